@@ -0,0 +1,48 @@
+"""Ingest manifests and watermarks
+
+Revision ID: 003
+Revises: 002
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '003'
+down_revision = '002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'ingest_manifests',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('source', sa.String(), nullable=False),
+        sa.Column('content_hash', sa.String(), nullable=False),
+        sa.Column('file_size', sa.BigInteger(), nullable=False),
+        sa.Column('rows', sa.BigInteger(), nullable=False),
+        sa.Column('ingested_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('source')
+    )
+    op.create_index(op.f('ix_ingest_manifests_id'), 'ingest_manifests', ['id'], unique=False)
+
+    op.create_table(
+        'ingest_watermarks',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('source', sa.String(), nullable=False),
+        sa.Column('season', sa.String(), nullable=False),
+        sa.Column('max_date', sa.Date(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('source', 'season', name='uq_ingest_watermarks_source_season')
+    )
+    op.create_index(op.f('ix_ingest_watermarks_id'), 'ingest_watermarks', ['id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_ingest_watermarks_id'), table_name='ingest_watermarks')
+    op.drop_table('ingest_watermarks')
+    op.drop_index(op.f('ix_ingest_manifests_id'), table_name='ingest_manifests')
+    op.drop_table('ingest_manifests')
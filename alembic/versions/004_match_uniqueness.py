@@ -0,0 +1,62 @@
+"""Unique match key and index cleanup
+
+Removes duplicate matches, enforces uniqueness of (date, home_team_id,
+away_team_id), drops indexes that duplicate the primary key or each other and
+adds team+date composite indexes for form and feature lookups.
+
+Revision ID: 004
+Revises: 003
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '004'
+down_revision = '003'
+branch_labels = None
+depends_on = None
+
+
+REDUNDANT_INDEXES = [
+    ('ix_matches_id', ['id']),
+    ('ix_matches_date', ['date']),
+    ('ix_matches_season', ['season']),
+    ('ix_matches_home_team_id', ['home_team_id']),
+    ('ix_matches_away_team_id', ['away_team_id']),
+    ('idx_matches_home_team', ['home_team_id']),
+    ('idx_matches_away_team', ['away_team_id']),
+]
+
+
+def upgrade() -> None:
+    # Keep the first stored copy of every duplicated match
+    op.execute(
+        """
+        DELETE FROM matches
+        WHERE id NOT IN (
+            SELECT MIN(id) FROM matches GROUP BY date, home_team_id, away_team_id
+        )
+        """
+    )
+
+    for name, _ in REDUNDANT_INDEXES:
+        op.drop_index(name, table_name='matches')
+
+    with op.batch_alter_table('matches') as batch_op:
+        batch_op.create_unique_constraint('uq_matches_date_home_away', ['date', 'home_team_id', 'away_team_id'])
+
+    op.create_index('idx_matches_home_team_date', 'matches', ['home_team_id', 'date'], unique=False)
+    op.create_index('idx_matches_away_team_date', 'matches', ['away_team_id', 'date'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('idx_matches_away_team_date', table_name='matches')
+    op.drop_index('idx_matches_home_team_date', table_name='matches')
+
+    with op.batch_alter_table('matches') as batch_op:
+        batch_op.drop_constraint('uq_matches_date_home_away', type_='unique')
+
+    for name, columns in reversed(REDUNDANT_INDEXES):
+        op.create_index(name, 'matches', columns, unique=False)
@@ -0,0 +1,39 @@
+"""Materialized match features
+
+Revision ID: 005
+Revises: 004
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '005'
+down_revision = '004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'match_features',
+        sa.Column('match_id', sa.Integer(), nullable=False),
+        sa.Column('schema_version', sa.Integer(), nullable=False),
+        sa.Column('home_team_points_last5', sa.Float(), nullable=False),
+        sa.Column('away_team_points_last5', sa.Float(), nullable=False),
+        sa.Column('home_goal_diff_last5', sa.Float(), nullable=False),
+        sa.Column('away_goal_diff_last5', sa.Float(), nullable=False),
+        sa.Column('head_to_head_points_last3', sa.Float(), nullable=False),
+        sa.Column('home_advantage', sa.Float(), nullable=False),
+        sa.Column('outcome', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.ForeignKeyConstraint(['match_id'], ['matches.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('match_id')
+    )
+    op.create_index(op.f('ix_match_features_schema_version'), 'match_features', ['schema_version'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_match_features_schema_version'), table_name='match_features')
+    op.drop_table('match_features')
@@ -0,0 +1,26 @@
+"""Model run activation
+
+Revision ID: 006
+Revises: 005
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '006'
+down_revision = '005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('model_runs', sa.Column('activated_at', sa.DateTime(), nullable=True))
+    # Until now the latest run was served; keep that behavior for existing runs
+    op.execute("UPDATE model_runs SET activated_at = created_at")
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('model_runs') as batch_op:
+        batch_op.drop_column('activated_at')
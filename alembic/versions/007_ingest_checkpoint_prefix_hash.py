@@ -0,0 +1,25 @@
+"""Ingest checkpoint prefix hash
+
+Revision ID: 007
+Revises: 006
+Create Date: 2026-10-17 00:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = '007'
+down_revision = '006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Existing checkpoints have no hash and restart from the beginning of their file
+    op.add_column('ingest_checkpoints', sa.Column('prefix_hash', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('ingest_checkpoints') as batch_op:
+        batch_op.drop_column('prefix_hash')
@@ -0,0 +1,80 @@
+"""
+Model artifacts on disk.
+
+Every model is pickled to MODELS_DIR/model_*.pkl. Multinomial linear models
+also get model_*.npz next to it with their coefficients, intercepts,
+classes and feature names. The API serves those with LinearSoftmaxModel, a
+NumPy-only predict_proba, so loading them needs neither sklearn nor
+unpickling; the pickle is still used for incremental training and for
+every other estimator.
+"""
+import os
+import pickle
+from typing import Optional
+
+import numpy as np
+
+from backend.features import FEATURE_NAMES
+
+
+class LinearSoftmaxModel:
+    """predict_proba of a multinomial logistic regression from its exported parameters"""
+
+    def __init__(self, coef: np.ndarray, intercept: np.ndarray, classes: np.ndarray, feature_names: list):
+        self.coef_ = coef
+        self.intercept_ = intercept
+        self.classes_ = classes
+        self.feature_names = feature_names
+
+    def decision_function(self, X: np.ndarray) -> np.ndarray:
+        return np.asarray(X, dtype=float) @ self.coef_.T + self.intercept_
+
+    def predict_proba(self, X: np.ndarray) -> np.ndarray:
+        scores = self.decision_function(X)
+        if scores.shape[1] == 1:
+            # Two classes are stored as one row of coefficients, like sklearn
+            scores = np.hstack([-scores, scores])
+        scores -= scores.max(axis=1, keepdims=True)
+        np.exp(scores, out=scores)
+        scores /= scores.sum(axis=1, keepdims=True)
+        return scores
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        return self.classes_[self.predict_proba(X).argmax(axis=1)]
+
+
+def linear_artifact_path(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + ".npz"
+
+
+def export_linear(model, model_path: str) -> Optional[str]:
+    """Write the .npz artifact of a fitted multinomial linear model; other models are skipped (None)"""
+    if not hasattr(model, "coef_") or getattr(model, "multi_class", None) != "multinomial":
+        return None
+    path = linear_artifact_path(model_path)
+    tmp = f"{path}.tmp.npz"
+    np.savez(
+        tmp,
+        coef=model.coef_,
+        intercept=model.intercept_,
+        classes=model.classes_,
+        feature_names=np.array(FEATURE_NAMES)
+    )
+    os.replace(tmp, path)
+    return path
+
+
+def load_model(model_path: str):
+    """
+    The model to serve from model_path: the NumPy model when a linear
+    artifact for the current features exists, otherwise the unpickled model.
+    Raises FileNotFoundError if neither file exists.
+    """
+    path = linear_artifact_path(model_path)
+    if os.path.exists(path):
+        with np.load(path) as data:
+            feature_names = data["feature_names"].tolist()
+            if feature_names == FEATURE_NAMES:
+                return LinearSoftmaxModel(data["coef"], data["intercept"], data["classes"], feature_names)
+    with open(model_path, 'rb') as f:
+        return pickle.load(f)
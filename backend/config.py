@@ -1,3 +1,5 @@
+from typing import Literal, Optional
+
 from pydantic_settings import BaseSettings
 
 
@@ -5,6 +7,33 @@ class Settings(BaseSettings):
     database_url: str = "postgresql://matchmind:matchmind@db:5432/matchmind"
     api_host: str = "0.0.0.0"
     api_port: int = 8000
+    ingest_chunk_size: int = 50000
+    ingest_workers: int = 2
+    # Processes for fitting; defaults to one per CPU so backtest folds run in parallel
+    train_workers: Optional[int] = None
+    # Threads per xgboost fit (None: all cores)
+    estimator_n_jobs: Optional[int] = None
+    # Memory-mapped training data snapshots, one directory per data version
+    dataset_cache_dir: str = "/app/cache/datasets"
+    feature_index_ttl_seconds: float = 30.0
+    # Predictions for every team pair, rebuilt after training and ingestion and reloaded at startup
+    pair_matrix_path: str = "/app/cache/pair_matrix.npz"
+    # How often /predict checks whether another model run was activated
+    registry_ttl_seconds: float = 5.0
+    # /predict result cache; entries are also dropped when the model run or match data change
+    prediction_cache_size: int = 10000
+    prediction_cache_ttl_seconds: float = 300.0
+    # Prediction rows: "sync" commits in the request, "async" queues them for a background bulk writer
+    prediction_log_mode: Literal["sync", "async"] = "async"
+    prediction_log_batch_size: int = 500
+    prediction_log_flush_seconds: float = 1.0
+    prediction_log_max_queue: int = 50000
+    prediction_log_put_timeout_seconds: float = 0.5
+    # /simulate/season: seasons per vectorized chunk and threads running chunks (None: one per CPU)
+    simulation_chunk_size: int = 10000
+    simulation_workers: Optional[int] = None
+    # How /predict computes features: in-memory index, SQL window functions, or Python over all matches
+    feature_backend: Literal["index", "sql", "python"] = "index"
 
     class Config:
         env_file = ".env"
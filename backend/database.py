@@ -17,3 +17,7 @@ def get_db():
     finally:
         db.close()
 
+
+def get_session_factory():
+    """Session factory for work that outlives the request, e.g. background jobs"""
+    return SessionLocal
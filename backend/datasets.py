@@ -0,0 +1,95 @@
+"""
+Training data snapshots on disk.
+
+The training matrix, labels, match ids and seasons are saved as .npy files
+in a directory named after the data version (match count, max match id and
+feature schema version). Training runs load them memory-mapped, so repeated
+runs skip reading the feature store and pool workers given the snapshot
+path share the same pages instead of receiving pickled copies.
+"""
+import hashlib
+import os
+import shutil
+import uuid
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from backend.config import settings
+from backend.features import FEATURE_SCHEMA_VERSION, load_training_set
+from backend.models import Match
+
+SNAPSHOT_ARRAYS = ("X", "y", "ids", "seasons")
+
+# Snapshots kept in DATASET_CACHE_DIR; older ones are removed after a new one is written
+SNAPSHOTS_KEPT = 3
+
+# Attempts at building a snapshot whose data version did not change while it was read
+BUILD_ATTEMPTS = 3
+
+
+def data_version(db: Session) -> str:
+    count, max_id = db.execute(select(func.count(Match.id), func.max(Match.id))).one()
+    return hashlib.sha1(f"{count}:{max_id}:{FEATURE_SCHEMA_VERSION}".encode()).hexdigest()[:16]
+
+
+def load_snapshot(path: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """(X, y, match ids, seasons) of a snapshot, memory-mapped read-only"""
+    return tuple(np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r") for name in SNAPSHOT_ARRAYS)
+
+
+def _write_snapshot(path: str, X: np.ndarray, y: np.ndarray, kept: pd.DataFrame):
+    """Write into a temporary directory and rename it into place, so readers never see a partial snapshot"""
+    tmp = f"{path}.tmp-{uuid.uuid4().hex}"
+    os.makedirs(tmp)
+    arrays = {
+        "X": np.ascontiguousarray(X, dtype=float),
+        "y": np.asarray(y, dtype=np.int64),
+        "ids": kept["id"].to_numpy(np.int64),
+        "seasons": kept["season"].to_numpy(str),
+    }
+    for name in SNAPSHOT_ARRAYS:
+        np.save(os.path.join(tmp, f"{name}.npy"), arrays[name])
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # Another run wrote the same snapshot first
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _prune(keep: str):
+    root = settings.dataset_cache_dir
+    snapshots = sorted(
+        (entry for entry in os.scandir(root) if entry.is_dir() and entry.path != keep and ".tmp-" not in entry.name),
+        key=lambda entry: entry.stat().st_mtime,
+        reverse=True
+    )
+    for entry in snapshots[SNAPSHOTS_KEPT - 1:]:
+        shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def training_snapshot(db: Session) -> str:
+    """
+    Path of the snapshot for the current data, building it from the feature
+    store if there is none. If matches keep changing while the data is read,
+    the last attempt is written under a one-off name so it is never mistaken
+    for the cached data of a version.
+    """
+    os.makedirs(settings.dataset_cache_dir, exist_ok=True)
+    for attempt in range(BUILD_ATTEMPTS):
+        version = data_version(db)
+        path = os.path.join(settings.dataset_cache_dir, version)
+        if os.path.isdir(path):
+            return path
+
+        X, y, kept = load_training_set(db)
+        if data_version(db) != version:
+            if attempt < BUILD_ATTEMPTS - 1:
+                continue
+            path = f"{path}-{uuid.uuid4().hex[:8]}"
+        _write_snapshot(path, X, y, kept)
+        _prune(keep=path)
+        return path
@@ -0,0 +1,141 @@
+"""
+Estimators /train can fit, by name.
+
+Every factory returns an unfitted sklearn-compatible classifier for the
+three outcome classes. sklearn and xgboost are imported only when they are
+used. SEARCH_SPACES lists the hyperparameters /train/search tries per
+estimator. Explanations of predictions work for any of them.
+"""
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+from backend.config import settings
+from backend.features import FEATURE_NAMES
+
+DEFAULT_ESTIMATOR = "logistic"
+
+
+def make_logistic():
+    from sklearn.linear_model import LogisticRegression
+
+    return LogisticRegression(multi_class='multinomial', max_iter=1000, random_state=42)
+
+
+def make_xgboost():
+    from xgboost import XGBClassifier
+
+    return XGBClassifier(
+        objective="multi:softprob",
+        tree_method="hist",
+        n_estimators=200,
+        max_depth=4,
+        learning_rate=0.1,
+        n_jobs=settings.estimator_n_jobs,
+        random_state=42
+    )
+
+
+def make_sgd():
+    from sklearn.linear_model import SGDClassifier
+
+    # Logistic loss fitted by SGD, the estimator incremental runs can update with partial_fit.
+    # Averaged coefficients keep an update on a few new matches close to what all history gave.
+    return SGDClassifier(loss="log_loss", alpha=1e-4, learning_rate="adaptive", eta0=0.01, average=True,
+                         random_state=42)
+
+
+def make_hist_gb():
+    from sklearn.ensemble import HistGradientBoostingClassifier
+
+    return HistGradientBoostingClassifier(max_iter=200, learning_rate=0.1, random_state=42)
+
+
+ESTIMATORS: Dict[str, Callable] = {
+    "logistic": make_logistic,
+    "xgboost": make_xgboost,
+    "hist_gb": make_hist_gb,
+    "sgd": make_sgd,
+}
+
+
+SEARCH_SPACES: Dict[str, Dict[str, list]] = {
+    "logistic": {
+        "C": [0.001, 0.01, 0.1, 1.0, 10.0, 100.0],
+    },
+    "xgboost": {
+        "max_depth": [2, 3, 4, 6],
+        "learning_rate": [0.03, 0.1, 0.3],
+        "n_estimators": [100, 300],
+    },
+    "hist_gb": {
+        "max_depth": [2, 3, 5, None],
+        "learning_rate": [0.03, 0.1, 0.3],
+        "l2_regularization": [0.0, 1.0],
+    },
+    "sgd": {
+        "alpha": [1e-5, 1e-4, 1e-3, 1e-2],
+        "eta0": [0.001, 0.01, 0.1],
+    },
+}
+
+
+def make_estimator(name: str = DEFAULT_ESTIMATOR, params: Optional[dict] = None):
+    if name not in ESTIMATORS:
+        raise ValueError(f"Unknown estimator: {name}")
+    model = ESTIMATORS[name]()
+    if params:
+        model.set_params(**params)
+    return model
+
+
+def estimator_name(model) -> str:
+    """Registry name of a fitted model, from its class"""
+    return {
+        "LogisticRegression": "logistic",
+        "XGBClassifier": "xgboost",
+        "HistGradientBoostingClassifier": "hist_gb",
+        "SGDClassifier": "sgd",
+    }.get(type(model).__name__, type(model).__name__)
+
+
+def supports_update(model) -> bool:
+    """Whether a fitted model can be trained further on new samples only (partial_fit)"""
+    return hasattr(model, "partial_fit")
+
+
+def feature_contributions(model, features: np.ndarray, probabilities: np.ndarray) -> np.ndarray:
+    """
+    Contribution of each feature to each prediction (rows of features and
+    probabilities). Linear models use coefficient * feature value averaged
+    across classes; other models use the drop in the predicted class's
+    probability when the feature is zeroed, scored in one predict_proba call.
+    """
+    if hasattr(model, "coef_"):
+        return features * model.coef_.mean(axis=0)
+
+    n, k = features.shape
+    occluded = np.repeat(features, k, axis=0).astype(float)
+    occluded[np.arange(n * k), np.tile(np.arange(k), n)] = 0
+    occluded_proba = model.predict_proba(occluded).reshape(n, k, -1)
+    rows, predicted = np.arange(n), probabilities.argmax(axis=1)
+    return probabilities[rows, predicted][:, None] - occluded_proba[rows, :, predicted]
+
+
+def build_explanation(features: np.ndarray, contributions: np.ndarray) -> dict:
+    """Explanation of one prediction from its feature row and contributions"""
+    explanations = {}
+    for i, feature_name in enumerate(FEATURE_NAMES):
+        explanations[feature_name] = {
+            "value": float(features[i]),
+            "contribution": float(contributions[i])
+        }
+
+    return {
+        "feature_contributions": explanations,
+        "top_features": sorted(
+            explanations.items(),
+            key=lambda x: abs(x[1]["contribution"]),
+            reverse=True
+        )[:3]
+    }
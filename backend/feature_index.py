@@ -0,0 +1,178 @@
+"""
+Process-resident index of recent results for /predict.
+
+Keeps the last FORM_WINDOW results of every team and the last H2H_WINDOW
+results of every team pair in memory, so the features of a prediction are
+computed from a handful of entries with no database query. The index is
+built once from the matches table, extended with matches committed by
+ingest in this process, and revalidated against the table (match count and
+max id) at most every FEATURE_INDEX_TTL_SECONDS to pick up writes from other
+processes.
+"""
+import bisect
+import threading
+import time
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import event, func, select
+from sqlalchemy.orm import Session
+
+from backend.config import settings
+from backend.features import FORM_WINDOW, H2H_WINDOW, load_matches_frame
+from backend.models import Match
+
+# Session.info key under which ingest stages inserted matches until commit
+PENDING_MATCHES_KEY = "feature_index_pending_matches"
+
+
+def _points(goals_for, goals_against):
+    return np.where(goals_for > goals_against, 3, np.where(goals_for == goals_against, 1, 0))
+
+
+class TeamFormIndex:
+    """Bounded, date-ordered recent results per team and per team pair"""
+
+    def __init__(self, form_window: int = FORM_WINDOW, h2h_window: int = H2H_WINDOW):
+        self.form_window = form_window
+        self.h2h_window = h2h_window
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # team_id -> [(date, match_id, points, goal_diff)], oldest first
+            self._teams: Dict[int, List[tuple]] = {}
+            # (lower team id, higher team id) -> [(date, match_id, points_lower, points_higher)]
+            self._pairs: Dict[Tuple[int, int], List[tuple]] = {}
+            self.loaded = False
+            self.match_count = 0
+            self.max_match_id = None
+            self.checked_at = 0.0
+            self.version = 0
+
+    def load(self, db: Session):
+        """Rebuild the index from the matches table with one query"""
+        matches = load_matches_frame(db)
+        hg, ag = matches["home_goals"].to_numpy(), matches["away_goals"].to_numpy()
+        home, away = matches["home_team_id"].to_numpy(), matches["away_team_id"].to_numpy()
+
+        form = pd.concat([
+            pd.DataFrame({"team": home, "date": matches["date"], "id": matches["id"],
+                          "points": _points(hg, ag), "goal_diff": hg - ag}),
+            pd.DataFrame({"team": away, "date": matches["date"], "id": matches["id"],
+                          "points": _points(ag, hg), "goal_diff": ag - hg}),
+        ]).sort_values(["team", "date", "id"]).groupby("team").tail(self.form_window)
+
+        home_is_lo = home <= away
+        pts_home, pts_away = _points(hg, ag), _points(ag, hg)
+        h2h = pd.DataFrame({
+            "lo": np.minimum(home, away), "hi": np.maximum(home, away),
+            "date": matches["date"], "id": matches["id"],
+            "points_lo": np.where(home_is_lo, pts_home, pts_away),
+            "points_hi": np.where(home_is_lo, pts_away, pts_home),
+        }).sort_values(["lo", "hi", "date", "id"]).groupby(["lo", "hi"]).tail(self.h2h_window)
+
+        teams = {
+            int(team): list(zip(group["date"], group["id"], group["points"], group["goal_diff"]))
+            for team, group in form.groupby("team")
+        }
+        pairs = {
+            (int(lo), int(hi)): list(zip(group["date"], group["id"], group["points_lo"], group["points_hi"]))
+            for (lo, hi), group in h2h.groupby(["lo", "hi"])
+        }
+
+        with self._lock:
+            self._teams, self._pairs = teams, pairs
+            self.match_count = len(matches)
+            self.max_match_id = int(matches["id"].max()) if len(matches) else None
+            self.loaded = True
+            self.checked_at = time.monotonic()
+            self.version += 1
+
+    def ensure_current(self, db: Session):
+        """Load on first use; afterwards compare against the table at most every TTL seconds"""
+        if self.loaded and time.monotonic() - self.checked_at < settings.feature_index_ttl_seconds:
+            return
+        count, max_id = db.execute(select(func.count(Match.id), func.max(Match.id))).one()
+        with self._lock:
+            current = self.loaded and (count, max_id) == (self.match_count, self.max_match_id)
+            self.checked_at = time.monotonic()
+        if not current:
+            self.load(db)
+
+    def add_matches(self, matches: pd.DataFrame):
+        """Insert newly committed matches (id, date, team ids, goals) in date order"""
+        with self._lock:
+            if not self.loaded:
+                return
+            for m in matches.itertuples(index=False):
+                home, away = int(m.home_team_id), int(m.away_team_id)
+                self._insert(self._teams.setdefault(home, []), self.form_window,
+                             (m.date, m.id, int(_points(m.home_goals, m.away_goals)), m.home_goals - m.away_goals))
+                self._insert(self._teams.setdefault(away, []), self.form_window,
+                             (m.date, m.id, int(_points(m.away_goals, m.home_goals)), m.away_goals - m.home_goals))
+
+                pts_home, pts_away = int(_points(m.home_goals, m.away_goals)), int(_points(m.away_goals, m.home_goals))
+                lo, hi = min(home, away), max(home, away)
+                entry = (m.date, m.id, pts_home, pts_away) if home == lo else (m.date, m.id, pts_away, pts_home)
+                self._insert(self._pairs.setdefault((lo, hi), []), self.h2h_window, entry)
+
+            self.match_count += len(matches)
+            if len(matches):
+                self.max_match_id = max(self.max_match_id or 0, int(matches["id"].max()))
+            self.version += 1
+
+    @staticmethod
+    def _insert(entries: List[tuple], window: int, entry: tuple):
+        bisect.insort(entries, entry)
+        del entries[:-window]
+
+    def lookup(self, home_team_id: int, away_team_id: int, match_date: date) -> Optional[np.ndarray]:
+        """
+        Features for a fixture from the index, shaped like compute_features.
+        Returns None when the index cannot answer exactly (a team has stored
+        matches on or after match_date), so the caller falls back to the DB.
+        """
+        lo, hi = min(home_team_id, away_team_id), max(home_team_id, away_team_id)
+        with self._lock:
+            home = self._teams.get(home_team_id, [])
+            away = self._teams.get(away_team_id, [])
+            pair = self._pairs.get((lo, hi), [])
+            if any(entries and entries[-1][0] >= match_date for entries in (home, away, pair)):
+                return None
+
+            h2h_column = 2 if home_team_id == lo else 3
+            return np.array([[
+                sum(e[2] for e in home),
+                sum(e[2] for e in away),
+                sum(e[3] for e in home),
+                sum(e[3] for e in away),
+                sum(e[h2h_column] for e in pair),
+                1
+            ]])
+
+
+team_form_index = TeamFormIndex()
+
+
+def stage_new_matches(db: Session, matches: pd.DataFrame):
+    """Remember matches inserted in this session; they reach the index only if the session commits"""
+    if not matches.empty:
+        db.info.setdefault(PENDING_MATCHES_KEY, []).append(
+            matches[["id", "date", "home_team_id", "away_team_id", "home_goals", "away_goals"]]
+        )
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_committed_matches(session: Session):
+    pending = session.info.pop(PENDING_MATCHES_KEY, None)
+    if pending:
+        team_form_index.add_matches(pd.concat(pending, ignore_index=True))
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _discard_rolled_back_matches(session: Session, previous_transaction):
+    session.info.pop(PENDING_MATCHES_KEY, None)
@@ -0,0 +1,331 @@
+"""
+Vectorized match features and the materialized feature store.
+
+Computes the same values as `compute_features` in backend/routers/ml.py for
+many fixtures at once: every team's results are laid out in one array sorted
+by (team, date), so "last N results before a date" becomes a binary search
+plus a difference of prefix sums instead of a scan over all past matches.
+
+Features of stored matches are kept in the match_features table, refreshed
+for the affected teams whenever matches are ingested. `compute_features_sql`
+computes the features of a single fixture inside the database instead.
+"""
+from datetime import date
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import and_, case, delete, func, insert, or_, select, union_all
+from sqlalchemy.orm import Session
+
+from backend.models import Match, MatchFeature
+
+FEATURE_NAMES = [
+    "home_team_points_last5",
+    "away_team_points_last5",
+    "home_goal_diff_last5",
+    "away_goal_diff_last5",
+    "head_to_head_points_last3",
+    "home_advantage"
+]
+
+# Bump when the feature definitions change; stored rows of other versions are rebuilt
+FEATURE_SCHEMA_VERSION = 1
+
+FORM_WINDOW = 5
+H2H_WINDOW = 3
+
+# Dates are packed into the low bits of a sort key next to a team or pair code
+_DATE_BITS = 20
+
+MATCH_FRAME_COLUMNS = ["id", "date", "season", "home_team_id", "away_team_id", "home_goals", "away_goals"]
+
+
+def load_matches_frame(db: Session, team_ids: Optional[Iterable[int]] = None) -> pd.DataFrame:
+    """All matches (or those involving team_ids) as a frame in chronological order, loaded with one query"""
+    query = select(
+        Match.id, Match.date, Match.season, Match.home_team_id,
+        Match.away_team_id, Match.home_goals, Match.away_goals
+    ).order_by(Match.date, Match.id)
+    if team_ids is not None:
+        team_ids = list(team_ids)
+        query = query.where(or_(Match.home_team_id.in_(team_ids), Match.away_team_id.in_(team_ids)))
+    return pd.DataFrame(db.execute(query).all(), columns=MATCH_FRAME_COLUMNS)
+
+
+def match_outcomes(home_goals: np.ndarray, away_goals: np.ndarray) -> np.ndarray:
+    """Outcome classes: 0=home win, 1=draw, 2=away win"""
+    return np.where(home_goals > away_goals, 0, np.where(home_goals == away_goals, 1, 2))
+
+
+def _points(goals_for: np.ndarray, goals_against: np.ndarray) -> np.ndarray:
+    return np.where(goals_for > goals_against, 3, np.where(goals_for == goals_against, 1, 0))
+
+
+def _days(dates) -> np.ndarray:
+    return pd.to_datetime(pd.Series(dates)).to_numpy().astype("datetime64[D]").astype(np.int64)
+
+
+class _WindowSums:
+    """
+    Sums of the last `window` values per group strictly before a date.
+    Entries are sorted by (group, date); queries are answered with
+    searchsorted on the packed key and prefix-sum differences.
+    """
+
+    def __init__(self, groups: np.ndarray, days: np.ndarray, values: np.ndarray, window: int):
+        keys = (groups.astype(np.int64) << _DATE_BITS) + days
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.window = window
+        self.prefix = np.zeros((len(order) + 1, values.shape[1]), dtype=np.int64)
+        np.cumsum(values[order], axis=0, out=self.prefix[1:])
+
+    def query(self, groups: np.ndarray, days: np.ndarray) -> np.ndarray:
+        groups = groups.astype(np.int64)
+        end = np.searchsorted(self.keys, (groups << _DATE_BITS) + days, side="left")
+        group_start = np.searchsorted(self.keys, groups << _DATE_BITS, side="left")
+        start = np.maximum(group_start, end - self.window)
+        return self.prefix[end] - self.prefix[start]
+
+
+def build_features(history: pd.DataFrame, fixtures: pd.DataFrame) -> np.ndarray:
+    """
+    Feature matrix (one row per fixture, columns as FEATURE_NAMES) for fixtures
+    with home_team_id, away_team_id and date columns, using only history
+    matches dated strictly before each fixture's date.
+    """
+    n = len(fixtures)
+    features = np.zeros((n, len(FEATURE_NAMES)))
+    features[:, 5] = 1  # home advantage
+    if n == 0 or history.empty:
+        return features
+
+    h_home = history["home_team_id"].to_numpy(np.int64)
+    h_away = history["away_team_id"].to_numpy(np.int64)
+    h_hg = history["home_goals"].to_numpy(np.int64)
+    h_ag = history["away_goals"].to_numpy(np.int64)
+    f_home = fixtures["home_team_id"].to_numpy(np.int64)
+    f_away = fixtures["away_team_id"].to_numpy(np.int64)
+
+    h_days = _days(history["date"])
+    f_days = _days(fixtures["date"])
+    origin = min(h_days.min(), f_days.min()) - 1
+    h_days = h_days - origin
+    f_days = f_days - origin
+
+    # Team form: one entry per team per match, (points, goal difference) from that team's side
+    form = _WindowSums(
+        groups=np.concatenate([h_home, h_away]),
+        days=np.concatenate([h_days, h_days]),
+        values=np.column_stack([
+            np.concatenate([_points(h_hg, h_ag), _points(h_ag, h_hg)]),
+            np.concatenate([h_hg - h_ag, h_ag - h_hg]),
+        ]),
+        window=FORM_WINDOW,
+    )
+    home_form = form.query(f_home, f_days)
+    away_form = form.query(f_away, f_days)
+    features[:, 0] = home_form[:, 0]
+    features[:, 1] = away_form[:, 0]
+    features[:, 2] = home_form[:, 1]
+    features[:, 3] = away_form[:, 1]
+
+    # Head to head: group by unordered pair, keep points for both the lower and higher team id
+    team_span = int(max(h_home.max(), h_away.max(), f_home.max(), f_away.max())) + 1
+    h_lo, h_hi = np.minimum(h_home, h_away), np.maximum(h_home, h_away)
+    h_pairs, h_codes = np.unique(h_lo * team_span + h_hi, return_inverse=True)
+    home_is_lo = h_home == h_lo
+    pts_home, pts_away = _points(h_hg, h_ag), _points(h_ag, h_hg)
+    h2h = _WindowSums(
+        groups=h_codes,
+        days=h_days,
+        values=np.column_stack([
+            np.where(home_is_lo, pts_home, pts_away),
+            np.where(home_is_lo, pts_away, pts_home),
+        ]),
+        window=H2H_WINDOW,
+    )
+
+    f_lo, f_hi = np.minimum(f_home, f_away), np.maximum(f_home, f_away)
+    f_pair = f_lo * team_span + f_hi
+    f_codes = np.clip(np.searchsorted(h_pairs, f_pair), 0, len(h_pairs) - 1)
+    known = h_pairs[f_codes] == f_pair
+    if known.any():
+        sums = h2h.query(f_codes[known], f_days[known])
+        features[known, 4] = np.where(f_home[known] == f_lo[known], sums[:, 0], sums[:, 1])
+
+    return features
+
+
+def build_training_set(matches: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, pd.DataFrame]:
+    """
+    Features and outcome labels for every match, each computed from the
+    matches before it, in one pass. Matches where neither team has any form
+    yet are left out, as in the original per-match loop.
+    Returns (X, y, the matches kept).
+    """
+    X = build_features(matches, matches)
+    has_history = np.any(X[:, :4] != 0, axis=1)
+    kept = matches[has_history]
+    y = match_outcomes(kept["home_goals"].to_numpy(), kept["away_goals"].to_numpy())
+    return X[has_history], y, kept
+
+
+def _feature_records(matches: pd.DataFrame, X: np.ndarray) -> List[dict]:
+    outcomes = match_outcomes(matches["home_goals"].to_numpy(), matches["away_goals"].to_numpy())
+    records = pd.DataFrame(X, columns=FEATURE_NAMES)
+    records["match_id"] = matches["id"].to_numpy()
+    records["outcome"] = outcomes
+    records["schema_version"] = FEATURE_SCHEMA_VERSION
+    return records.to_dict(orient="records")
+
+
+def rebuild_match_features(db: Session) -> int:
+    """Recompute the whole feature store. Does not commit. Returns rows written."""
+    matches = load_matches_frame(db)
+    db.execute(delete(MatchFeature))
+    if matches.empty:
+        return 0
+    db.execute(insert(MatchFeature), _feature_records(matches, build_features(matches, matches)))
+    return len(matches)
+
+
+def refresh_match_features(db: Session, new_matches: pd.DataFrame) -> int:
+    """
+    Update stored features after matches were inserted. Only matches of the
+    teams involved, on or after each team's earliest new match, can change;
+    those are recomputed from the histories of both teams of each such
+    match. Does not commit.
+    Returns rows written.
+    """
+    if new_matches.empty:
+        return 0
+
+    first_new = pd.concat([
+        pd.DataFrame({"team": new_matches["home_team_id"], "date": new_matches["date"]}),
+        pd.DataFrame({"team": new_matches["away_team_id"], "date": new_matches["date"]}),
+    ])
+    first_new = pd.to_datetime(first_new["date"]).groupby(first_new["team"].to_numpy()).min()
+
+    history = load_matches_frame(db, team_ids=first_new.index.tolist())
+    dates = pd.to_datetime(history["date"])
+    affected = history[
+        (dates >= history["home_team_id"].map(first_new)).to_numpy()
+        | (dates >= history["away_team_id"].map(first_new)).to_numpy()
+    ]
+    if affected.empty:
+        return 0
+
+    # Affected matches also need the history of opponents outside the new batch
+    opponents = set(affected["home_team_id"]) | set(affected["away_team_id"])
+    if not opponents <= set(first_new.index):
+        history = load_matches_frame(db, team_ids=opponents)
+
+    ids = affected["id"].tolist()
+    for start in range(0, len(ids), 5000):
+        db.execute(delete(MatchFeature).where(MatchFeature.match_id.in_(ids[start:start + 5000])))
+    db.execute(insert(MatchFeature), _feature_records(affected, build_features(history, affected)))
+    return len(affected)
+
+
+def _sql_points(goals_for, goals_against):
+    return case((goals_for > goals_against, 3), (goals_for == goals_against, 1), else_=0)
+
+
+def compute_features_sql(home_team_id: int, away_team_id: int, match_date: date, db: Session) -> np.ndarray:
+    """
+    Same result as compute_features, computed by the database: the last
+    FORM_WINDOW results per team are picked with ROW_NUMBER() over a union of
+    the home and away sides, and only the aggregated sums are returned.
+    Works on PostgreSQL and SQLite (3.25+).
+    """
+    teams = [home_team_id, away_team_id]
+    sides = union_all(
+        select(
+            Match.id, Match.date, Match.home_team_id.label("team_id"),
+            Match.home_goals.label("goals_for"), Match.away_goals.label("goals_against")
+        ).where(Match.date < match_date, Match.home_team_id.in_(teams)),
+        select(
+            Match.id, Match.date, Match.away_team_id.label("team_id"),
+            Match.away_goals.label("goals_for"), Match.home_goals.label("goals_against")
+        ).where(Match.date < match_date, Match.away_team_id.in_(teams)),
+    ).subquery("team_matches")
+
+    ranked = select(
+        sides.c.team_id, sides.c.goals_for, sides.c.goals_against,
+        func.row_number().over(
+            partition_by=sides.c.team_id,
+            order_by=(sides.c.date.desc(), sides.c.id.desc())
+        ).label("rn")
+    ).subquery("ranked")
+
+    form = dict.fromkeys(teams, (0, 0))
+    form.update({
+        row.team_id: (row.points, row.goal_diff)
+        for row in db.execute(
+            select(
+                ranked.c.team_id,
+                func.sum(_sql_points(ranked.c.goals_for, ranked.c.goals_against)).label("points"),
+                func.sum(ranked.c.goals_for - ranked.c.goals_against).label("goal_diff"),
+            ).where(ranked.c.rn <= FORM_WINDOW).group_by(ranked.c.team_id)
+        )
+    })
+
+    # Head to head: points of the home team over the pair's last H2H_WINDOW meetings
+    is_home = Match.home_team_id == home_team_id
+    last_meetings = select(
+        case((is_home, Match.home_goals), else_=Match.away_goals).label("goals_for"),
+        case((is_home, Match.away_goals), else_=Match.home_goals).label("goals_against"),
+    ).where(
+        Match.date < match_date,
+        or_(
+            and_(Match.home_team_id == home_team_id, Match.away_team_id == away_team_id),
+            and_(Match.home_team_id == away_team_id, Match.away_team_id == home_team_id),
+        )
+    ).order_by(Match.date.desc(), Match.id.desc()).limit(H2H_WINDOW).subquery("last_meetings")
+    h2h_points = db.execute(
+        select(func.coalesce(func.sum(_sql_points(last_meetings.c.goals_for, last_meetings.c.goals_against)), 0))
+    ).scalar()
+
+    return np.array([[
+        form[home_team_id][0],
+        form[away_team_id][0],
+        form[home_team_id][1],
+        form[away_team_id][1],
+        h2h_points,
+        1
+    ]])
+
+
+def is_feature_store_current(db: Session) -> bool:
+    """Whether every match has stored features of the current schema version"""
+    stored = db.execute(
+        select(func.count(MatchFeature.match_id)).where(MatchFeature.schema_version == FEATURE_SCHEMA_VERSION)
+    ).scalar()
+    return stored == db.execute(select(func.count(Match.id))).scalar()
+
+
+def load_training_set(db: Session) -> Tuple[np.ndarray, np.ndarray, pd.DataFrame]:
+    """
+    Training matrix read from the feature store with one query, rebuilding
+    (and committing) the store first if it is missing rows or outdated.
+    Same result as build_training_set on all matches.
+    """
+    if not is_feature_store_current(db):
+        rebuild_match_features(db)
+        db.commit()
+
+    feature_columns = [getattr(MatchFeature, name) for name in FEATURE_NAMES]
+    rows = db.execute(
+        select(*[getattr(Match, col) for col in MATCH_FRAME_COLUMNS], *feature_columns, MatchFeature.outcome)
+        .join(MatchFeature, MatchFeature.match_id == Match.id)
+        .where(MatchFeature.schema_version == FEATURE_SCHEMA_VERSION)
+        .order_by(Match.date, Match.id)
+    ).all()
+    frame = pd.DataFrame(rows, columns=MATCH_FRAME_COLUMNS + FEATURE_NAMES + ["outcome"])
+
+    X = frame[FEATURE_NAMES].to_numpy(dtype=float)
+    has_history = np.any(X[:, :4] != 0, axis=1)
+    kept = frame.loc[has_history, MATCH_FRAME_COLUMNS]
+    return X[has_history], frame["outcome"].to_numpy()[has_history], kept
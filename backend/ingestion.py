@@ -0,0 +1,584 @@
+"""
+Shared ingestion engine used by POST /ingest and scripts/ingest.py.
+
+Rows are parsed column-wise, teams are resolved with one query per batch and
+matches are inserted set-wise, so the cost of an ingest no longer scales with
+one round trip per CSV row.
+"""
+import glob
+import hashlib
+import io
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from backend.config import settings
+from backend.feature_index import stage_new_matches
+from backend.features import refresh_match_features
+from backend.models import Team, Match, IngestCheckpoint, IngestManifest, IngestWatermark
+
+REQUIRED_COLUMNS = ["date", "season", "home_team", "away_team", "home_goals", "away_goals"]
+
+MATCH_KEY = ["date", "home_team_id", "away_team_id"]
+
+MATCH_COLUMNS = ["date", "season", "home_team_id", "away_team_id", "home_goals", "away_goals"]
+
+# Read these as strings so CSV parsing does no per-value type inference on them
+CSV_DTYPES = {"season": str, "home_team": str, "away_team": str}
+
+SUPPORTED_EXTENSIONS = (".csv", ".csv.gz", ".csv.bz2", ".csv.xz", ".csv.zst", ".parquet", ".pq", ".feather", ".arrow", ".ipc")
+
+MAX_REJECTED_REPORTED = 100
+
+
+def missing_columns(df: pd.DataFrame) -> List[str]:
+    """Return the required columns that are absent from a frame"""
+    return [col for col in REQUIRED_COLUMNS if col not in df.columns]
+
+
+def _parse_dates(values: pd.Series) -> pd.Series:
+    """Vectorized date parsing; rows that fail the inferred format are retried individually"""
+    parsed = pd.to_datetime(values, errors="coerce")
+    retry = parsed.isna() & values.notna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(values[retry], errors="coerce", format="mixed")
+    return parsed.dt.date
+
+
+def validate_frame(df: pd.DataFrame, row_offset: int = 0) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Convert a raw input frame into typed match rows, column by column.
+    Returns (valid rows, rejected rows as a frame of row number and reason);
+    row numbers count data rows from 0, shifted by row_offset.
+    """
+    dates = _parse_dates(df["date"])
+    home_goals = pd.to_numeric(df["home_goals"], errors="coerce")
+    away_goals = pd.to_numeric(df["away_goals"], errors="coerce")
+
+    # Checked in order; a row is reported with the first reason that applies
+    checks = [
+        ("invalid date", dates.isna()),
+        ("missing team name", df["home_team"].isna() | df["away_team"].isna()),
+        ("invalid home_goals", home_goals.isna() | (home_goals % 1 != 0)),
+        ("invalid away_goals", away_goals.isna() | (away_goals % 1 != 0)),
+    ]
+    reasons = pd.Series(None, index=df.index, dtype=object)
+    for reason, failed in checks:
+        reasons = reasons.mask(reasons.isna() & failed.to_numpy(), reason)
+    rejected_mask = reasons.notna().to_numpy()
+
+    frame = pd.DataFrame({
+        "date": dates,
+        "season": df["season"].astype(str),
+        "home_team": df["home_team"].astype(str),
+        "away_team": df["away_team"].astype(str),
+        "home_goals": home_goals,
+        "away_goals": away_goals,
+    })[~rejected_mask]
+    frame["home_goals"] = frame["home_goals"].astype(int)
+    frame["away_goals"] = frame["away_goals"].astype(int)
+
+    rejected = pd.DataFrame({
+        "row": (pd.RangeIndex(len(df)) + row_offset)[rejected_mask],
+        "reason": reasons[rejected_mask].to_numpy(),
+    })
+    return frame.reset_index(drop=True), rejected
+
+
+def normalize_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Typed match rows of a raw input frame; invalid rows are dropped"""
+    return validate_frame(df)[0]
+
+
+def rejected_report(rejected: pd.DataFrame) -> List[dict]:
+    """First rejected rows, capped so responses stay small"""
+    return rejected.head(MAX_REJECTED_REPORTED).to_dict(orient="records")
+
+
+def merge_counts(totals: Dict, counts: Dict) -> Dict:
+    """Accumulate per-batch results: numbers are summed, rejected reports concatenated up to the cap"""
+    for key, value in counts.items():
+        if isinstance(value, list):
+            totals[key] = (totals.get(key, []) + value)[:MAX_REJECTED_REPORTED]
+        else:
+            totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def input_format(path: str) -> str:
+    """Classify an input file by extension: 'parquet', 'arrow' or 'csv' (possibly compressed)"""
+    name = path.lower()
+    if name.endswith((".parquet", ".pq")):
+        return "parquet"
+    if name.endswith((".feather", ".arrow", ".ipc")):
+        return "arrow"
+    return "csv"
+
+
+def read_frame(path: str) -> pd.DataFrame:
+    """
+    Read an input file with typed columns. Parquet and Arrow IPC/Feather read
+    only the required columns; CSV may be gzip/bz2/xz/zstd compressed
+    (inferred from the extension). Raises FileNotFoundError, or ValueError if
+    required columns are missing.
+    """
+    fmt = input_format(path)
+    if fmt == "csv":
+        df = pd.read_csv(path, dtype=CSV_DTYPES, compression="infer")
+    else:
+        import pyarrow.parquet as pq
+        import pyarrow.feather as feather
+
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        table = pq.read_table(path) if fmt == "parquet" else feather.read_table(path)
+        df = table.select([col for col in REQUIRED_COLUMNS if col in table.column_names]).to_pandas()
+
+    if missing_columns(df):
+        raise ValueError(f"CSV must contain columns: {', '.join(REQUIRED_COLUMNS)}")
+    return df
+
+
+def _dialect_insert(db: Session):
+    """The session dialect's insert construct, which supports ON CONFLICT DO NOTHING"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        raise NotImplementedError(f"Ingest does not support the {dialect} dialect")
+    return dialect_insert
+
+
+def resolve_teams(names: Iterable[str], db: Session) -> tuple:
+    """
+    Map team names to ids, bulk-inserting the names that do not exist yet.
+    A name inserted by a concurrent ingest in the meantime is left to the
+    unique name constraint and selected afterwards.
+    Returns (name -> id mapping, number of teams created).
+    """
+    names = set(names)
+    if not names:
+        return {}, 0
+
+    team_ids = dict(db.execute(select(Team.name, Team.id).where(Team.name.in_(names))).all())
+    missing = sorted(names - set(team_ids))
+    if not missing:
+        return team_ids, 0
+
+    created = db.execute(
+        _dialect_insert(db)(Team).on_conflict_do_nothing(index_elements=["name"]).returning(Team.id),
+        [{"name": name} for name in missing]
+    ).all()
+    team_ids.update(db.execute(select(Team.name, Team.id).where(Team.name.in_(missing))).all())
+
+    return team_ids, len(created)
+
+
+def _insert_ignoring_duplicates(db: Session):
+    """INSERT INTO matches ... ON CONFLICT (date, home, away) DO NOTHING for the session's dialect"""
+    return _dialect_insert(db)(Match).on_conflict_do_nothing(index_elements=MATCH_KEY).returning(
+        Match.id, *[getattr(Match, col) for col in MATCH_KEY]
+    )
+
+
+def _insert_new_matches(frame: pd.DataFrame, db: Session) -> tuple:
+    """
+    Resolve teams and insert the matches of a normalized frame, leaving
+    duplicates of stored matches to the unique (date, home, away) constraint.
+    Extra columns (e.g. source) are carried along but not written.
+    Returns (teams created, all match rows, inserted match rows).
+    """
+    team_ids, teams_created = resolve_teams(
+        pd.concat([frame["home_team"], frame["away_team"]]).unique(), db
+    )
+
+    matches = frame.drop(columns=["home_team", "away_team"]).assign(
+        home_team_id=frame["home_team"].map(team_ids).astype(int),
+        away_team_id=frame["away_team"].map(team_ids).astype(int),
+    )
+
+    # Duplicates within the batch are dropped here; the database skips the rest
+    candidates = matches.drop_duplicates(subset=MATCH_KEY)
+    if candidates.empty:
+        return teams_created, matches, candidates
+
+    inserted = db.execute(
+        _insert_ignoring_duplicates(db), candidates[MATCH_COLUMNS].to_dict(orient="records")
+    ).all()
+    new_matches = candidates.merge(pd.DataFrame(inserted, columns=["id"] + MATCH_KEY), on=MATCH_KEY)
+    refresh_match_features(db, new_matches)
+    stage_new_matches(db, new_matches)
+
+    return teams_created, matches, new_matches
+
+
+def write_matches(frame: pd.DataFrame, db: Session) -> Dict[str, int]:
+    """
+    Write a normalized frame: resolve teams, then insert only the matches
+    whose (date, home, away) key is not stored yet. Does not commit.
+    """
+    if frame.empty:
+        return {"teams_created": 0, "matches_created": 0, "matches_skipped": 0}
+
+    teams_created, matches, new_matches = _insert_new_matches(frame, db)
+
+    return {
+        "teams_created": teams_created,
+        "matches_created": len(new_matches),
+        "matches_skipped": len(matches) - len(new_matches),
+    }
+
+
+def ingest_dataframe(df: pd.DataFrame, db: Session, row_offset: int = 0) -> Dict:
+    """
+    Ingest a raw frame with the required columns. Does not commit.
+    Raises ValueError if required columns are missing.
+    """
+    missing = missing_columns(df)
+    if missing:
+        raise ValueError(f"CSV must contain columns: {', '.join(REQUIRED_COLUMNS)}")
+    frame, rejected = validate_frame(df, row_offset=row_offset)
+    return {
+        **write_matches(frame, db),
+        "rows_rejected": len(rejected),
+        "rejected": rejected_report(rejected),
+    }
+
+
+def ingest_path(path: str, db: Session) -> Dict:
+    """
+    Ingest a CSV (optionally compressed), Parquet or Arrow IPC file in one
+    batch. Does not commit.
+    """
+    df = read_frame(path)
+    return {**ingest_dataframe(df, db), "rows_processed": len(df)}
+
+
+def file_fingerprint(path: str) -> str:
+    """SHA-256 of a file's contents, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def is_unchanged(source: str, fingerprint: str, db: Session) -> bool:
+    """Whether the manifest already records this exact content for the source"""
+    manifest = db.query(IngestManifest).filter(IngestManifest.source == source).first()
+    return manifest is not None and manifest.content_hash == fingerprint
+
+
+def apply_watermarks(frame: pd.DataFrame, source: str, db: Session) -> Tuple[pd.DataFrame, int]:
+    """
+    Drop rows dated before the source's watermark for their season. Rows on
+    the watermark date itself are kept, since a matchday may have been only
+    partially ingested; the match dedupe handles them.
+    Returns (remaining rows, rows dropped).
+    """
+    watermarks = dict(
+        db.query(IngestWatermark.season, IngestWatermark.max_date)
+        .filter(IngestWatermark.source == source).all()
+    )
+    if not watermarks or frame.empty:
+        return frame, 0
+
+    cutoff = frame["season"].map(watermarks)
+    keep = cutoff.isna().to_numpy() | (frame["date"] >= cutoff.fillna(frame["date"])).to_numpy()
+    return frame[keep].reset_index(drop=True), int((~keep).sum())
+
+
+def record_ingest(source: str, fingerprint: str, frame: pd.DataFrame, rows: int, db: Session):
+    """Upsert the manifest entry and raise per-season watermarks for an ingested source. Does not commit."""
+    manifest = db.query(IngestManifest).filter(IngestManifest.source == source).first()
+    if manifest is None:
+        manifest = IngestManifest(source=source)
+        db.add(manifest)
+    manifest.content_hash = fingerprint
+    manifest.file_size = os.path.getsize(source)
+    manifest.rows = rows
+
+    if frame.empty:
+        return
+    existing = {
+        w.season: w for w in db.query(IngestWatermark).filter(IngestWatermark.source == source).all()
+    }
+    for season, max_date in frame.groupby("season")["date"].max().items():
+        watermark = existing.get(season)
+        if watermark is None:
+            db.add(IngestWatermark(source=source, season=season, max_date=max_date))
+        elif max_date > watermark.max_date:
+            watermark.max_date = max_date
+
+
+def ingest_incremental(path: str, db: Session) -> Dict:
+    """
+    Ingest a file only as far as it is new: a file whose content hash matches
+    the manifest is skipped outright, otherwise only rows at or after the
+    season watermark of that source are written. Corrections to rows older
+    than the watermark need a full (non-incremental) ingest. Does not commit.
+    """
+    source = os.path.abspath(path)
+    fingerprint = file_fingerprint(source)
+    if is_unchanged(source, fingerprint, db):
+        return {
+            "teams_created": 0, "matches_created": 0, "matches_skipped": 0,
+            "rows_rejected": 0, "rejected": [], "rows_processed": 0,
+            "rows_below_watermark": 0, "file_unchanged": True,
+        }
+
+    df = read_frame(source)
+    frame, rejected = validate_frame(df)
+    new_rows, below_watermark = apply_watermarks(frame, source, db)
+    result = write_matches(new_rows, db)
+    record_ingest(source, fingerprint, frame, len(df), db)
+
+    return {
+        **result,
+        "rows_rejected": len(rejected),
+        "rejected": rejected_report(rejected),
+        "rows_processed": len(df),
+        "rows_below_watermark": below_watermark,
+        "file_unchanged": False,
+    }
+
+
+class CsvBatcher:
+    """
+    Push-style CSV splitter: feed raw bytes as they arrive and get back frames
+    of at most batch_size rows. Only the current partial line and the pending
+    batch are buffered. Splits on physical lines like iter_csv_chunks.
+    """
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.header: Optional[bytes] = None
+        self._partial = b""
+        self._lines: List[bytes] = []
+
+    def feed(self, data: bytes) -> List[pd.DataFrame]:
+        *complete, self._partial = (self._partial + data).split(b"\n")
+        frames = []
+        for line in complete:
+            if self.header is None:
+                self.header = line + b"\n"
+                continue
+            self._lines.append(line + b"\n")
+            if len(self._lines) >= self.batch_size:
+                frames.append(self._flush())
+        return frames
+
+    def close(self) -> List[pd.DataFrame]:
+        """Flush the trailing line and any pending rows"""
+        frames = self.feed(b"\n") if self._partial.strip() else []
+        if self._lines:
+            frames.append(self._flush())
+        return frames
+
+    def _flush(self) -> pd.DataFrame:
+        lines, self._lines = self._lines, []
+        return pd.read_csv(io.BytesIO(self.header + b"".join(lines)), dtype=CSV_DTYPES)
+
+
+def prefix_digest(path: str, n_bytes: int):
+    """SHA-256 object over the first n_bytes of a file, read in blocks"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while n_bytes > 0:
+            block = f.read(min(1 << 20, n_bytes))
+            if not block:
+                break
+            digest.update(block)
+            n_bytes -= len(block)
+    return digest
+
+
+def iter_csv_chunks(csv_path: str, chunk_size: int, start_offset: int = 0,
+                    digest=None) -> Iterator[Tuple[pd.DataFrame, int]]:
+    """
+    Read a CSV file in chunks of at most chunk_size lines, yielding
+    (frame, byte offset just past the chunk). Only one chunk is held in memory.
+    Splits on physical lines, so quoted fields must not contain newlines.
+    A digest of the bytes before start_offset (0 or past the header) is
+    updated with every byte read, so it covers the file up to each offset.
+    """
+    with open(csv_path, "rb") as f:
+        header = f.readline()
+        if start_offset > f.tell():
+            f.seek(start_offset)
+        elif digest is not None:
+            digest.update(header)
+
+        while True:
+            lines = b"".join(islice(f, chunk_size))
+            if not lines:
+                break
+            if digest is not None:
+                digest.update(lines)
+            df = pd.read_csv(io.BytesIO(header + lines), dtype=CSV_DTYPES)
+            yield df, f.tell()
+
+
+def ingest_csv_stream(
+    csv_path: str,
+    db: Session,
+    chunk_size: Optional[int] = None,
+    resume: bool = True,
+    on_chunk: Optional[Callable[[Dict[str, int]], None]] = None,
+) -> Dict[str, int]:
+    """
+    Ingest a CSV file chunk by chunk, committing after every chunk together
+    with a checkpoint of the byte offset reached and a hash of the bytes
+    before it. An interrupted ingest of the same file resumes from the last
+    committed offset if those bytes are unchanged, otherwise it starts over.
+    Raises FileNotFoundError or ValueError (missing columns, not a plain CSV).
+    """
+    chunk_size = chunk_size or settings.ingest_chunk_size
+    source = os.path.abspath(csv_path)
+    file_size = os.path.getsize(source)
+
+    if input_format(source) != "csv" or not source.lower().endswith(".csv"):
+        raise ValueError("Stream mode supports plain (uncompressed) CSV files only")
+
+    missing = missing_columns(pd.read_csv(source, nrows=0))
+    if missing:
+        raise ValueError(f"CSV must contain columns: {', '.join(REQUIRED_COLUMNS)}")
+
+    checkpoint = db.query(IngestCheckpoint).filter(IngestCheckpoint.source == source).first()
+    if checkpoint is None:
+        checkpoint = IngestCheckpoint(source=source, file_size=file_size, byte_offset=0, rows_committed=0)
+        db.add(checkpoint)
+
+    # Only resume an unfinished checkpoint while the file still starts with the bytes it covers; a file
+    # replaced or rewritten since would otherwise be read from an arbitrary offset
+    digest = None
+    if resume and not checkpoint.completed and checkpoint.byte_offset <= file_size:
+        digest = prefix_digest(source, checkpoint.byte_offset)
+    if digest is None or digest.hexdigest() != checkpoint.prefix_hash:
+        checkpoint.byte_offset = 0
+        checkpoint.rows_committed = 0
+        digest = hashlib.sha256()
+    resumed_from = checkpoint.byte_offset
+    checkpoint.file_size = file_size
+    checkpoint.prefix_hash = digest.hexdigest()
+    checkpoint.completed = False
+    db.commit()
+
+    totals = {"teams_created": 0, "matches_created": 0, "matches_skipped": 0, "rows_rejected": 0, "rejected": [],
+              "rows_processed": 0, "chunks": 0}
+
+    for df, offset in iter_csv_chunks(source, chunk_size, start_offset=resumed_from, digest=digest):
+        merge_counts(totals, ingest_dataframe(df, db, row_offset=checkpoint.rows_committed))
+        totals["rows_processed"] += len(df)
+        totals["chunks"] += 1
+
+        checkpoint.byte_offset = offset
+        checkpoint.prefix_hash = digest.hexdigest()
+        checkpoint.rows_committed += len(df)
+        db.commit()
+
+        if on_chunk is not None:
+            on_chunk(totals)
+
+    checkpoint.completed = True
+    db.commit()
+
+    return {**totals, "resumed_from_byte": resumed_from}
+
+
+def expand_sources(pattern: str) -> List[str]:
+    """Expand a directory (all supported files in it) or a glob pattern into a sorted file list"""
+    if os.path.isdir(pattern):
+        return sorted(
+            os.path.join(pattern, name) for name in os.listdir(pattern)
+            if name.lower().endswith(SUPPORTED_EXTENSIONS)
+        )
+    return sorted(glob.glob(pattern))
+
+
+def parse_file(path: str) -> tuple:
+    """
+    Read, validate and normalize one file. Runs in a worker process.
+    Returns (valid rows, rows read, rejected report, rejected count, seconds spent).
+    """
+    started = time.perf_counter()
+    df = read_frame(path)
+    frame, rejected = validate_frame(df)
+    return frame, len(df), rejected_report(rejected), len(rejected), time.perf_counter() - started
+
+
+def ingest_files(paths: List[str], db: Session, workers: Optional[int] = None, incremental: bool = False) -> Dict:
+    """
+    Parse files in a process pool and write them through a single writer:
+    teams are resolved and matches deduplicated once across all files, then
+    committed in one transaction. Files that fail to parse are reported and
+    left out. In incremental mode unchanged files are skipped before parsing
+    and rows before each file's watermarks are dropped.
+    """
+    frames = {}
+    files = {}
+    fingerprints = {}
+
+    to_parse = []
+    for path in paths:
+        if incremental:
+            fingerprints[path] = file_fingerprint(path)
+            if is_unchanged(os.path.abspath(path), fingerprints[path], db):
+                files[path] = {"file_unchanged": True}
+                continue
+        to_parse.append(path)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(parse_file, path): path for path in to_parse}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                frame, rows, rejected, rows_rejected, seconds = future.result()
+            except Exception as e:
+                files[path] = {"error": str(e)}
+                continue
+            below_watermark = 0
+            if incremental:
+                new_rows, below_watermark = apply_watermarks(frame, os.path.abspath(path), db)
+                record_ingest(os.path.abspath(path), fingerprints[path], frame, rows, db)
+                frame = new_rows
+            frames[path] = frame.assign(source=path)
+            files[path] = {
+                "rows": rows,
+                "rows_below_watermark": below_watermark,
+                "rows_rejected": rows_rejected,
+                "rejected": rejected,
+                "matches_created": 0,
+                "matches_skipped": 0,
+                "parse_seconds": round(seconds, 3),
+            }
+
+    started = time.perf_counter()
+    teams_created = 0
+    # Concatenate in input order so the first file listed wins a cross-file duplicate
+    combined = pd.concat([frames[path] for path in paths if path in frames] or [pd.DataFrame()], ignore_index=True)
+    if not combined.empty:
+        teams_created, matches, new_matches = _insert_new_matches(combined, db)
+
+        created = new_matches["source"].value_counts()
+        for path, total in matches["source"].value_counts().items():
+            files[path]["matches_created"] = int(created.get(path, 0))
+            files[path]["matches_skipped"] = int(total - created.get(path, 0))
+    # Also when nothing is left to write, so the manifests of changed files are kept
+    db.commit()
+
+    return {
+        "teams_created": teams_created,
+        "matches_created": sum(f.get("matches_created", 0) for f in files.values()),
+        "matches_skipped": sum(f.get("matches_skipped", 0) for f in files.values()),
+        "write_seconds": round(time.perf_counter() - started, 3),
+        "files": {path: files[path] for path in paths},
+    }
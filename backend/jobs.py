@@ -0,0 +1,134 @@
+"""
+In-process background job runner.
+
+Jobs run on a thread pool and are tracked in memory, so their status is only
+visible from the API process that accepted them.
+"""
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Optional
+
+
+class Job:
+    """State of one background job, updated by the worker running it"""
+
+    def __init__(self, kind: str, key: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.key = key
+        self.state = "queued"
+        self.stage: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.rows_processed = 0
+        self.errors = []
+        self.result: Optional[dict] = None
+        self.exception: Optional[BaseException] = None
+        self.cancel_requested = False
+        self._done = threading.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self._done.is_set()
+
+    @property
+    def rows_per_sec(self) -> float:
+        if self.started_at is None:
+            return 0.0
+        elapsed = ((self.finished_at or datetime.utcnow()) - self.started_at).total_seconds()
+        return self.rows_processed / elapsed if elapsed > 0 else 0.0
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "stage": self.stage,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+            "rows_processed": self.rows_processed,
+            "rows_per_sec": round(self.rows_per_sec, 1),
+            "errors": self.errors,
+            "result": self.result,
+        }
+
+
+class JobManager:
+    """Runs jobs on a bounded thread pool and coalesces jobs that share a key"""
+
+    def __init__(self, max_workers: int, max_history: int = 1000):
+        self.max_workers = max_workers
+        self.max_history = max_history
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._jobs: Dict[str, Job] = {}
+        self._active_by_key: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn: Callable[[Job], dict], key: Optional[str] = None) -> tuple:
+        """
+        Queue fn(job) for execution. If a queued or running job with the same
+        key exists, return it instead. Returns (job, created).
+        """
+        with self._lock:
+            if key is not None and key in self._active_by_key:
+                return self._active_by_key[key], False
+
+            job = Job(kind, key)
+            self._jobs[job.id] = job
+            self._prune()
+            if key is not None:
+                self._active_by_key[key] = job
+
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=kind)
+            self._executor.submit(self._run, job, fn)
+            return job, True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        return self._jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """Flag a job for cancellation; the job function decides when to stop"""
+        job = self._jobs.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel_requested = True
+        return job
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False)
+
+    def _prune(self):
+        """Forget the oldest finished jobs once the history cap is exceeded"""
+        excess = len(self._jobs) - self.max_history
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished][:max(excess, 0)]:
+            del self._jobs[job_id]
+
+    def _run(self, job: Job, fn: Callable[[Job], dict]):
+        job.started_at = datetime.utcnow()
+        try:
+            if job.cancel_requested:
+                job.state = "cancelled"
+            else:
+                job.state = "running"
+                job.result = fn(job)
+                job.state = "cancelled" if job.cancel_requested and job.result is None else "succeeded"
+        except Exception as e:
+            job.state = "failed"
+            job.exception = e
+            job.errors.append(str(e))
+        finally:
+            job.finished_at = datetime.utcnow()
+            with self._lock:
+                if self._active_by_key.get(job.key) is job:
+                    del self._active_by_key[job.key]
+            job._done.set()
@@ -1,9 +1,45 @@
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from backend.config import settings
+from backend.database import get_session_factory
+from backend.feature_index import team_form_index
+from backend.model_registry import model_registry
+from backend.pair_matrix import pair_matrix
+from backend.prediction_log import prediction_log
 from backend.routers import ingest, analytics, ml
+from backend.training import shutdown_training_pool
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Build the prediction feature index and load the served model up front
+    session_factory = app.state.session_factory
+    db = session_factory()
+    try:
+        team_form_index.load(db)
+        try:
+            model_registry.get(db)
+        except FileNotFoundError:
+            pass  # reported by /predict
+        pair_matrix.load()
+    finally:
+        db.close()
+    if settings.prediction_log_mode == "async":
+        prediction_log.start(session_factory)
+    yield
+    prediction_log.stop()
+    pair_matrix.shutdown()
+    ingest.ingest_jobs.shutdown()
+    ml.train_jobs.shutdown()
+    shutdown_training_pool()
+
 
-app = FastAPI(title="MatchMind API", version="1.0.0")
+app = FastAPI(title="MatchMind API", version="1.0.0", lifespan=lifespan)
+# Sessions of the startup work and the background prediction log writer
+app.state.session_factory = get_session_factory()
 
 # CORS middleware for frontend
 app.add_middleware(
@@ -0,0 +1,106 @@
+"""
+Process-resident registry of the served model.
+
+The active ModelRun's model is loaded once (see backend/artifacts.py) and
+kept in memory. Every REGISTRY_TTL_SECONDS a request compares the active
+run id and activation time with the database and, if another run was
+activated, loads it and swaps the reference. Requests already holding the previous
+model finish with it; while one thread loads, the others keep serving the
+current model.
+"""
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from backend.artifacts import load_model
+from backend.config import settings
+from backend.models import ModelRun
+
+
+@dataclass(frozen=True)
+class LoadedModel:
+    run_id: int
+    activated_at: datetime
+    model_path: str
+    model: object
+    metrics: dict
+    loaded_at: datetime
+
+
+class ModelRegistry:
+    """Holds the loaded active model and swaps it when another run is activated"""
+
+    def __init__(self):
+        self._load_lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self._current: Optional[LoadedModel] = None
+        self.checked_at = 0.0
+        self.swaps = 0
+
+    @property
+    def current(self) -> Optional[LoadedModel]:
+        return self._current
+
+    def invalidate(self):
+        """Check the database on the next request, e.g. after a run was stored in this process"""
+        self.checked_at = 0.0
+
+    def get(self, db: Session) -> Optional[LoadedModel]:
+        """
+        The model to serve, or None if no run is active. Raises
+        FileNotFoundError if the active run's model file is missing.
+        """
+        current = self._current
+        if current is not None and time.monotonic() - self.checked_at < settings.registry_ttl_seconds:
+            return current
+
+        active = db.execute(
+            select(ModelRun.id, ModelRun.activated_at, ModelRun.model_path, ModelRun.metrics_json)
+            .where(ModelRun.activated_at.isnot(None))
+            .order_by(ModelRun.activated_at.desc(), ModelRun.id.desc())
+            .limit(1)
+        ).first()
+        if active is None:
+            self._current = None
+            return None
+        if current is not None and (current.run_id, current.activated_at) == (active.id, active.activated_at):
+            self.checked_at = time.monotonic()
+            return current
+
+        # One thread loads the new model; the others keep serving the current one meanwhile
+        if not self._load_lock.acquire(blocking=current is None):
+            return current
+        try:
+            latest = self._current
+            if latest is not None and (latest.run_id, latest.activated_at) == (active.id, active.activated_at):
+                return latest
+            self._current = LoadedModel(
+                run_id=active.id,
+                activated_at=active.activated_at,
+                model_path=active.model_path,
+                model=load_model(active.model_path),
+                metrics=active.metrics_json or {},
+                loaded_at=datetime.utcnow()
+            )
+            self.checked_at = time.monotonic()
+            self.swaps += 1
+            return self._current
+        finally:
+            self._load_lock.release()
+
+
+model_registry = ModelRegistry()
+
+
+def activate_run(db: Session, run: ModelRun):
+    """Make a run the served model; this process swaps it in on its next request"""
+    run.activated_at = datetime.utcnow()
+    db.commit()
+    model_registry.invalidate()
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Date, ForeignKey, Float, DateTime, JSON, Index
+from sqlalchemy import Column, Integer, BigInteger, String, Date, ForeignKey, Float, DateTime, JSON, Index, Boolean, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -18,24 +18,41 @@ class Team(Base):
 class Match(Base):
     __tablename__ = "matches"
 
-    id = Column(Integer, primary_key=True, index=True)
-    date = Column(Date, nullable=False, index=True)
-    season = Column(String, nullable=False, index=True)
-    home_team_id = Column(Integer, ForeignKey("teams.id"), nullable=False, index=True)
-    away_team_id = Column(Integer, ForeignKey("teams.id"), nullable=False, index=True)
+    id = Column(Integer, primary_key=True)
+    date = Column(Date, nullable=False)
+    season = Column(String, nullable=False)
+    home_team_id = Column(Integer, ForeignKey("teams.id"), nullable=False)
+    away_team_id = Column(Integer, ForeignKey("teams.id"), nullable=False)
     home_goals = Column(Integer, nullable=False)
     away_goals = Column(Integer, nullable=False)
 
     home_team = relationship("Team", foreign_keys=[home_team_id], back_populates="home_matches")
     away_team = relationship("Team", foreign_keys=[away_team_id], back_populates="away_matches")
 
+    # The unique key also serves date-range scans (its leading column is date)
     __table_args__ = (
+        UniqueConstraint("date", "home_team_id", "away_team_id", name="uq_matches_date_home_away"),
         Index("idx_matches_season_date", "season", "date"),
-        Index("idx_matches_home_team", "home_team_id"),
-        Index("idx_matches_away_team", "away_team_id"),
+        Index("idx_matches_home_team_date", "home_team_id", "date"),
+        Index("idx_matches_away_team_date", "away_team_id", "date"),
     )
 
 
+class MatchFeature(Base):
+    __tablename__ = "match_features"
+
+    match_id = Column(Integer, ForeignKey("matches.id", ondelete="CASCADE"), primary_key=True)
+    schema_version = Column(Integer, nullable=False, index=True)
+    home_team_points_last5 = Column(Float, nullable=False)
+    away_team_points_last5 = Column(Float, nullable=False)
+    home_goal_diff_last5 = Column(Float, nullable=False)
+    away_goal_diff_last5 = Column(Float, nullable=False)
+    head_to_head_points_last3 = Column(Float, nullable=False)
+    home_advantage = Column(Float, nullable=False)
+    outcome = Column(Integer, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
 class ModelRun(Base):
     __tablename__ = "model_runs"
 
@@ -43,6 +60,8 @@ class ModelRun(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     metrics_json = Column(JSON, nullable=False)
     model_path = Column(String, nullable=False)
+    # Set when the run is chosen for serving; /predict uses the most recently activated run
+    activated_at = Column(DateTime, nullable=True)
 
 
 class Prediction(Base):
@@ -58,3 +77,40 @@ class Prediction(Base):
     proba_away = Column(Float, nullable=False)
     explanation_json = Column(JSON, nullable=False)
 
+
+class IngestCheckpoint(Base):
+    __tablename__ = "ingest_checkpoints"
+
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String, unique=True, nullable=False)
+    file_size = Column(BigInteger, nullable=False)
+    byte_offset = Column(BigInteger, nullable=False, default=0)
+    # SHA-256 of the file's first byte_offset bytes; a resume requires the file to still start with them
+    prefix_hash = Column(String, nullable=True)
+    rows_committed = Column(BigInteger, nullable=False, default=0)
+    completed = Column(Boolean, nullable=False, default=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class IngestManifest(Base):
+    __tablename__ = "ingest_manifests"
+
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String, unique=True, nullable=False)
+    content_hash = Column(String, nullable=False)
+    file_size = Column(BigInteger, nullable=False)
+    rows = Column(BigInteger, nullable=False)
+    ingested_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+
+class IngestWatermark(Base):
+    __tablename__ = "ingest_watermarks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    source = Column(String, nullable=False)
+    season = Column(String, nullable=False)
+    max_date = Column(Date, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("source", "season", name="uq_ingest_watermarks_source_season"),
+    )
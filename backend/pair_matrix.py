@@ -0,0 +1,212 @@
+"""
+Precomputed predictions for every ordered pair of current teams.
+
+After a model is activated or matches are ingested, a background thread
+computes the features, outcome probabilities and explanations of all home
+x away pairs of the teams that played in the latest season (the season of
+the most recent match) in one vectorized pass (one build_features call,
+one predict_proba call) for a fixture after the last stored match. The
+matrix is kept in memory and in a .npz file (PAIR_MATRIX_PATH) that is
+reloaded at startup.
+
+Features depend only on matches before the fixture date, so the matrix
+answers /predict for any date after the last match, as long as the served
+run and the matches table (count and max id) are the ones it was built
+from; otherwise, and for teams outside the latest season, /predict
+computes the prediction live.
+"""
+import os
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from sqlalchemy.orm import Session
+
+from backend.config import settings
+from backend.estimators import feature_contributions
+from backend.features import build_features, load_matches_frame
+from backend.model_registry import model_registry
+
+
+@dataclass(frozen=True)
+class PairMatrix:
+    run_id: int
+    match_count: int
+    max_match_id: Optional[int]
+    last_match_date: Optional[date]
+    team_ids: np.ndarray
+    probabilities: np.ndarray  # (teams, teams, classes)
+    features: np.ndarray  # (teams, teams, features)
+    contributions: np.ndarray  # (teams, teams, features)
+    built_at: datetime
+
+    def position(self, team_id: int) -> Optional[int]:
+        i = int(np.searchsorted(self.team_ids, team_id))
+        return i if i < len(self.team_ids) and self.team_ids[i] == team_id else None
+
+
+class PairMatrixStore:
+    """The current matrix, replaced as a whole when it is rebuilt on its background thread"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._schedule_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._pending: Optional[Future] = None
+        self._last: Optional[Future] = None
+        self.matrix: Optional[PairMatrix] = None
+        self.last_error: Optional[str] = None
+
+    def reset(self):
+        self.matrix = None
+
+    def schedule(self, session_factory):
+        """
+        Rebuild in the background with a new session. A rebuild that has not
+        started yet already covers this request; one that is running may
+        have read older data, so another is queued behind it.
+        """
+        with self._schedule_lock:
+            if self._pending is not None:
+                return
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pair-matrix")
+            self._pending = self._last = self._executor.submit(self._run, session_factory)
+
+    def wait(self):
+        """Block until the scheduled rebuilds have finished"""
+        last = self._last
+        if last is not None:
+            last.result()
+
+    def shutdown(self):
+        with self._schedule_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
+
+    def _run(self, session_factory):
+        with self._schedule_lock:
+            self._pending = None
+        db = session_factory()
+        try:
+            self.rebuild(db)
+            self.last_error = None
+        except FileNotFoundError:
+            self.reset()
+        except Exception as e:
+            # Predictions are computed live until the next rebuild succeeds
+            self.reset()
+            self.last_error = str(e)
+        finally:
+            db.close()
+
+    def rebuild(self, db: Session) -> Optional[PairMatrix]:
+        """Compute the matrix for the served model and save it; clears it when no model is served"""
+        with self._lock:
+            loaded = model_registry.get(db)
+            history = load_matches_frame(db)
+            team_ids = latest_season_teams(history)
+            if loaded is None or len(team_ids) < 2:
+                self.matrix = None
+                return None
+
+            last_match_date = history["date"].max()
+            n = len(team_ids)
+            fixtures = pd.DataFrame({
+                "home_team_id": np.repeat(team_ids, n),
+                "away_team_id": np.tile(team_ids, n),
+                "date": last_match_date + timedelta(days=1),
+            })
+
+            features = build_features(history, fixtures)
+            probabilities = loaded.model.predict_proba(features)
+            contributions = feature_contributions(loaded.model, features, probabilities)
+
+            matrix = PairMatrix(
+                run_id=loaded.run_id,
+                match_count=len(history),
+                max_match_id=int(history["id"].max()),
+                last_match_date=last_match_date,
+                team_ids=team_ids,
+                probabilities=probabilities.reshape(n, n, -1),
+                features=features.reshape(n, n, -1),
+                contributions=contributions.reshape(n, n, -1),
+                built_at=datetime.utcnow()
+            )
+            self._save(matrix)
+            self.matrix = matrix
+            return matrix
+
+    def lookup(self, run_id: int, match_count: int, max_match_id: Optional[int], home_team_id: int,
+               away_team_id: int, match_date: date) -> Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        (probabilities, features, contributions) of a fixture, or None if
+        the matrix was built for another run or other matches, or the date
+        is not after the last match
+        """
+        matrix = self.matrix
+        if matrix is None or (matrix.run_id, matrix.match_count, matrix.max_match_id) != (
+                run_id, match_count, max_match_id):
+            return None
+        if matrix.last_match_date is not None and match_date <= matrix.last_match_date:
+            return None
+        home, away = matrix.position(home_team_id), matrix.position(away_team_id)
+        if home is None or away is None or home == away:
+            return None
+        return matrix.probabilities[home, away], matrix.features[home, away], matrix.contributions[home, away]
+
+    def load(self):
+        """Read the saved matrix, if any; lookups check whether it is still current"""
+        path = settings.pair_matrix_path
+        if not os.path.exists(path):
+            return
+        with np.load(path) as data:
+            last_match_date = str(data["last_match_date"])
+            max_match_id = int(data["max_match_id"])
+            self.matrix = PairMatrix(
+                run_id=int(data["run_id"]),
+                match_count=int(data["match_count"]),
+                max_match_id=max_match_id if max_match_id >= 0 else None,
+                last_match_date=date.fromisoformat(last_match_date) if last_match_date else None,
+                team_ids=data["team_ids"],
+                probabilities=data["probabilities"],
+                features=data["features"],
+                contributions=data["contributions"],
+                built_at=datetime.fromisoformat(str(data["built_at"]))
+            )
+
+    def _save(self, matrix: PairMatrix):
+        path = settings.pair_matrix_path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.{uuid.uuid4().hex}.tmp.npz"
+        np.savez(
+            tmp,
+            run_id=matrix.run_id,
+            match_count=matrix.match_count,
+            max_match_id=matrix.max_match_id if matrix.max_match_id is not None else -1,
+            last_match_date=matrix.last_match_date.isoformat() if matrix.last_match_date else "",
+            team_ids=matrix.team_ids,
+            probabilities=matrix.probabilities,
+            features=matrix.features,
+            contributions=matrix.contributions,
+            built_at=matrix.built_at.isoformat()
+        )
+        os.replace(tmp, path)
+
+
+pair_matrix = PairMatrixStore()
+
+
+def latest_season_teams(history: pd.DataFrame) -> np.ndarray:
+    """Sorted ids of the teams that played in the season of the most recent match"""
+    if history.empty:
+        return np.array([], dtype=np.int64)
+    season = history["season"].iloc[-1]
+    played = history[history["season"] == season]
+    return np.union1d(played["home_team_id"].to_numpy(np.int64), played["away_team_id"].to_numpy(np.int64))
@@ -0,0 +1,154 @@
+"""
+Recording of served predictions in the predictions table.
+
+With PREDICTION_LOG_MODE=sync each request inserts and commits its rows.
+With async, rows are put on a bounded in-process queue and a background
+writer inserts them in bulk, once PREDICTION_LOG_BATCH_SIZE rows are
+waiting or PREDICTION_LOG_FLUSH_SECONDS after the first one, whichever
+comes first. Stopping the writer flushes what is still queued. Rows that
+do not fit in the queue within PREDICTION_LOG_PUT_TIMEOUT_SECONDS are
+dropped and counted; one call waits at most that long in total, however
+many rows it queues.
+"""
+import queue
+import threading
+import time
+from datetime import datetime
+from typing import List, Optional
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from backend.config import settings
+from backend.models import Prediction
+
+_STOP = object()
+
+
+class PredictionLogWriter:
+    """Background thread that bulk-inserts queued prediction rows"""
+
+    def __init__(self):
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._session_factory = None
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_error: Optional[str] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, session_factory):
+        if self.running:
+            return
+        self._session_factory = session_factory
+        self._queue = queue.Queue(maxsize=settings.prediction_log_max_queue)
+        self._thread = threading.Thread(target=self._run, name="prediction-log", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Write everything still queued, then stop the thread"""
+        if not self.running:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def enqueue(self, records: List[dict]):
+        """Queue records, waiting at most PREDICTION_LOG_PUT_TIMEOUT_SECONDS in total for room"""
+        deadline = time.monotonic() + settings.prediction_log_put_timeout_seconds
+        for i, record in enumerate(records):
+            try:
+                self._queue.put(record, timeout=max(deadline - time.monotonic(), 0))
+            except queue.Full:
+                # Out of time: drop the rest of the batch at once
+                self.dropped += len(records) - i
+                return
+
+    def flush(self):
+        """Block until every queued row has been written (or failed)"""
+        if self.running:
+            self._queue.join()
+
+    def stats(self) -> dict:
+        return {
+            "mode": settings.prediction_log_mode,
+            "running": self.running,
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "last_error": self.last_error
+        }
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                break
+
+            batch = [item]
+            deadline = time.monotonic() + settings.prediction_log_flush_seconds
+            while len(batch) < settings.prediction_log_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    self._queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+
+            if stopping:
+                # Drain whatever was queued before the stop request
+                while True:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+            self._write(batch)
+
+    def _write(self, batch: List[dict]):
+        db = self._session_factory()
+        try:
+            db.execute(insert(Prediction), batch)
+            db.commit()
+            self.written += len(batch)
+            self.batches += 1
+        except Exception as e:
+            db.rollback()
+            self.failed += len(batch)
+            self.last_error = str(e)
+        finally:
+            db.close()
+            for _ in batch:
+                self._queue.task_done()
+
+
+prediction_log = PredictionLogWriter()
+
+
+def log_predictions(db: Session, records: List[dict]):
+    """
+    Record predictions (dicts of Prediction columns), stamped with the
+    request time. Written in the request with sync logging or when the
+    writer is not running, otherwise queued for the background writer.
+    """
+    now = datetime.utcnow()
+    records = [{**record, "created_at": now} for record in records]
+    if settings.prediction_log_mode == "async" and prediction_log.running:
+        prediction_log.enqueue(records)
+        return
+    db.execute(insert(Prediction), records)
+    db.commit()
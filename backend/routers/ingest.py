@@ -1,97 +1,200 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from multipart.multipart import MultipartParser, parse_options_header
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
-from datetime import datetime
 import pandas as pd
+import os
 from typing import Optional
 
-from backend.database import get_db
-from backend.models import Team, Match
+from backend.config import settings
+from backend.database import get_db, get_session_factory
+from backend.ingestion import CsvBatcher, ingest_dataframe, ingest_csv_stream, ingest_path, ingest_incremental, merge_counts
+from backend.jobs import Job, JobManager
+from backend.pair_matrix import pair_matrix
 
 router = APIRouter()
 
+ingest_jobs = JobManager(max_workers=settings.ingest_workers)
+
+
+def run_ingest_job(job: Job, csv_path: str, stream: bool, chunk_size: Optional[int], resume: bool, incremental: bool,
+                   session_factory):
+    """Body of a background ingest job; progress is reported on the job"""
+    db = session_factory()
+    try:
+        if incremental:
+            result = ingest_incremental(csv_path, db)
+            db.commit()
+            job.rows_processed = result["rows_processed"]
+        elif stream:
+            def report(totals):
+                job.rows_processed = totals["rows_processed"]
+
+            result = ingest_csv_stream(csv_path, db, chunk_size=chunk_size, resume=resume, on_chunk=report)
+        else:
+            result = ingest_path(csv_path, db)
+            db.commit()
+            job.rows_processed = result["rows_processed"]
+
+        if result.get("matches_created"):
+            pair_matrix.schedule(session_factory)
+        return result
+    finally:
+        db.close()
+
 
 @router.post("")
 def ingest_csv(
-    csv_path: Optional[str] = Query(None, description="Path to CSV file (defaults to /app/data/sample_matches.csv)"),
-    db: Session = Depends(get_db)
+    response: Response,
+    csv_path: Optional[str] = Query(None, description="Path to a CSV (optionally .gz/.zst), Parquet or Arrow IPC file (defaults to /app/data/sample_matches.csv)"),
+    stream: bool = Query(False, description="Read a plain CSV in chunks, committing and checkpointing after each chunk"),
+    chunk_size: Optional[int] = Query(None, ge=1, description="Rows per chunk in stream mode"),
+    resume: bool = Query(True, description="Resume an interrupted stream ingest of the same file"),
+    incremental: bool = Query(False, description="Skip an unchanged file and rows before the per-season watermarks"),
+    wait: bool = Query(False, description="Block until the job finishes and return its counts"),
+    session_factory=Depends(get_session_factory)
 ):
     """
-    Ingest CSV data into teams and matches tables.
+    Ingest match data into teams and matches tables as a background job.
     Idempotent on team names, deduplicates matches by date+teams.
+    Invalid rows are skipped and reported in the result.
+    A request for a file that is already being ingested with the same mode
+    and options joins the running job.
     """
     if csv_path is None:
         csv_path = "/app/data/sample_matches.csv"
 
-    try:
-        df = pd.read_csv(csv_path)
-    except FileNotFoundError:
+    if not os.path.exists(csv_path):
         raise HTTPException(status_code=404, detail=f"CSV file not found: {csv_path}")
 
-    # Required columns
-    required_cols = ["date", "season", "home_team", "away_team", "home_goals", "away_goals"]
-    if not all(col in df.columns for col in required_cols):
-        raise HTTPException(
-            status_code=400,
-            detail=f"CSV must contain columns: {', '.join(required_cols)}"
-        )
-
-    teams_created = 0
-    matches_created = 0
-    matches_skipped = 0
-
-    for _, row in df.iterrows():
-        # Get or create home team
-        home_team = db.query(Team).filter(Team.name == row["home_team"]).first()
-        if not home_team:
-            home_team = Team(name=row["home_team"])
-            db.add(home_team)
-            db.flush()
-            teams_created += 1
-
-        # Get or create away team
-        away_team = db.query(Team).filter(Team.name == row["away_team"]).first()
-        if not away_team:
-            away_team = Team(name=row["away_team"])
-            db.add(away_team)
-            db.flush()
-            teams_created += 1
-
-        # Parse date
-        try:
-            match_date = pd.to_datetime(row["date"]).date()
-        except:
-            continue
-
-        # Check if match already exists (dedupe by date + teams)
-        existing_match = db.query(Match).filter(
-            and_(
-                Match.date == match_date,
-                Match.home_team_id == home_team.id,
-                Match.away_team_id == away_team.id
-            )
-        ).first()
-
-        if not existing_match:
-            match = Match(
-                date=match_date,
-                season=str(row["season"]),
-                home_team_id=home_team.id,
-                away_team_id=away_team.id,
-                home_goals=int(row["home_goals"]),
-                away_goals=int(row["away_goals"])
-            )
-            db.add(match)
-            matches_created += 1
-        else:
-            matches_skipped += 1
+    if stream and incremental:
+        raise HTTPException(status_code=400, detail="stream and incremental cannot be combined")
 
+    # chunk_size and resume only apply to stream mode
+    mode = "incremental" if incremental else "stream" if stream else "full"
+    stream_options = f"{chunk_size or settings.ingest_chunk_size}:{resume}" if stream else "-"
+    job, created = ingest_jobs.submit(
+        "ingest",
+        lambda job: run_ingest_job(job, csv_path, stream, chunk_size, resume, incremental, session_factory),
+        key=f"ingest:{mode}:{stream_options}:{os.path.abspath(csv_path)}"
+    )
+
+    if not wait:
+        response.status_code = 202
+        return {
+            "job_id": job.id,
+            "state": job.state,
+            "coalesced": not created
+        }
+
+    job.wait()
+    if job.state == "failed":
+        if isinstance(job.exception, ValueError):
+            raise HTTPException(status_code=400, detail=str(job.exception))
+        if isinstance(job.exception, FileNotFoundError):
+            raise HTTPException(status_code=404, detail=f"CSV file not found: {csv_path}")
+        raise HTTPException(status_code=500, detail=f"Ingestion failed: {job.exception}")
+
+    return {
+        **job.result,
+        "job_id": job.id,
+        "message": "Ingestion completed"
+    }
+
+
+def ingest_batch(df: pd.DataFrame, db: Session, row_offset: int) -> dict:
+    """Ingest and commit one batch of an upload"""
+    result = ingest_dataframe(df, db, row_offset=row_offset)
     db.commit()
+    return result
+
+
+@router.post("/upload")
+async def ingest_upload(
+    request: Request,
+    batch_size: Optional[int] = Query(None, ge=1, description="Rows per committed batch"),
+    db: Session = Depends(get_db),
+    session_factory=Depends(get_session_factory)
+):
+    """
+    Ingest a CSV sent as the `file` field of a multipart/form-data upload.
+    The body is parsed as it streams in and each batch is committed as soon as
+    it is complete, so ingestion starts before the upload has finished.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Expected a multipart/form-data upload")
+
+    batcher = CsvBatcher(batch_size or settings.ingest_chunk_size)
+    ready = []
+    part = {"field": b"", "value": b"", "name": None}
+
+    def on_part_begin():
+        part["name"] = None
+
+    def on_header_field(data, start, end):
+        part["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        part["value"] += data[start:end]
+
+    def on_header_end():
+        if part["field"].lower() == b"content-disposition":
+            part["name"] = parse_options_header(part["value"])[1].get(b"name")
+        part["field"], part["value"] = b"", b""
+
+    def on_part_data(data, start, end):
+        if part["name"] == b"file":
+            ready.extend(batcher.feed(data[start:end]))
+
+    def on_part_end():
+        if part["name"] == b"file":
+            ready.extend(batcher.close())
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    totals = {"teams_created": 0, "matches_created": 0, "matches_skipped": 0, "rows_rejected": 0, "rejected": [],
+              "rows_processed": 0, "batches": 0}
+
+    async def drain():
+        while ready:
+            df = ready.pop(0)
+            try:
+                counts = await run_in_threadpool(ingest_batch, df, db, totals["rows_processed"])
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            merge_counts(totals, counts)
+            totals["rows_processed"] += len(df)
+            totals["batches"] += 1
+
+    async for chunk in request.stream():
+        parser.write(chunk)
+        await drain()
+    parser.finalize()
+    await drain()
+
+    if batcher.header is None:
+        raise HTTPException(status_code=400, detail="Upload must contain a CSV in the 'file' field")
+    if totals["matches_created"]:
+        pair_matrix.schedule(session_factory)
 
     return {
-        "teams_created": teams_created,
-        "matches_created": matches_created,
-        "matches_skipped": matches_skipped,
+        **totals,
         "message": "Ingestion completed"
     }
 
+
+@router.get("/jobs/{job_id}")
+def get_ingest_job(job_id: str):
+    """Get state, progress and errors of an ingest job"""
+    job = ingest_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
@@ -1,23 +1,94 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import and_, or_, func
-from datetime import datetime, date
-from typing import Optional
-from pydantic import BaseModel
-import pickle
+from datetime import date
+from typing import List, Literal, Optional
+from pydantic import BaseModel, Field
 import os
-import json
+import threading
+import time
+from collections import OrderedDict
 import numpy as np
-from sklearn.linear_model import LogisticRegression
-from sklearn.model_selection import train_test_split
-from sklearn.metrics import accuracy_score, log_loss
 import pandas as pd
 
-from backend.database import get_db
-from backend.models import Team, Match, ModelRun, Prediction
+from backend.config import settings
+from backend.database import get_db, get_session_factory
+from backend.feature_index import team_form_index
+from backend.estimators import build_explanation, feature_contributions
+from backend.features import build_features, compute_features_sql, load_matches_frame
+from backend.jobs import JobManager
+from backend.models import Team, Match, ModelRun
+from backend.model_registry import activate_run, model_registry
+from backend.pair_matrix import pair_matrix
+from backend.simulation import season_table, simulate_season
+from backend.prediction_log import log_predictions, prediction_log
+from backend.training import leaderboard, run_search_job, run_training_job
 
 router = APIRouter()
 
+train_jobs = JobManager(max_workers=1)
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of /predict results with a TTL. Keys carry the served
+    model run and the match-data version, so entries from before an ingest
+    or a model change are never returned; the cache is emptied as soon as
+    either changes.
+    """
+
+    def __init__(self, max_size: int, ttl_seconds: float):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        with self._lock:
+            self._entries: "OrderedDict[tuple, tuple]" = OrderedDict()
+            self._generation = None
+            self.hits = 0
+            self.misses = 0
+
+    def get(self, generation: tuple, key: tuple):
+        with self._lock:
+            if generation != self._generation:
+                self._entries.clear()
+                self._generation = generation
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[0] > self.ttl_seconds:
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, generation: tuple, key: tuple, value):
+        with self._lock:
+            if generation != self._generation or self.max_size <= 0:
+                return
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "generation": list(self._generation) if self._generation else None
+            }
+
+
+prediction_cache = PredictionCache(settings.prediction_cache_size, settings.prediction_cache_ttl_seconds)
+
 
 class PredictRequest(BaseModel):
     home_team_id: int
@@ -35,6 +106,68 @@ class PredictResponse(BaseModel):
     explanation: dict
 
 
+class BatchFixture(BaseModel):
+    home_team_id: int
+    away_team_id: int
+    season: str
+    match_date: Optional[date] = None
+
+
+class BatchPredictRequest(BaseModel):
+    fixtures: List[BatchFixture] = Field(..., min_length=1, max_length=5000)
+
+
+class BatchPrediction(PredictResponse):
+    match_date: date
+
+
+class BatchPredictResponse(BaseModel):
+    model_config = {"protected_namespaces": ()}
+
+    model_run_id: int
+    predictions: List[BatchPrediction]
+
+
+class SimulationFixture(BaseModel):
+    home_team_id: int
+    away_team_id: int
+    match_date: Optional[date] = None
+
+
+class SimulateSeasonRequest(BaseModel):
+    season: str
+    fixtures: List[SimulationFixture] = Field(..., min_length=1, max_length=5000)
+    n_simulations: int = Field(10000, ge=1, le=1000000)
+    seed: Optional[int] = None
+    top: int = Field(4, ge=1)
+    relegation: int = Field(3, ge=0)
+
+
+class TeamSimulation(BaseModel):
+    team_id: int
+    team_name: str
+    played: int
+    points: int
+    expected_points: float
+    title: float
+    top: float
+    relegation: float
+    positions: List[float]
+
+
+class SimulateSeasonResponse(BaseModel):
+    model_config = {"protected_namespaces": ()}
+
+    model_run_id: int
+    season: str
+    fixtures: int
+    simulations: int
+    chunks: int
+    seconds: float
+    simulations_per_second: float
+    teams: List[TeamSimulation]
+
+
 def compute_features(home_team_id: int, away_team_id: int, match_date: date, db: Session):
     """Compute features for a match"""
     # Get matches before this date
@@ -107,95 +240,182 @@ def compute_features(home_team_id: int, away_team_id: int, match_date: date, db:
     ]])
 
 
+def get_features(home_team_id: int, away_team_id: int, match_date: date, db: Session):
+    """
+    Features for a prediction using the configured FEATURE_BACKEND. The
+    in-memory index falls back to the database for dates it cannot answer.
+    """
+    if settings.feature_backend == "sql":
+        return compute_features_sql(home_team_id, away_team_id, match_date, db)
+    if settings.feature_backend == "index":
+        team_form_index.ensure_current(db)
+        features = team_form_index.lookup(home_team_id, away_team_id, match_date)
+        if features is not None:
+            return features
+    return compute_features(home_team_id, away_team_id, match_date, db)
+
+
+def get_served_model(db: Session):
+    """The loaded active model, or 404"""
+    try:
+        loaded = model_registry.get(db)
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Model file not found")
+    if not loaded:
+        raise HTTPException(status_code=404, detail="No trained model found. Train a model first.")
+    return loaded
+
+
 @router.post("/train")
-def train_model(db: Session = Depends(get_db)):
-    """Train a multiclass classifier and store the model"""
-    # Get all matches with results
-    matches = db.query(Match).order_by(Match.date).all()
-
-    if len(matches) < 50:
-        raise HTTPException(
-            status_code=400,
-            detail="Not enough matches for training. Need at least 50 matches."
-        )
+def train_model(
+    response: Response,
+    mode: Literal["full", "incremental", "backtest"] = Query("full", description="full retrains on all history; incremental updates the latest model with matches added since its run; backtest scores walk-forward by season"),
+    estimator: Literal["logistic", "xgboost", "hist_gb", "sgd"] = Query("logistic", description="Model to fit (incremental runs keep the estimator of the model they update)"),
+    activate: bool = Query(True, description="Serve the new run once it is stored; false keeps the currently active run"),
+    wait: bool = Query(False, description="Block until training finishes and return the model run"),
+    session_factory=Depends(get_session_factory)
+):
+    """
+    Train a multiclass classifier and store the model as a background job.
+    A request while a training job with the same parameters is queued or
+    running joins that job; other requests queue behind it.
+    """
+    # Incremental runs keep the estimator of the model they update
+    key = f"train:{mode}:{'-' if mode == 'incremental' else estimator}:{activate}"
+    job, created = train_jobs.submit(
+        "train",
+        lambda job: run_training_job(job, session_factory, mode, estimator, activate),
+        key=key
+    )
 
-    # Prepare training data
-    X = []
-    y = []
+    if not wait:
+        response.status_code = 202
+        return {
+            "job_id": job.id,
+            "state": job.state,
+            "coalesced": not created
+        }
 
-    for match in matches:
-        features = compute_features(
-            match.home_team_id,
-            match.away_team_id,
-            match.date,
-            db
-        )
-        
-        # Skip if no historical data (first matches)
-        if features[0][0] == 0 and features[0][1] == 0 and features[0][2] == 0 and features[0][3] == 0:
-            continue
+    job.wait()
+    if job.state == "failed":
+        if isinstance(job.exception, ValueError):
+            raise HTTPException(status_code=400, detail=str(job.exception))
+        raise HTTPException(status_code=500, detail=f"Training failed: {job.exception}")
+    if job.state == "cancelled":
+        raise HTTPException(status_code=409, detail="Training was cancelled")
 
-        X.append(features[0])
+    return {
+        **job.result,
+        "job_id": job.id,
+        "message": "Model trained successfully"
+    }
 
-        # Determine outcome: 0=home win, 1=draw, 2=away win
-        if match.home_goals > match.away_goals:
-            y.append(0)
-        elif match.home_goals == match.away_goals:
-            y.append(1)
-        else:
-            y.append(2)
 
-    if len(X) < 30:
-        raise HTTPException(
-            status_code=400,
-            detail="Not enough matches with historical data for training."
-        )
+@router.post("/train/search")
+def search_models(
+    response: Response,
+    estimator: Literal["logistic", "xgboost", "hist_gb", "sgd"] = Query("logistic", description="Model whose hyperparameters are searched"),
+    strategy: Literal["grid", "random"] = Query("grid", description="Try the whole grid, or n_candidates sampled from it"),
+    n_candidates: int = Query(10, ge=1, le=100, description="Candidates for a random search"),
+    promote: bool = Query(False, description="Activate the candidate with the lowest log loss for serving"),
+    wait: bool = Query(False, description="Block until the search finishes and return the leaderboard"),
+    session_factory=Depends(get_session_factory)
+):
+    """
+    Fit hyperparameter candidates in parallel as a background job and store
+    every candidate as a model run. Poll it with GET /train/jobs/{job_id}.
+    """
+    job, created = train_jobs.submit(
+        "search",
+        lambda job: run_search_job(job, session_factory, estimator, strategy, n_candidates, promote),
+        key=f"search:{estimator}:{strategy}:{n_candidates if strategy == 'random' else '-'}:{promote}"
+    )
 
-    X = np.array(X)
-    y = np.array(y)
-
-    # Split data
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
-
-    # Train model
-    model = LogisticRegression(multi_class='multinomial', max_iter=1000, random_state=42)
-    model.fit(X_train, y_train)
-
-    # Evaluate
-    y_pred = model.predict(X_test)
-    accuracy = accuracy_score(y_test, y_pred)
-    y_proba = model.predict_proba(X_test)
-    log_loss_score = log_loss(y_test, y_proba)
-
-    # Save model
-    os.makedirs("/app/models", exist_ok=True)
-    model_path = f"/app/models/model_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.pkl"
-    with open(model_path, 'wb') as f:
-        pickle.dump(model, f)
-
-    # Store model run
-    metrics = {
-        "accuracy": float(accuracy),
-        "log_loss": float(log_loss_score),
-        "train_size": len(X_train),
-        "test_size": len(X_test)
+    if not wait:
+        response.status_code = 202
+        return {
+            "job_id": job.id,
+            "state": job.state,
+            "coalesced": not created
+        }
+
+    job.wait()
+    if job.state == "failed":
+        if isinstance(job.exception, ValueError):
+            raise HTTPException(status_code=400, detail=str(job.exception))
+        raise HTTPException(status_code=500, detail=f"Search failed: {job.exception}")
+    if job.state == "cancelled":
+        raise HTTPException(status_code=409, detail="Search was cancelled")
+
+    return {
+        **job.result,
+        "job_id": job.id,
+        "message": "Search completed"
     }
 
-    model_run = ModelRun(
-        metrics_json=metrics,
-        model_path=model_path
-    )
-    db.add(model_run)
-    db.commit()
 
+@router.get("/train/leaderboard")
+def get_leaderboard(
+    search_id: Optional[str] = Query(None, description="Only runs of this search (its job id)"),
+    limit: int = Query(20, ge=1, le=500),
+    db: Session = Depends(get_db)
+):
+    """Model runs sorted by log loss, best first"""
+    return leaderboard(db, search_id=search_id, limit=limit)
+
+
+@router.get("/train/jobs/{job_id}")
+def get_training_job(job_id: str):
+    """Get state, stage and result of a training job"""
+    job = train_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@router.post("/train/jobs/{job_id}/cancel")
+def cancel_training_job(job_id: str):
+    """Request cancellation of a training job; no model run is stored for it"""
+    job = train_jobs.cancel(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job.to_dict()
+
+
+@router.get("/models/active")
+def get_active_model(db: Session = Depends(get_db)):
+    """The model run /predict currently serves"""
+    loaded = get_served_model(db)
     return {
-        "message": "Model trained successfully",
-        "model_run_id": model_run.id,
-        "metrics": metrics,
-        "model_path": model_path
+        "model_run_id": loaded.run_id,
+        "activated_at": loaded.activated_at.isoformat(),
+        "loaded_at": loaded.loaded_at.isoformat(),
+        "metrics": loaded.metrics
     }
 
 
+@router.post("/models/{model_run_id}/activate")
+def activate_model(
+    model_run_id: int,
+    db: Session = Depends(get_db),
+    session_factory=Depends(get_session_factory)
+):
+    """
+    Serve a specific model run. It stays active until another run is
+    activated (training with activate=false leaves it in place).
+    """
+    model_run = db.query(ModelRun).filter(ModelRun.id == model_run_id).first()
+    if not model_run:
+        raise HTTPException(status_code=404, detail="Model run not found")
+    if not os.path.exists(model_run.model_path):
+        raise HTTPException(status_code=404, detail="Model file not found")
+
+    activate_run(db, model_run)
+    active = get_active_model(db)
+    pair_matrix.schedule(session_factory)
+    return active
+
+
 @router.post("/predict", response_model=PredictResponse)
 def predict_match(request: PredictRequest, db: Session = Depends(get_db)):
     """Make a prediction for a match"""
@@ -206,80 +426,64 @@ def predict_match(request: PredictRequest, db: Session = Depends(get_db)):
     if not home_team or not away_team:
         raise HTTPException(status_code=404, detail="Team not found")
 
-    # Get latest model
-    model_run = db.query(ModelRun).order_by(ModelRun.created_at.desc()).first()
-    if not model_run:
-        raise HTTPException(status_code=404, detail="No trained model found. Train a model first.")
-
-    # Load model
-    if not os.path.exists(model_run.model_path):
-        raise HTTPException(status_code=404, detail="Model file not found")
-
-    with open(model_run.model_path, 'rb') as f:
-        model = pickle.load(f)
+    # Get the model selected for serving, loaded once per activated run
+    loaded = get_served_model(db)
+    model = loaded.model
 
-    # Compute features (use today's date as reference)
+    # Use today's date as reference
     match_date = date.today()
-    features = compute_features(
-        request.home_team_id,
-        request.away_team_id,
-        match_date,
-        db
-    )
-
-    # Predict
-    probabilities = model.predict_proba(features)[0]
-    proba_home = float(probabilities[0])
-    proba_draw = float(probabilities[1])
-    proba_away = float(probabilities[2])
-
-    # Generate explanation using feature contributions
-    feature_names = [
-        "home_team_points_last5",
-        "away_team_points_last5",
-        "home_goal_diff_last5",
-        "away_goal_diff_last5",
-        "head_to_head_points_last3",
-        "home_advantage"
-    ]
-
-    # For LogisticRegression, compute feature contributions
-    # Contribution = coefficient * feature_value
-    explanations = {}
-    for i, feature_name in enumerate(feature_names):
-        # Average contribution across all classes
-        contributions = []
-        for class_idx in range(3):
-            coef = model.coef_[class_idx][i]
-            contrib = coef * features[0][i]
-            contributions.append(contrib)
-        
-        explanations[feature_name] = {
-            "value": float(features[0][i]),
-            "contribution": float(np.mean(contributions))
-        }
 
-    explanation = {
-        "feature_contributions": explanations,
-        "top_features": sorted(
-            explanations.items(),
-            key=lambda x: abs(x[1]["contribution"]),
-            reverse=True
-        )[:3]
-    }
-
-    # Store prediction
-    prediction = Prediction(
-        home_team_id=request.home_team_id,
-        away_team_id=request.away_team_id,
-        season=request.season,
-        proba_home=proba_home,
-        proba_draw=proba_draw,
-        proba_away=proba_away,
-        explanation_json=explanation
-    )
-    db.add(prediction)
-    db.commit()
+    # Reuse the result for the same fixture, model run and match data
+    team_form_index.ensure_current(db)
+    generation = (loaded.run_id, team_form_index.version)
+    cache_key = (request.home_team_id, request.away_team_id, match_date)
+    cached = prediction_cache.get(generation, cache_key)
+
+    if cached is not None:
+        proba_home, proba_draw, proba_away, explanation = cached
+    else:
+        # Precomputed for every team pair after training and ingestion; computed live when stale
+        precomputed = pair_matrix.lookup(
+            loaded.run_id,
+            team_form_index.match_count,
+            team_form_index.max_match_id,
+            request.home_team_id,
+            request.away_team_id,
+            match_date
+        )
+        if precomputed is not None:
+            probabilities, features_row, contributions_row = precomputed
+        else:
+            features = get_features(
+                request.home_team_id,
+                request.away_team_id,
+                match_date,
+                db
+            )
+
+            # Predict
+            probabilities = model.predict_proba(features)[0]
+
+            # Generate explanation using feature contributions
+            contributions = feature_contributions(model, features, probabilities[None, :])
+            features_row, contributions_row = features[0], contributions[0]
+
+        proba_home = float(probabilities[0])
+        proba_draw = float(probabilities[1])
+        proba_away = float(probabilities[2])
+        explanation = build_explanation(features_row, contributions_row)
+        prediction_cache.put(generation, cache_key, (proba_home, proba_draw, proba_away, explanation))
+
+    # Store prediction (in the background with async prediction logging)
+    log_predictions(db, [{
+        "home_team_id": request.home_team_id,
+        "away_team_id": request.away_team_id,
+        "season": request.season,
+        "proba_home": proba_home,
+        "proba_draw": proba_draw,
+        "proba_away": proba_away,
+        "explanation_json": explanation
+    }])
 
     return PredictResponse(
         home_team_id=request.home_team_id,
@@ -291,3 +495,129 @@ def predict_match(request: PredictRequest, db: Session = Depends(get_db)):
         explanation=explanation
     )
 
+
+@router.get("/predict/cache")
+def get_prediction_cache_stats():
+    """Hit/miss counters and size of the /predict result cache"""
+    return prediction_cache.stats()
+
+
+@router.get("/predict/log")
+def get_prediction_log_stats():
+    """State of prediction logging: mode, queued, written, dropped and failed rows"""
+    return prediction_log.stats()
+
+
+@router.post("/predict/batch", response_model=BatchPredictResponse)
+def predict_batch(request: BatchPredictRequest, db: Session = Depends(get_db)):
+    """
+    Predict a list of fixtures (match_date defaults to today). Features of
+    all fixtures are built in one pass over the involved teams' history,
+    the model is called once and all predictions are stored in one insert
+    (or queued for the background writer).
+    """
+    fixtures = pd.DataFrame([fixture.model_dump() for fixture in request.fixtures])
+    fixtures["date"] = fixtures["match_date"].fillna(date.today())
+
+    team_ids = set(fixtures["home_team_id"]) | set(fixtures["away_team_id"])
+    found = {team_id for (team_id,) in db.query(Team.id).filter(Team.id.in_(team_ids))}
+    if found != team_ids:
+        raise HTTPException(status_code=404, detail=f"Team not found: {sorted(team_ids - found)}")
+
+    loaded = get_served_model(db)
+    model = loaded.model
+
+    # Same values as compute_features for every fixture, from one history query
+    features = build_features(load_matches_frame(db, team_ids=team_ids), fixtures)
+    probabilities = model.predict_proba(features)
+    contributions = feature_contributions(model, features, probabilities)
+
+    records = [
+        {
+            "home_team_id": int(fixture.home_team_id),
+            "away_team_id": int(fixture.away_team_id),
+            "season": fixture.season,
+            "proba_home": float(proba[0]),
+            "proba_draw": float(proba[1]),
+            "proba_away": float(proba[2]),
+            "explanation_json": build_explanation(row, contribution)
+        }
+        for fixture, row, proba, contribution in zip(
+            fixtures.itertuples(index=False), features, probabilities, contributions
+        )
+    ]
+    log_predictions(db, records)
+
+    return BatchPredictResponse(
+        model_run_id=loaded.run_id,
+        predictions=[
+            BatchPrediction(
+                home_team_id=record["home_team_id"],
+                away_team_id=record["away_team_id"],
+                season=record["season"],
+                match_date=match_date,
+                proba_home=record["proba_home"],
+                proba_draw=record["proba_draw"],
+                proba_away=record["proba_away"],
+                explanation=record["explanation_json"]
+            )
+            for record, match_date in zip(records, fixtures["date"])
+        ]
+    )
+
+
+@router.post("/simulate/season", response_model=SimulateSeasonResponse)
+def simulate_season_table(request: SimulateSeasonRequest, db: Session = Depends(get_db)):
+    """
+    Finishing-position probabilities for a season: the current table from
+    the season's stored matches plus the remaining fixtures, predicted in
+    one batch by the served model and simulated n_simulations times.
+    Teams are listed by expected points.
+    """
+    fixtures = pd.DataFrame([fixture.model_dump() for fixture in request.fixtures])
+    fixtures["date"] = fixtures["match_date"].fillna(date.today())
+
+    history = load_matches_frame(db)
+    played = history[history["season"] == request.season]
+    team_ids = np.unique(np.concatenate([
+        played["home_team_id"], played["away_team_id"], fixtures["home_team_id"], fixtures["away_team_id"]
+    ]).astype(np.int64))
+    names = dict(db.query(Team.id, Team.name).filter(Team.id.in_(team_ids.tolist())))
+    missing = sorted(set(team_ids.tolist()) - set(names))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Team not found: {missing}")
+
+    loaded = get_served_model(db)
+    probabilities = loaded.model.predict_proba(build_features(history, fixtures))
+
+    table = season_table(team_ids, played)
+    result = simulate_season(table, fixtures, probabilities, request.n_simulations, request.seed)
+    distribution = result.position_counts / result.simulations
+    relegated = distribution[:, max(len(team_ids) - request.relegation, 0):].sum(axis=1)
+
+    teams = [
+        TeamSimulation(
+            team_id=int(team_id),
+            team_name=names[int(team_id)],
+            played=int(table.played[i]),
+            points=int(table.points[i]),
+            expected_points=round(float(result.expected_points[i]), 3),
+            title=float(distribution[i, 0]),
+            top=float(distribution[i, :request.top].sum()),
+            relegation=float(relegated[i]),
+            positions=distribution[i].tolist()
+        )
+        for i, team_id in enumerate(team_ids)
+    ]
+    teams.sort(key=lambda team: team.expected_points, reverse=True)
+
+    return SimulateSeasonResponse(
+        model_run_id=loaded.run_id,
+        season=request.season,
+        fixtures=len(fixtures),
+        simulations=result.simulations,
+        chunks=result.chunks,
+        seconds=round(result.seconds, 4),
+        simulations_per_second=round(result.simulations / result.seconds, 1),
+        teams=teams
+    )
@@ -0,0 +1,136 @@
+"""
+Monte Carlo simulation of the rest of a season.
+
+Each remaining fixture has the served model's (home, draw, away)
+probabilities. A chunk of simulated seasons draws one uniform number per
+season and fixture, turns the (seasons, fixtures) outcome matrix into
+points with two matrix products against home/away team indicators, and
+ranks every season's table with one argsort, so there is no Python loop
+over matches or seasons. Chunks are seeded from one SeedSequence and their
+counts summed, so results for a seed do not depend on how many
+SIMULATION_WORKERS threads run them (NumPy releases the GIL for this work).
+
+Simulated matches award points only; ties on points are broken by the
+current goal difference, then goals scored, then at random.
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from functools import partial
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from backend.config import settings
+from backend.features import match_outcomes
+
+
+@dataclass
+class SeasonTable:
+    team_ids: np.ndarray
+    played: np.ndarray
+    points: np.ndarray
+    goal_difference: np.ndarray
+    goals_for: np.ndarray
+
+
+@dataclass
+class SimulationResult:
+    # position_counts[t, p]: seasons in which team t finished in position p (0 = first)
+    position_counts: np.ndarray
+    expected_points: np.ndarray
+    simulations: int
+    chunks: int
+    seconds: float
+
+
+def season_table(team_ids: np.ndarray, played: pd.DataFrame) -> SeasonTable:
+    """Current table of team_ids (sorted) from a frame of played matches"""
+    home = np.searchsorted(team_ids, played["home_team_id"].to_numpy(np.int64))
+    away = np.searchsorted(team_ids, played["away_team_id"].to_numpy(np.int64))
+    home_goals = played["home_goals"].to_numpy(np.int64)
+    away_goals = played["away_goals"].to_numpy(np.int64)
+    outcomes = match_outcomes(home_goals, away_goals)
+    n = len(team_ids)
+
+    def per_team(home_values, away_values):
+        return (np.bincount(home, weights=home_values, minlength=n)
+                + np.bincount(away, weights=away_values, minlength=n)).astype(np.int64)
+
+    return SeasonTable(
+        team_ids=team_ids,
+        played=per_team(np.ones(len(home)), np.ones(len(away))),
+        points=per_team(np.choose(outcomes, [3, 1, 0]), np.choose(outcomes, [0, 1, 3])),
+        goal_difference=per_team(home_goals - away_goals, away_goals - home_goals),
+        goals_for=per_team(home_goals, away_goals)
+    )
+
+
+def _simulate_chunk(seed: np.random.SeedSequence, size: int, cumulative: np.ndarray, indicators: np.ndarray,
+                    points: np.ndarray, tie_break: np.ndarray, jitter: float) -> tuple:
+    """Position counts and summed final points of `size` simulated seasons"""
+    rng = np.random.default_rng(seed)
+    n_teams = len(points)
+    draws = rng.random((size, len(cumulative)), dtype=np.float32)
+    home_win, draw = draws < cumulative[:, 0], draws < cumulative[:, 1]
+    home_points = np.where(home_win, 3, np.where(draw, 1, 0)).astype(np.float32)
+    away_points = np.where(home_win, 0, np.where(draw, 1, 3)).astype(np.float32)
+
+    # (seasons, home and away results) @ (home and away results, teams) indicators -> points per season and team
+    final = points + np.hstack([home_points, away_points]) @ indicators
+
+    # Sort key: points, then the current-table tie break (< 1), then a random order within exact ties
+    key = final + tie_break + rng.random((size, n_teams), dtype=np.float32) * jitter
+    order = np.argsort(-key, axis=1)
+    positions = np.empty_like(order)
+    np.put_along_axis(positions, order, np.arange(n_teams)[None, :], axis=1)
+
+    counts = np.bincount((np.arange(n_teams)[None, :] * n_teams + positions).ravel(), minlength=n_teams * n_teams)
+    return counts.reshape(n_teams, n_teams), final.sum(axis=0, dtype=np.float64)
+
+
+def simulate_season(table: SeasonTable, fixtures: pd.DataFrame, probabilities: np.ndarray, n_simulations: int,
+                    seed: Optional[int] = None) -> SimulationResult:
+    """
+    Simulate the remaining fixtures (home_team_id, away_team_id; teams in
+    the table) n_simulations times with their (home, draw, away)
+    probabilities, in chunks of SIMULATION_CHUNK_SIZE seasons.
+    """
+    start = time.perf_counter()
+    n_teams = len(table.team_ids)
+    home = np.searchsorted(table.team_ids, fixtures["home_team_id"].to_numpy(np.int64))
+    away = np.searchsorted(table.team_ids, fixtures["away_team_id"].to_numpy(np.int64))
+    n_fixtures = len(fixtures)
+    indicators = np.zeros((2 * n_fixtures, n_teams), dtype=np.float32)
+    indicators[np.arange(n_fixtures), home] = 1
+    indicators[n_fixtures + np.arange(n_fixtures), away] = 1
+    cumulative = np.cumsum(probabilities[:, :2], axis=1).astype(np.float32)
+
+    # Dense rank of each team by (goal difference, goals for), spaced `gap` apart below one point; teams
+    # level on both share a rank, so the jitter (< gap) orders them at random
+    _, tie_rank = np.unique(np.column_stack([table.goal_difference, table.goals_for]), axis=0,
+                            return_inverse=True)
+    tie_rank = tie_rank.reshape(-1)
+    gap = 0.5 / n_teams
+    tie_break = (tie_rank * gap).astype(np.float32)
+
+    chunk_size = max(1, settings.simulation_chunk_size)
+    sizes = [chunk_size] * (n_simulations // chunk_size)
+    if n_simulations % chunk_size:
+        sizes.append(n_simulations % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    run_chunk = partial(_simulate_chunk, cumulative=cumulative, indicators=indicators,
+                        points=table.points.astype(np.float32), tie_break=tie_break, jitter=gap / 2)
+    with ThreadPoolExecutor(max_workers=settings.simulation_workers or os.cpu_count()) as pool:
+        results = list(pool.map(run_chunk, seeds, sizes))
+
+    return SimulationResult(
+        position_counts=sum(counts for counts, _ in results),
+        expected_points=sum(points for _, points in results) / n_simulations,
+        simulations=n_simulations,
+        chunks=len(sizes),
+        seconds=time.perf_counter() - start
+    )
@@ -0,0 +1,531 @@
+"""
+Model training as a background job.
+
+The job runs on a JobManager thread of the API process and only reads the
+training matrix there; fitting and evaluation are sent to a process pool so
+they do not hold the API process's GIL. The ModelRun row is written only
+when every stage succeeds.
+
+A full run fits on all history. An incremental run continues training the
+latest model (one that supports partial_fit, i.e. sgd) on only the matches
+added since it was trained (metrics_json records the highest match id each
+run has trained on). A backtest run scores the
+model walk-forward, training on the seasons before each season and testing
+on it, with the folds fitted in parallel on the pool. A search fits many
+hyperparameter candidates in parallel and stores every candidate as a run.
+Backtest folds and search candidates read the training data snapshot
+(backend/datasets.py) memory-mapped in the pool workers.
+
+sklearn is imported where training uses it, so the API process only loads
+it once a model is trained or a pickled model is served.
+
+Only activated runs are served (see backend/model_registry.py); full,
+incremental and backtest runs are activated when stored unless the caller
+opts out, search candidates only when promoted. Activating a run also
+schedules a rebuild of the all-pairs prediction matrix
+(backend/pair_matrix.py).
+"""
+import os
+import pickle
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from datetime import datetime
+from typing import List, Optional
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from backend.artifacts import export_linear
+from backend.config import settings
+from backend.datasets import load_snapshot, training_snapshot
+from backend.estimators import DEFAULT_ESTIMATOR, SEARCH_SPACES, estimator_name, make_estimator, supports_update
+from backend.jobs import Job
+from backend.model_registry import activate_run, model_registry
+from backend.models import Match, ModelRun
+from backend.pair_matrix import pair_matrix
+
+MODELS_DIR = "/app/models"
+
+# Share of an incremental run's new matches (the latest ones) held out to score it
+INCREMENTAL_TEST_FRACTION = 0.2
+
+# Single-row predictions timed (median taken) to measure serving latency
+LATENCY_SAMPLES = 20
+
+# How often a job waiting on the process pool checks for cancellation
+CANCEL_POLL_SECONDS = 0.1
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def get_training_pool() -> ProcessPoolExecutor:
+    """Process pool for fitting, created on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=settings.train_workers)
+        return _pool
+
+
+def shutdown_training_pool():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def fit_model(X_train: np.ndarray, y_train: np.ndarray, estimator: str = DEFAULT_ESTIMATOR,
+              params: Optional[dict] = None) -> tuple:
+    """Fit a new estimator. Returns (model, fit seconds)."""
+    model = make_estimator(estimator, params)
+    start = time.perf_counter()
+    model.fit(X_train, y_train)
+    return model, round(time.perf_counter() - start, 3)
+
+
+def update_model(model, X_new: np.ndarray, y_new: np.ndarray) -> tuple:
+    """
+    Continue training a fitted model on new samples with partial_fit, which
+    takes SGD steps from the current coefficients (with the learning rate
+    schedule where it left off) instead of refitting. Returns (model, fit
+    seconds).
+    """
+    start = time.perf_counter()
+    model.partial_fit(X_new, y_new, classes=model.classes_)
+    return model, round(time.perf_counter() - start, 3)
+
+
+def evaluate_model(model, X_test: np.ndarray, y_test: np.ndarray) -> dict:
+    """Accuracy and log loss on a test set, plus the latency of a single-row prediction"""
+    from sklearn.metrics import accuracy_score, log_loss
+
+    y_proba = model.predict_proba(X_test)
+    y_pred = model.classes_[y_proba.argmax(axis=1)]
+
+    timings = []
+    for _ in range(LATENCY_SAMPLES):
+        start = time.perf_counter()
+        model.predict_proba(X_test[:1])
+        timings.append(time.perf_counter() - start)
+
+    return {
+        "accuracy": float(accuracy_score(y_test, y_pred)),
+        "log_loss": float(log_loss(y_test, y_proba, labels=model.classes_)),
+        "predict_latency_ms": round(float(np.median(timings)) * 1000, 3)
+    }
+
+
+def fit_snapshot(snapshot: str, estimator: str = DEFAULT_ESTIMATOR) -> tuple:
+    """fit_model on all rows of a training data snapshot"""
+    X, y, _, _ = load_snapshot(snapshot)
+    return fit_model(X, y, estimator)
+
+
+def run_fold(snapshot: str, season: str, estimator: str = DEFAULT_ESTIMATOR) -> dict:
+    """Fit on the seasons before `season` and score on it, timing the fold"""
+    start = time.perf_counter()
+    X, y, _, seasons = load_snapshot(snapshot)
+    train, test = seasons < season, seasons == season
+    model, fit_seconds = fit_model(X[train], y[train], estimator)
+    scores = evaluate_model(model, X[test], y[test])
+    return {**scores, "fit_seconds": fit_seconds, "seconds": round(time.perf_counter() - start, 3)}
+
+
+def run_candidate(snapshot: str, estimator: str, params: dict) -> tuple:
+    """
+    Fit and score one search candidate on the same split as a full run.
+    Returns (model, scores).
+    """
+    from sklearn.model_selection import train_test_split
+
+    X, y, _, _ = load_snapshot(snapshot)
+    train_idx, test_idx = train_test_split(np.arange(len(y)), test_size=0.2, random_state=42)
+    model, fit_seconds = fit_model(X[train_idx], y[train_idx], estimator, params)
+    scores = evaluate_model(model, X[test_idx], y[test_idx])
+    return model, {**scores, "fit_seconds": fit_seconds, "train_size": len(train_idx), "test_size": len(test_idx)}
+
+
+def search_candidates(estimator: str, strategy: str, n_candidates: int) -> List[dict]:
+    """Hyperparameter sets to try: the whole grid, or n_candidates sampled from it"""
+    from sklearn.model_selection import ParameterGrid, ParameterSampler
+
+    grid = ParameterGrid(SEARCH_SPACES[estimator])
+    if strategy == "random" and n_candidates < len(grid):
+        return list(ParameterSampler(SEARCH_SPACES[estimator], n_iter=n_candidates, random_state=42))
+    return list(grid)
+
+
+def await_result(job: Job, future: Future):
+    """
+    Wait for a pool future while watching for cancellation. On cancel the
+    future is cancelled if still pending (a running fit cannot be
+    interrupted; its result is discarded) and None is returned.
+    """
+    while True:
+        try:
+            return future.result(timeout=CANCEL_POLL_SECONDS)
+        except TimeoutError:
+            if job.cancel_requested:
+                future.cancel()
+                return None
+
+
+def await_all(job: Job, futures: List[Future]) -> Optional[list]:
+    """await_result for several futures; on cancel the remaining ones are cancelled too"""
+    results = []
+    for future in futures:
+        result = await_result(job, future)
+        if result is None:
+            for pending in futures:
+                pending.cancel()
+            return None
+        results.append(result)
+    return results
+
+
+def save_model(model) -> str:
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    model_path = os.path.join(MODELS_DIR, f"model_{datetime.utcnow().strftime('%Y%m%d_%H%M%S_%f')}.pkl")
+    with open(model_path, 'wb') as f:
+        pickle.dump(model, f)
+    export_linear(model, model_path)
+    return model_path
+
+
+def active_model_run(db: Session) -> Optional[ModelRun]:
+    """The run /predict serves: the most recently activated one"""
+    return db.query(ModelRun).filter(ModelRun.activated_at.isnot(None)).order_by(
+        ModelRun.activated_at.desc(), ModelRun.id.desc()
+    ).first()
+
+
+def _store_run(db: Session, model, metrics: dict) -> dict:
+    model_path = save_model(model)
+    model_run = ModelRun(
+        metrics_json=metrics,
+        model_path=model_path
+    )
+    db.add(model_run)
+    db.commit()
+
+    return {
+        "model_run": model_run,
+        "model_run_id": model_run.id,
+        "metrics": metrics,
+        "model_path": model_path
+    }
+
+
+def _load_matrix(job: Job, db: Session):
+    """
+    Snapshot path and its memory-mapped (X, y, match ids, seasons), built
+    from the feature store when the data changed since the last run
+    """
+    job.stage = "loading"
+    if db.query(Match).count() < 50:
+        raise ValueError("Not enough matches for training. Need at least 50 matches.")
+
+    # Read the precomputed feature matrix; matches without historical
+    # data (first matches) are skipped
+    snapshot = training_snapshot(db)
+    X, y, ids, seasons = load_snapshot(snapshot)
+    if len(X) < 30:
+        raise ValueError("Not enough matches with historical data for training.")
+    return snapshot, X, y, ids, seasons
+
+
+def train_full(job: Job, db: Session, estimator: str = DEFAULT_ESTIMATOR) -> Optional[dict]:
+    """Fit a new model on all history"""
+    from sklearn.model_selection import train_test_split
+
+    _, X, y, ids, _ = _load_matrix(job, db)
+    job.rows_processed = len(X)
+    if job.cancel_requested:
+        return None
+
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42)
+    pool = get_training_pool()
+
+    job.stage = "fitting"
+    fitted = await_result(job, pool.submit(fit_model, X_train, y_train, estimator))
+    if fitted is None:
+        return None
+    model, fit_seconds = fitted
+
+    job.stage = "evaluating"
+    scores = await_result(job, pool.submit(evaluate_model, model, X_test, y_test))
+    if scores is None or job.cancel_requested:
+        return None
+
+    job.stage = "saving"
+    return _store_run(db, model, {
+        **scores,
+        "mode": "full",
+        "estimator": estimator,
+        "fit_seconds": fit_seconds,
+        "train_size": len(X_train),
+        "test_size": len(X_test),
+        "max_match_id": int(ids.max())
+    })
+
+
+def train_incremental(job: Job, db: Session) -> Optional[dict]:
+    """
+    Update the latest model with the matches added since its run. The
+    latest INCREMENTAL_TEST_FRACTION of those matches are held out: the
+    reported scores are on them, before (parent_*) and after the update,
+    and the run's max_match_id stops before them so the next incremental
+    run trains on them.
+    """
+    parent = active_model_run(db)
+    if parent is None:
+        raise ValueError("No trained model to update. Run a full training first.")
+    parent_max_id = (parent.metrics_json or {}).get("max_match_id")
+    if parent_max_id is None:
+        raise ValueError(f"Model run {parent.id} does not record its matches. Run a full training first.")
+    if not os.path.exists(parent.model_path):
+        raise ValueError(f"Model file of run {parent.id} not found")
+    with open(parent.model_path, 'rb') as f:
+        model = pickle.load(f)
+    if not supports_update(model):
+        raise ValueError(f"{estimator_name(model)} models cannot be updated incrementally; "
+                         f"train with estimator=sgd or run a full training")
+
+    _, X, y, match_ids, _ = _load_matrix(job, db)
+    new = np.flatnonzero(match_ids > parent_max_id)
+    job.rows_processed = len(new)
+    if len(new) == 0:
+        raise ValueError(f"No new matches since model run {parent.id}")
+    if len(new) < 2:
+        raise ValueError(f"Only one new match since model run {parent.id}; at least two are needed to "
+                         f"train and score an update")
+    new = new[np.argsort(match_ids[new], kind="stable")]
+    n_test = max(1, int(round(len(new) * INCREMENTAL_TEST_FRACTION)))
+    train_rows, test_rows = new[:-n_test], new[-n_test:]
+    X_train, y_train, X_test, y_test = X[train_rows], y[train_rows], X[test_rows], y[test_rows]
+    if job.cancel_requested:
+        return None
+    pool = get_training_pool()
+
+    job.stage = "evaluating"
+    parent_scores = await_result(job, pool.submit(evaluate_model, model, X_test, y_test))
+    if parent_scores is None:
+        return None
+
+    job.stage = "fitting"
+    fitted = await_result(job, pool.submit(update_model, model, X_train, y_train))
+    if fitted is None:
+        return None
+    model, fit_seconds = fitted
+
+    job.stage = "evaluating"
+    scores = await_result(job, pool.submit(evaluate_model, model, X_test, y_test))
+    if scores is None or job.cancel_requested:
+        return None
+
+    job.stage = "saving"
+    return _store_run(db, model, {
+        **scores,
+        "parent_accuracy": parent_scores["accuracy"],
+        "parent_log_loss": parent_scores["log_loss"],
+        "mode": "incremental",
+        "estimator": estimator_name(model),
+        "fit_seconds": fit_seconds,
+        "parent_run_id": parent.id,
+        "new_samples": len(train_rows),
+        "test_size": len(test_rows),
+        "train_size": (parent.metrics_json or {}).get("train_size", 0) + len(train_rows),
+        "max_match_id": int(match_ids[train_rows].max())
+    })
+
+
+def train_backtest(job: Job, db: Session, estimator: str = DEFAULT_ESTIMATOR) -> Optional[dict]:
+    """
+    Walk-forward backtest: for each season S, fit on the seasons before S
+    and score on S. All folds and the final model (fitted on every season)
+    run in parallel on the training pool from the one data snapshot.
+    Seasons whose earlier seasons do not cover every outcome are skipped.
+    """
+    snapshot, X, y, ids, seasons = _load_matrix(job, db)
+    job.rows_processed = len(X)
+
+    folds = []
+    for season in np.unique(seasons):
+        train, test = seasons < season, seasons == season
+        if len(np.unique(y[train])) == len(np.unique(y)):
+            folds.append((str(season), train, test))
+    if not folds:
+        raise ValueError("Backtesting needs earlier seasons that include every outcome before a test season")
+    if job.cancel_requested:
+        return None
+
+    pool = get_training_pool()
+    job.stage = "fitting"
+    model_future = pool.submit(fit_snapshot, snapshot, estimator)
+    fold_futures = [pool.submit(run_fold, snapshot, season, estimator) for season, _, _ in folds]
+
+    job.stage = "evaluating"
+    fold_scores = await_all(job, fold_futures + [model_future])
+    if fold_scores is None or job.cancel_requested:
+        return None
+    model, fit_seconds = fold_scores.pop()
+
+    fold_metrics = [
+        {"season": season, "train_size": int(train.sum()), "test_size": int(test.sum()), **scores}
+        for (season, train, test), scores in zip(folds, fold_scores)
+    ]
+    test_sizes = np.array([fold["test_size"] for fold in fold_metrics])
+
+    job.stage = "saving"
+    return _store_run(db, model, {
+        # Overall scores weight each fold by its number of test matches
+        "accuracy": float(np.average([fold["accuracy"] for fold in fold_metrics], weights=test_sizes)),
+        "log_loss": float(np.average([fold["log_loss"] for fold in fold_metrics], weights=test_sizes)),
+        "predict_latency_ms": float(np.median([fold["predict_latency_ms"] for fold in fold_metrics])),
+        "mode": "backtest",
+        "estimator": estimator,
+        "fit_seconds": fit_seconds,
+        "folds": fold_metrics,
+        "train_size": len(X),
+        "test_size": int(test_sizes.sum()),
+        "max_match_id": int(ids.max())
+    })
+
+
+def train_search(job: Job, db: Session, estimator: str = DEFAULT_ESTIMATOR, strategy: str = "grid",
+                 n_candidates: int = 10, promote: bool = False) -> Optional[dict]:
+    """
+    Fit every candidate configuration in parallel on the training pool and
+    store each as a ModelRun tagged with the job id as search_id. With
+    promote, the candidate with the lowest log loss is activated for serving.
+    """
+    snapshot, X, y, ids, _ = _load_matrix(job, db)
+    job.rows_processed = len(X)
+    candidates = search_candidates(estimator, strategy, n_candidates)
+    if job.cancel_requested:
+        return None
+
+    pool = get_training_pool()
+    job.stage = "searching"
+    results = await_all(job, [pool.submit(run_candidate, snapshot, estimator, params) for params in candidates])
+    if results is None or job.cancel_requested:
+        return None
+
+    job.stage = "saving"
+    max_match_id = int(ids.max())
+    runs = []
+    for params, (model, scores) in zip(candidates, results):
+        run = ModelRun(
+            metrics_json={
+                **scores,
+                "mode": "search",
+                "search_id": job.id,
+                "estimator": estimator,
+                "params": params,
+                "max_match_id": max_match_id
+            },
+            model_path=save_model(model)
+        )
+        db.add(run)
+        runs.append(run)
+
+    runs.sort(key=lambda run: run.metrics_json["log_loss"])
+    db.commit()
+    if promote:
+        activate_run(db, runs[0])
+
+    active = active_model_run(db)
+    return {
+        "search_id": job.id,
+        "candidates": len(runs),
+        "best_run_id": runs[0].id,
+        "promoted": promote,
+        "leaderboard": [leaderboard_entry(run, active) for run in runs]
+    }
+
+
+def leaderboard_entry(run: ModelRun, active: Optional[ModelRun] = None) -> dict:
+    metrics = run.metrics_json or {}
+    return {
+        "model_run_id": run.id,
+        "created_at": run.created_at.isoformat() if run.created_at else None,
+        "mode": metrics.get("mode"),
+        "search_id": metrics.get("search_id"),
+        "estimator": metrics.get("estimator", "logistic"),
+        "params": metrics.get("params", {}),
+        "accuracy": metrics.get("accuracy"),
+        "log_loss": metrics.get("log_loss"),
+        "fit_seconds": metrics.get("fit_seconds"),
+        "predict_latency_ms": metrics.get("predict_latency_ms"),
+        "active": active is not None and run.id == active.id
+    }
+
+
+def leaderboard(db: Session, search_id: Optional[str] = None, limit: int = 20) -> List[dict]:
+    """Model runs with a log loss, best first, optionally limited to one search"""
+    runs = [
+        run for run in db.query(ModelRun).all()
+        if (run.metrics_json or {}).get("log_loss") is not None
+        and (search_id is None or run.metrics_json.get("search_id") == search_id)
+    ]
+    runs.sort(key=lambda run: (run.metrics_json["log_loss"], run.id))
+    active = active_model_run(db)
+    return [leaderboard_entry(run, active) for run in runs[:limit]]
+
+
+def train(job: Job, db: Session, mode: str = "full", estimator: str = DEFAULT_ESTIMATOR,
+          activate: bool = True) -> Optional[dict]:
+    """
+    Train and store a model, reporting the stage on the job, and activate
+    it for serving unless activate is False (e.g. while a run is pinned).
+    Raises ValueError when there is not enough data. Returns None if the
+    job was cancelled, in which case nothing is stored. Incremental runs
+    keep the estimator of the model they update.
+    """
+    if mode == "incremental":
+        result = train_incremental(job, db)
+    elif mode == "backtest":
+        result = train_backtest(job, db, estimator)
+    else:
+        result = train_full(job, db, estimator)
+    if result is None:
+        return None
+
+    model_run = result.pop("model_run")
+    if activate:
+        activate_run(db, model_run)
+    return {**result, "activated": activate}
+
+
+def run_training_job(job: Job, session_factory, mode: str = "full", estimator: str = DEFAULT_ESTIMATOR,
+                     activate: bool = True) -> Optional[dict]:
+    """Body of a background training job"""
+    db = session_factory()
+    try:
+        result = train(job, db, mode, estimator, activate)
+        if result is not None and result["activated"]:
+            # Load the new run before the job completes, so requests after it serve that run
+            model_registry.get(db)
+    finally:
+        db.close()
+    if result is not None and result["activated"]:
+        pair_matrix.schedule(session_factory)
+    return result
+
+
+def run_search_job(job: Job, session_factory, estimator: str, strategy: str, n_candidates: int,
+                   promote: bool) -> Optional[dict]:
+    """Body of a background hyperparameter search job"""
+    db = session_factory()
+    try:
+        result = train_search(job, db, estimator, strategy, n_candidates, promote)
+        if result is not None and result["promoted"]:
+            model_registry.get(db)
+    finally:
+        db.close()
+    if result is not None and result["promoted"]:
+        pair_matrix.schedule(session_factory)
+    return result
@@ -1,8 +1,10 @@
 #!/usr/bin/env python3
 """
-CLI script to ingest CSV data into the database.
-Usage: python -m scripts.ingest [csv_path]
+CLI script to ingest match data (CSV, .csv.gz/.csv.zst, Parquet, Arrow IPC) into the database.
+Usage: python -m scripts.ingest [csv_path] [--stream] [--chunk-size N] [--no-resume] [--incremental]
+       python -m scripts.ingest <directory|glob> [--workers N] [--incremental]
 """
+import argparse
 import sys
 import os
 
@@ -10,14 +12,13 @@ import os
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
-import pandas as pd
 from backend.database import SessionLocal
-from backend.models import Team, Match
+from backend.ingestion import ingest_path, ingest_incremental, ingest_csv_stream, expand_sources, ingest_files
 
 
-def ingest_csv(csv_path: str = None):
-    """Ingest CSV data into teams and matches tables"""
+def ingest_csv(csv_path: str = None, stream: bool = False, chunk_size: int = None, resume: bool = True,
+               incremental: bool = False):
+    """Ingest a data file into teams and matches tables"""
     if csv_path is None:
         csv_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "sample_matches.csv")
 
@@ -27,79 +28,106 @@ def ingest_csv(csv_path: str = None):
 
     db: Session = SessionLocal()
 
-    try:
-        df = pd.read_csv(csv_path)
-    except Exception as e:
-        print(f"Error reading CSV: {e}")
-        sys.exit(1)
+    if stream:
+        def report(totals):
+            print(f"  ... {totals['rows_processed']} rows committed ({totals['chunks']} chunks)")
+
+        try:
+            result = ingest_csv_stream(csv_path, db, chunk_size=chunk_size, resume=resume, on_chunk=report)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        finally:
+            db.close()
+
+        if result["resumed_from_byte"]:
+            print(f"Resumed from byte offset {result['resumed_from_byte']}")
+    else:
+        try:
+            result = ingest_incremental(csv_path, db) if incremental else ingest_path(csv_path, db)
+        except ValueError as e:
+            print(f"Error: {e}")
+            sys.exit(1)
+        except Exception as e:
+            print(f"Error reading {csv_path}: {e}")
+            sys.exit(1)
 
-    # Required columns
-    required_cols = ["date", "season", "home_team", "away_team", "home_goals", "away_goals"]
-    if not all(col in df.columns for col in required_cols):
-        print(f"Error: CSV must contain columns: {', '.join(required_cols)}")
+        db.commit()
+        db.close()
+
+    if result.get("file_unchanged"):
+        print("File unchanged since the last ingest, skipped")
+        return
+
+    print(f"Ingestion completed:")
+    if result.get("rows_below_watermark"):
+        print(f"  Rows before watermark (skipped): {result['rows_below_watermark']}")
+    print(f"  Teams created: {result['teams_created']}")
+    print(f"  Matches created: {result['matches_created']}")
+    print(f"  Matches skipped (duplicates): {result['matches_skipped']}")
+    print_rejected(result)
+
+
+def print_rejected(result: dict):
+    """Print the rejected-rows summary of an ingest result"""
+    if not result.get("rows_rejected"):
+        return
+    print(f"  Rows rejected: {result['rows_rejected']}")
+    for entry in result["rejected"][:10]:
+        print(f"    row {entry['row']}: {entry['reason']}")
+
+
+def ingest_many(pattern: str, workers: int = None, incremental: bool = False):
+    """Ingest every data file in a directory or matching a glob, parsing files in parallel"""
+    paths = expand_sources(pattern)
+    if not paths:
+        print(f"Error: no data files match: {pattern}")
         sys.exit(1)
 
-    teams_created = 0
-    matches_created = 0
-    matches_skipped = 0
-
-    for _, row in df.iterrows():
-        # Get or create home team
-        home_team = db.query(Team).filter(Team.name == row["home_team"]).first()
-        if not home_team:
-            home_team = Team(name=row["home_team"])
-            db.add(home_team)
-            db.flush()
-            teams_created += 1
-
-        # Get or create away team
-        away_team = db.query(Team).filter(Team.name == row["away_team"]).first()
-        if not away_team:
-            away_team = Team(name=row["away_team"])
-            db.add(away_team)
-            db.flush()
-            teams_created += 1
-
-        # Parse date
-        try:
-            match_date = pd.to_datetime(row["date"]).date()
-        except:
-            print(f"Warning: Skipping row with invalid date: {row.get('date', 'unknown')}")
-            continue
-
-        # Check if match already exists (dedupe by date + teams)
-        existing_match = db.query(Match).filter(
-            and_(
-                Match.date == match_date,
-                Match.home_team_id == home_team.id,
-                Match.away_team_id == away_team.id
-            )
-        ).first()
-
-        if not existing_match:
-            match = Match(
-                date=match_date,
-                season=str(row["season"]),
-                home_team_id=home_team.id,
-                away_team_id=away_team.id,
-                home_goals=int(row["home_goals"]),
-                away_goals=int(row["away_goals"])
-            )
-            db.add(match)
-            matches_created += 1
+    db: Session = SessionLocal()
+    try:
+        result = ingest_files(paths, db, workers=workers, incremental=incremental)
+    finally:
+        db.close()
+
+    for path, report in result["files"].items():
+        if "error" in report:
+            print(f"  {path}: failed ({report['error']})")
+        elif report.get("file_unchanged"):
+            print(f"  {path}: unchanged, skipped")
         else:
-            matches_skipped += 1
+            print(
+                f"  {path}: {report['rows']} rows, {report['matches_created']} created, "
+                f"{report['matches_skipped']} skipped, {report['rows_rejected']} rejected "
+                f"(parsed in {report['parse_seconds']}s)"
+            )
 
-    db.commit()
-    db.close()
+    print(f"Ingestion completed ({len(paths)} files, written in {result['write_seconds']}s):")
+    print(f"  Teams created: {result['teams_created']}")
+    print(f"  Matches created: {result['matches_created']}")
+    print(f"  Matches skipped (duplicates): {result['matches_skipped']}")
 
-    print(f"Ingestion completed:")
-    print(f"  Teams created: {teams_created}")
-    print(f"  Matches created: {matches_created}")
-    print(f"  Matches skipped (duplicates): {matches_skipped}")
 
+def is_multi_source(csv_path: str) -> bool:
+    return csv_path is not None and (os.path.isdir(csv_path) or any(c in csv_path for c in "*?["))
 
-if __name__ == "__main__":
-    csv_path = sys.argv[1] if len(sys.argv) > 1 else None
-    ingest_csv(csv_path)
 
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ingest match data into the database")
+    parser.add_argument("csv_path", nargs="?", default=None, help="Path to a data file, directory or glob")
+    parser.add_argument("--stream", action="store_true", help="Read in chunks with per-chunk commits and checkpoints")
+    parser.add_argument("--chunk-size", type=int, default=None, help="Rows per chunk in stream mode")
+    parser.add_argument("--no-resume", action="store_true", help="Ignore an existing checkpoint and start over")
+    parser.add_argument("--workers", type=int, default=None, help="Parser processes for directory/glob ingest")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Skip unchanged files and rows before the per-season watermarks")
+    args = parser.parse_args()
+
+    if args.stream and args.incremental:
+        parser.error("--stream and --incremental cannot be combined")
+
+    if is_multi_source(args.csv_path):
+        ingest_many(args.csv_path, workers=args.workers, incremental=args.incremental)
+    else:
+        ingest_csv(args.csv_path, stream=args.stream, chunk_size=args.chunk_size, resume=not args.no_resume,
+                   incremental=args.incremental)
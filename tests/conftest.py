@@ -3,9 +3,13 @@ from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from fastapi.testclient import TestClient
 
-from backend.database import Base, get_db
+from backend.database import Base, get_db, get_session_factory
 from backend.main import app
 from backend.config import settings
+from backend.feature_index import team_form_index
+from backend.model_registry import model_registry
+from backend.pair_matrix import pair_matrix
+from backend.routers.ml import prediction_cache
 
 
 # Use in-memory SQLite for testing
@@ -15,13 +19,27 @@ TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engin
 
 
 @pytest.fixture(scope="function")
-def db():
+def db(tmp_path):
     """Create a fresh database for each test"""
     Base.metadata.create_all(bind=engine)
+    # Each test database starts at the same ids, so cached training data must not be shared
+    settings.dataset_cache_dir = str(tmp_path / "datasets")
+    # Tests write matches directly, so revalidate the feature index on every lookup
+    settings.feature_index_ttl_seconds = 0
+    team_form_index.reset()
+    settings.registry_ttl_seconds = 0
+    model_registry.reset()
+    settings.pair_matrix_path = str(tmp_path / "pair_matrix.npz")
+    pair_matrix.reset()
+    prediction_cache.clear()
+    # Predictions are committed in the request unless a test starts the background writer
+    settings.prediction_log_mode = "sync"
     db = TestingSessionLocal()
     try:
         yield db
     finally:
+        # A pair matrix rebuild scheduled by the test must not outlive its database
+        pair_matrix.wait()
         db.close()
         Base.metadata.drop_all(bind=engine)
 
@@ -36,7 +54,11 @@ def client(db):
             pass
 
     app.dependency_overrides[get_db] = override_get_db
+    app.dependency_overrides[get_session_factory] = lambda: TestingSessionLocal
+    session_factory = app.state.session_factory
+    app.state.session_factory = TestingSessionLocal
     with TestClient(app) as test_client:
         yield test_client
     app.dependency_overrides.clear()
+    app.state.session_factory = session_factory
 
@@ -0,0 +1,246 @@
+import random
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy.orm import Session
+
+from backend import datasets
+from backend.feature_index import TeamFormIndex, team_form_index
+from backend.features import (
+    FEATURE_NAMES,
+    build_features,
+    build_training_set,
+    compute_features_sql,
+    is_feature_store_current,
+    load_matches_frame,
+    load_training_set,
+)
+from backend.ingestion import ingest_dataframe
+from backend.models import Team, Match, MatchFeature
+from backend.routers.ml import compute_features
+
+
+@pytest.fixture
+def league_history(db: Session):
+    """Create a few rounds of a league: several matches per date, no team twice on one date"""
+    rng = random.Random(7)
+    teams = [Team(name=f"Team{i}") for i in range(8)]
+    db.add_all(teams)
+    db.commit()
+
+    day = date(2022, 8, 1)
+    for _ in range(30):
+        order = teams[:]
+        rng.shuffle(order)
+        # Leave one pair out now and then so pairs and teams have uneven histories
+        pairs = [(order[i], order[i + 1]) for i in range(0, 8, 2)][:rng.choice([3, 4])]
+        for home, away in pairs:
+            db.add(Match(
+                date=day,
+                season="2022-23",
+                home_team_id=home.id,
+                away_team_id=away.id,
+                home_goals=rng.randint(0, 4),
+                away_goals=rng.randint(0, 3)
+            ))
+        day += timedelta(days=rng.choice([3, 4, 7]))
+    db.commit()
+    return teams
+
+
+def test_build_features_matches_compute_features(db: Session, league_history):
+    """Test that the vectorized builder reproduces compute_features for every match"""
+    matches = load_matches_frame(db)
+    batch = build_features(matches, matches)
+
+    for i, match in enumerate(matches.itertuples()):
+        expected = compute_features(match.home_team_id, match.away_team_id, match.date, db)[0]
+        np.testing.assert_array_equal(batch[i], expected)
+
+
+def test_build_features_for_future_fixtures(db: Session, league_history):
+    """Test parity for fixtures after the last match, including every ordered pair"""
+    matches = load_matches_frame(db)
+    team_ids = [team.id for team in league_history]
+    fixtures = pd.DataFrame(
+        [(h, a, date(2024, 1, 1)) for h in team_ids for a in team_ids if h != a],
+        columns=["home_team_id", "away_team_id", "date"]
+    )
+    batch = build_features(matches, fixtures)
+
+    for i, fixture in enumerate(fixtures.itertuples()):
+        expected = compute_features(fixture.home_team_id, fixture.away_team_id, fixture.date, db)[0]
+        np.testing.assert_array_equal(batch[i], expected)
+
+
+def test_compute_features_sql_matches_compute_features(db: Session, league_history):
+    """Test that the window-function query reproduces compute_features on past and future dates"""
+    matches = load_matches_frame(db)
+    fixtures = [(m.home_team_id, m.away_team_id, m.date) for m in matches.itertuples()]
+    fixtures += [(home.id, away.id, date(2024, 1, 1)) for home in league_history[:3] for away in league_history
+                 if home.id != away.id]
+
+    for home_team_id, away_team_id, match_date in fixtures:
+        np.testing.assert_array_equal(
+            compute_features_sql(home_team_id, away_team_id, match_date, db),
+            compute_features(home_team_id, away_team_id, match_date, db)
+        )
+
+
+def test_build_training_set_skips_matches_without_history(db: Session, league_history):
+    """Test that the first matches of the history are left out of the training set"""
+    matches = load_matches_frame(db)
+    X, y, kept = build_training_set(matches)
+
+    assert len(X) == len(y) == len(kept)
+    assert len(kept) < len(matches)
+    assert not np.any(np.all(X[:, :4] == 0, axis=1))
+    assert set(np.unique(y)) <= {0, 1, 2}
+
+
+def test_feature_store_refreshed_incrementally_on_ingest(db: Session):
+    """Test that ingest keeps match_features equal to a full rebuild, even for out-of-order data"""
+    rng = random.Random(11)
+    names = [f"Club{i}" for i in range(6)]
+
+    def season_frame(start: date, rounds: int) -> pd.DataFrame:
+        rows = []
+        for r in range(rounds):
+            order = names[:]
+            rng.shuffle(order)
+            for i in range(0, 6, 2):
+                rows.append({
+                    "date": (start + timedelta(days=7 * r)).isoformat(),
+                    "season": str(start.year),
+                    "home_team": order[i],
+                    "away_team": order[i + 1],
+                    "home_goals": rng.randint(0, 3),
+                    "away_goals": rng.randint(0, 3)
+                })
+        return pd.DataFrame(rows)
+
+    # Recent season first, then an older one that shifts everyone's history
+    ingest_dataframe(season_frame(date(2023, 8, 1), 10), db)
+    ingest_dataframe(season_frame(date(2022, 8, 1), 10), db)
+    db.commit()
+
+    assert is_feature_store_current(db)
+    stored = {
+        f.match_id: [getattr(f, name) for name in FEATURE_NAMES]
+        for f in db.query(MatchFeature).all()
+    }
+    matches = load_matches_frame(db)
+    expected = build_features(matches, matches)
+    for i, match_id in enumerate(matches["id"]):
+        np.testing.assert_array_equal(stored[match_id], expected[i])
+
+
+def test_feature_store_refresh_uses_opponents_history(db: Session):
+    """Test that a refreshed match keeps the features of an opponent that is not in the new batch"""
+    def match(day: int, home: str, away: str, home_goals: int, away_goals: int) -> dict:
+        return {"date": (date(2023, 8, 1) + timedelta(days=day)).isoformat(), "season": "2023",
+                "home_team": home, "away_team": away, "home_goals": home_goals, "away_goals": away_goals}
+
+    # B's form comes from games against C; A meets B later
+    rows = [match(day, "ClubB", "ClubC", 3, 0) for day in range(5)] + [match(20, "ClubA", "ClubB", 1, 1)]
+    ingest_dataframe(pd.DataFrame(rows), db)
+    # Only A and D are in this batch, but it changes A's form before the A vs B match
+    ingest_dataframe(pd.DataFrame([match(10, "ClubA", "ClubD", 2, 0)]), db)
+    db.commit()
+
+    stored = {
+        f.match_id: [getattr(f, name) for name in FEATURE_NAMES]
+        for f in db.query(MatchFeature).all()
+    }
+    matches = load_matches_frame(db)
+    expected = build_features(matches, matches)
+    for i, match_id in enumerate(matches["id"]):
+        np.testing.assert_array_equal(stored[match_id], expected[i])
+    a_vs_b = stored[int(matches["id"][matches["date"] == date(2023, 8, 21)].iloc[0])]
+    assert a_vs_b[1] == 15 and a_vs_b[3] == 15
+
+
+def test_load_training_set_rebuilds_stale_store(db: Session, league_history):
+    """Test that matches added outside ingest trigger a rebuild and the same training set"""
+    assert not is_feature_store_current(db)
+
+    X, y, kept = load_training_set(db)
+    X_expected, y_expected, kept_expected = build_training_set(load_matches_frame(db))
+
+    assert is_feature_store_current(db)
+    np.testing.assert_array_equal(X, X_expected)
+    np.testing.assert_array_equal(y, y_expected)
+    assert kept["id"].tolist() == kept_expected["id"].tolist()
+
+
+def test_team_form_index_matches_compute_features(db: Session, league_history):
+    """Test that index lookups reproduce compute_features for upcoming fixtures"""
+    index = TeamFormIndex()
+    index.load(db)
+    fixture_date = date(2023, 6, 1)
+
+    for home in league_history:
+        for away in league_history:
+            if home.id == away.id:
+                continue
+            expected = compute_features(home.id, away.id, fixture_date, db)
+            np.testing.assert_array_equal(index.lookup(home.id, away.id, fixture_date), expected)
+
+
+def test_team_form_index_defers_to_database_for_past_dates(db: Session, league_history):
+    """Test that the index declines fixtures dated before stored matches"""
+    index = TeamFormIndex()
+    index.load(db)
+    assert index.lookup(league_history[0].id, league_history[1].id, date(2022, 9, 1)) is None
+
+
+def test_team_form_index_updated_on_ingest_commit(db: Session, league_history):
+    """Test that committed ingests reach the index without a reload and rollbacks do not"""
+    team_form_index.load(db)
+    version = team_form_index.version
+    fixture_date = date(2023, 6, 1)
+
+    df = pd.DataFrame([{"date": "2023-05-01", "season": "2022-23", "home_team": "Team0",
+                        "away_team": "Team1", "home_goals": 4, "away_goals": 0}])
+    ingest_dataframe(df, db)
+    db.rollback()
+    assert team_form_index.version == version
+
+    ingest_dataframe(df, db)
+    db.commit()
+    assert team_form_index.version == version + 1
+    assert team_form_index.match_count == db.query(Match).count()
+
+    home, away = league_history[0].id, league_history[1].id
+    np.testing.assert_array_equal(
+        team_form_index.lookup(home, away, fixture_date),
+        compute_features(home, away, fixture_date, db)
+    )
+
+
+def test_training_snapshot_reused_until_matches_change(db: Session, league_history, monkeypatch):
+    """Test that the snapshot is built once per data version and loads memory-mapped"""
+    path = datasets.training_snapshot(db)
+    X, y, ids, seasons = datasets.load_snapshot(path)
+    expected_X, expected_y, kept = load_training_set(db)
+    assert isinstance(X, np.memmap)
+    np.testing.assert_array_equal(X, expected_X)
+    np.testing.assert_array_equal(y, expected_y)
+    np.testing.assert_array_equal(ids, kept["id"].to_numpy())
+    assert set(seasons) == {"2022-23"}
+
+    def fail(session):
+        raise AssertionError("feature store read for a cached version")
+
+    monkeypatch.setattr(datasets, "load_training_set", fail)
+    assert datasets.training_snapshot(db) == path
+
+    monkeypatch.undo()
+    ingest_dataframe(pd.DataFrame([{"date": "2023-05-01", "season": "2022-23", "home_team": "Team0",
+                                    "away_team": "Team1", "home_goals": 1, "away_goals": 0}]), db)
+    db.commit()
+    new_path = datasets.training_snapshot(db)
+    assert new_path != path
+    assert len(datasets.load_snapshot(new_path)[0]) == len(X) + 1
@@ -1,11 +1,18 @@
 import pytest
 import pandas as pd
 import os
+import threading
+import time
 from datetime import date
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
-from backend.models import Team, Match
-from backend.routers.ingest import ingest_csv
+from backend.models import Team, Match, IngestCheckpoint, IngestManifest, IngestWatermark
+from backend.ingestion import expand_sources, file_fingerprint, ingest_files, prefix_digest, resolve_teams
+from backend.jobs import JobManager
+from backend.routers import ingest as ingest_router
+from backend.routers.ingest import ingest_csv, ingest_jobs
+from tests.conftest import TestingSessionLocal
 
 
 def test_ingest_idempotency(client, db: Session):
@@ -24,13 +31,13 @@ def test_ingest_idempotency(client, db: Session):
     df.to_csv(csv_path, index=False)
 
     # First ingestion
-    response1 = client.post("/ingest", params={"csv_path": csv_path})
+    response1 = client.post("/ingest", params={"csv_path": csv_path, "wait": True})
     assert response1.status_code == 200
     teams_created_1 = response1.json()["teams_created"]
     matches_created_1 = response1.json()["matches_created"]
 
     # Second ingestion (should be idempotent)
-    response2 = client.post("/ingest", params={"csv_path": csv_path})
+    response2 = client.post("/ingest", params={"csv_path": csv_path, "wait": True})
     assert response2.status_code == 200
     teams_created_2 = response2.json()["teams_created"]
     matches_created_2 = response2.json()["matches_created"]
@@ -66,7 +73,7 @@ def test_ingest_creates_teams_and_matches(client, db: Session):
     csv_path = "/tmp/test_matches_single.csv"
     df.to_csv(csv_path, index=False)
 
-    response = client.post("/ingest", params={"csv_path": csv_path})
+    response = client.post("/ingest", params={"csv_path": csv_path, "wait": True})
     assert response.status_code == 200
 
     # Verify teams were created
@@ -87,3 +94,489 @@ def test_ingest_creates_teams_and_matches(client, db: Session):
 
     os.remove(csv_path)
 
+
+
+def test_ingest_dedupes_within_file_and_drops_invalid_dates(client, db: Session):
+    """Test that duplicate rows in one file are skipped and unparseable dates are dropped"""
+    test_data = {
+        "date": ["2023-01-01", "2023-01-01", "not-a-date"],
+        "season": ["2023-24", "2023-24", "2023-24"],
+        "home_team": ["Arsenal", "Arsenal", "Chelsea"],
+        "away_team": ["Liverpool", "Liverpool", "Arsenal"],
+        "home_goals": [2, 2, 0],
+        "away_goals": [1, 1, 0]
+    }
+    df = pd.DataFrame(test_data)
+    csv_path = "/tmp/test_matches_dupes.csv"
+    df.to_csv(csv_path, index=False)
+
+    response = client.post("/ingest", params={"csv_path": csv_path, "wait": True})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["teams_created"] == 2
+    assert data["matches_created"] == 1
+    assert data["matches_skipped"] == 1
+    assert db.query(Match).count() == 1
+
+    os.remove(csv_path)
+
+
+def test_ingest_missing_columns(client):
+    """Test that ingestion rejects a CSV without the required columns"""
+    csv_path = "/tmp/test_matches_bad_columns.csv"
+    pd.DataFrame({"date": ["2023-01-01"], "home_team": ["Arsenal"]}).to_csv(csv_path, index=False)
+
+    response = client.post("/ingest", params={"csv_path": csv_path, "wait": True})
+    assert response.status_code == 400
+
+    os.remove(csv_path)
+
+
+def test_ingest_stream_chunks_and_checkpoint(client, db: Session):
+    """Test that stream mode commits per chunk and records a completed checkpoint"""
+    test_data = {
+        "date": ["2023-01-01", "2023-01-02", "2023-01-03"],
+        "season": ["2023-24", "2023-24", "2023-24"],
+        "home_team": ["Arsenal", "Chelsea", "Liverpool"],
+        "away_team": ["Liverpool", "Manchester United", "Chelsea"],
+        "home_goals": [2, 1, 0],
+        "away_goals": [1, 0, 0]
+    }
+    csv_path = "/tmp/test_matches_stream.csv"
+    pd.DataFrame(test_data).to_csv(csv_path, index=False)
+
+    response = client.post("/ingest", params={"csv_path": csv_path, "stream": True, "chunk_size": 2, "wait": True})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["chunks"] == 2
+    assert data["matches_created"] == 3
+
+    checkpoint = db.query(IngestCheckpoint).one()
+    assert checkpoint.completed
+    assert checkpoint.rows_committed == 3
+    assert checkpoint.byte_offset == os.path.getsize(csv_path)
+
+    os.remove(csv_path)
+
+
+def test_ingest_stream_resumes_from_checkpoint(client, db: Session):
+    """Test that an interrupted stream ingest resumes after the last committed offset"""
+    test_data = {
+        "date": ["2023-01-01", "2023-01-02"],
+        "season": ["2023-24", "2023-24"],
+        "home_team": ["Arsenal", "Chelsea"],
+        "away_team": ["Liverpool", "Manchester United"],
+        "home_goals": [2, 1],
+        "away_goals": [1, 0]
+    }
+    csv_path = "/tmp/test_matches_resume.csv"
+    pd.DataFrame(test_data).to_csv(csv_path, index=False)
+
+    # Simulate a crash after the header and first row were committed
+    with open(csv_path, "rb") as f:
+        f.readline()
+        f.readline()
+        offset = f.tell()
+    db.add(IngestCheckpoint(
+        source=os.path.abspath(csv_path),
+        file_size=os.path.getsize(csv_path),
+        byte_offset=offset,
+        prefix_hash=prefix_digest(csv_path, offset).hexdigest(),
+        rows_committed=1,
+        completed=False
+    ))
+    db.commit()
+
+    response = client.post("/ingest", params={"csv_path": csv_path, "stream": True, "wait": True})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["resumed_from_byte"] == offset
+    assert data["rows_processed"] == 1
+    assert db.query(Match).count() == 1
+
+    os.remove(csv_path)
+
+
+def test_ingest_stream_restarts_when_file_was_rewritten(client, db: Session, tmp_path):
+    """Test that a checkpoint is not resumed once the bytes it covers have changed"""
+    csv_path = str(tmp_path / "rewritten.csv")
+    df = pd.DataFrame({
+        "date": ["2023-01-01", "2023-01-02"],
+        "season": ["2023-24", "2023-24"],
+        "home_team": ["Arsenal", "Chelsea"],
+        "away_team": ["Liverpool", "Everton"],
+        "home_goals": [2, 1],
+        "away_goals": [1, 0]
+    })
+    df.to_csv(csv_path, index=False)
+
+    # Interrupted after the first row, then the file is replaced with content of the same size
+    with open(csv_path, "rb") as f:
+        f.readline()
+        f.readline()
+        offset = f.tell()
+    db.add(IngestCheckpoint(
+        source=os.path.abspath(csv_path),
+        file_size=os.path.getsize(csv_path),
+        byte_offset=offset,
+        prefix_hash=prefix_digest(csv_path, offset).hexdigest(),
+        rows_committed=1,
+        completed=False
+    ))
+    db.commit()
+    size = os.path.getsize(csv_path)
+    df.assign(home_team=["Chelsea", "Arsenal"], away_team=["Everton", "Liverpool"]).to_csv(csv_path, index=False)
+    assert os.path.getsize(csv_path) == size
+
+    data = client.post("/ingest", params={"csv_path": csv_path, "stream": True, "wait": True}).json()
+    assert data["resumed_from_byte"] == 0
+    assert data["rows_processed"] == 2
+    assert db.query(Match).count() == 2
+
+    db.expire_all()
+    checkpoint = db.query(IngestCheckpoint).one()
+    assert checkpoint.completed
+    assert checkpoint.prefix_hash == file_fingerprint(csv_path)
+
+
+def test_ingest_job_status(client, db: Session):
+    """Test that POST /ingest returns a job id and the job reports progress when done"""
+    test_data = {
+        "date": ["2023-01-01", "2023-01-02"],
+        "season": ["2023-24", "2023-24"],
+        "home_team": ["Arsenal", "Chelsea"],
+        "away_team": ["Liverpool", "Manchester United"],
+        "home_goals": [2, 1],
+        "away_goals": [1, 0]
+    }
+    csv_path = "/tmp/test_matches_job.csv"
+    pd.DataFrame(test_data).to_csv(csv_path, index=False)
+
+    response = client.post("/ingest", params={"csv_path": csv_path})
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    ingest_jobs.get(job_id).wait(timeout=10)
+
+    status = client.get(f"/ingest/jobs/{job_id}")
+    assert status.status_code == 200
+    job = status.json()
+    assert job["state"] == "succeeded"
+    assert job["rows_processed"] == 2
+    assert job["result"]["matches_created"] == 2
+    assert db.query(Match).count() == 2
+
+    os.remove(csv_path)
+
+
+def test_ingest_jobs_coalesce_on_same_file():
+    """Test that a second job for a file that is still being ingested joins the first"""
+    manager = JobManager(max_workers=2)
+    release = threading.Event()
+
+    first, created_first = manager.submit("ingest", lambda job: release.wait(5) and {}, key="/data/a.csv")
+    second, created_second = manager.submit("ingest", lambda job: {}, key="/data/a.csv")
+    assert created_first and not created_second
+    assert second is first
+
+    release.set()
+    first.wait(timeout=5)
+    third, created_third = manager.submit("ingest", lambda job: {}, key="/data/a.csv")
+    assert created_third and third is not first
+    manager.shutdown()
+
+
+def test_ingest_requests_coalesce_only_with_same_parameters(client, db: Session, tmp_path, monkeypatch):
+    """Test that an ingest request joins a running job for the file only when its mode and options match"""
+    csv_path = str(tmp_path / "coalesce.csv")
+    pd.DataFrame({
+        "date": ["2023-01-01"],
+        "season": ["2023-24"],
+        "home_team": ["Arsenal"],
+        "away_team": ["Liverpool"],
+        "home_goals": [2],
+        "away_goals": [1]
+    }).to_csv(csv_path, index=False)
+
+    loading, release = threading.Event(), threading.Event()
+    ingest_path = ingest_router.ingest_path
+
+    def blocking_ingest(path, session):
+        loading.set()
+        release.wait(5)
+        return ingest_path(path, session)
+
+    monkeypatch.setattr(ingest_router, "ingest_path", blocking_ingest)
+
+    first = client.post("/ingest", params={"csv_path": csv_path}).json()
+    assert loading.wait(5)
+    same = client.post("/ingest", params={"csv_path": csv_path}).json()
+    assert (same["job_id"], same["coalesced"]) == (first["job_id"], True)
+
+    others = [
+        client.post("/ingest", params={"csv_path": csv_path, **params}).json()
+        for params in ({"stream": True}, {"stream": True, "chunk_size": 1}, {"incremental": True})
+    ]
+    assert not any(other["coalesced"] for other in others)
+    assert len({first["job_id"], *(other["job_id"] for other in others)}) == 4
+
+    release.set()
+    for job_id in [first["job_id"]] + [other["job_id"] for other in others]:
+        ingest_jobs.get(job_id).wait(timeout=10)
+    results = [client.get(f"/ingest/jobs/{other['job_id']}").json() for other in others]
+    assert [result["state"] for result in results] == ["succeeded"] * 3
+    assert "chunks" in results[0]["result"] and "file_unchanged" in results[2]["result"]
+
+
+def test_ingest_job_not_found(client):
+    """Test GET /ingest/jobs/{id} with an unknown job id"""
+    response = client.get("/ingest/jobs/unknown")
+    assert response.status_code == 404
+
+
+def test_ingest_upload_streams_batches(client, db: Session):
+    """Test that an uploaded CSV is ingested in batches as it streams in"""
+    csv_content = (
+        "date,season,home_team,away_team,home_goals,away_goals\n"
+        "2023-01-01,2023-24,Arsenal,Liverpool,2,1\n"
+        "2023-01-02,2023-24,Chelsea,Manchester United,1,0\n"
+        "2023-01-03,2023-24,Liverpool,Chelsea,0,0"
+    )
+
+    response = client.post(
+        "/ingest/upload",
+        params={"batch_size": 2},
+        files={"file": ("matches.csv", csv_content, "text/csv")}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["batches"] == 2
+    assert data["rows_processed"] == 3
+    assert data["teams_created"] == 4
+    assert data["matches_created"] == 3
+    assert db.query(Match).count() == 3
+
+
+def test_ingest_upload_missing_columns(client):
+    """Test that an upload without the required columns is rejected"""
+    response = client.post(
+        "/ingest/upload",
+        files={"file": ("matches.csv", "date,home_team\n2023-01-01,Arsenal\n", "text/csv")}
+    )
+    assert response.status_code == 400
+
+
+def test_ingest_files_parallel_with_cross_file_dedupe(db: Session, tmp_path):
+    """Test multi-file ingest: per-file counts, cross-file dedupe and failed files"""
+    season_a = pd.DataFrame({
+        "date": ["2023-01-01", "2023-01-02"],
+        "season": ["2023-24", "2023-24"],
+        "home_team": ["Arsenal", "Chelsea"],
+        "away_team": ["Liverpool", "Manchester United"],
+        "home_goals": [2, 1],
+        "away_goals": [1, 0]
+    })
+    season_b = pd.DataFrame({
+        "date": ["2023-01-02", "2023-01-09"],
+        "season": ["2023-24", "2023-24"],
+        "home_team": ["Chelsea", "Liverpool"],
+        "away_team": ["Manchester United", "Arsenal"],
+        "home_goals": [1, 3],
+        "away_goals": [0, 0]
+    })
+    season_a.to_csv(tmp_path / "a.csv", index=False)
+    season_b.to_csv(tmp_path / "b.csv", index=False)
+    (tmp_path / "bad.csv").write_text("date,home_team\n2023-01-01,Arsenal\n")
+
+    paths = expand_sources(str(tmp_path))
+    result = ingest_files(paths, db, workers=2)
+
+    assert result["teams_created"] == 4
+    assert result["matches_created"] == 3
+    assert result["matches_skipped"] == 1
+    assert result["files"][str(tmp_path / "a.csv")]["matches_created"] == 2
+    assert result["files"][str(tmp_path / "b.csv")]["matches_skipped"] == 1
+    assert "error" in result["files"][str(tmp_path / "bad.csv")]
+    assert db.query(Match).count() == 3
+
+
+def test_ingest_reports_rejected_rows(client, db: Session):
+    """Test that invalid rows are skipped and reported with their row number and reason"""
+    test_data = {
+        "date": ["2023-01-01", "bad-date", "2023-01-03", "2023-01-04"],
+        "season": ["2023-24"] * 4,
+        "home_team": ["Arsenal", "Chelsea", None, "Liverpool"],
+        "away_team": ["Liverpool", "Arsenal", "Chelsea", "Arsenal"],
+        "home_goals": [2, 1, 0, "x"],
+        "away_goals": [1, 0, 0, 1]
+    }
+    csv_path = "/tmp/test_matches_rejected.csv"
+    pd.DataFrame(test_data).to_csv(csv_path, index=False)
+
+    response = client.post("/ingest", params={"csv_path": csv_path, "wait": True})
+    assert response.status_code == 200
+    data = response.json()
+    assert data["matches_created"] == 1
+    assert data["rows_rejected"] == 3
+    assert data["rejected"] == [
+        {"row": 1, "reason": "invalid date"},
+        {"row": 2, "reason": "missing team name"},
+        {"row": 3, "reason": "invalid home_goals"}
+    ]
+
+    os.remove(csv_path)
+
+
+@pytest.mark.parametrize("suffix", [".csv.gz", ".parquet", ".feather"])
+def test_ingest_columnar_and_compressed_inputs(client, db: Session, tmp_path, suffix):
+    """Test ingesting gzip CSV, Parquet and Arrow IPC files with the same columns"""
+    if suffix != ".csv.gz":
+        pytest.importorskip("pyarrow")
+
+    df = pd.DataFrame({
+        "date": pd.to_datetime(["2023-01-01", "2023-01-02"]),
+        "season": ["2023-24", "2023-24"],
+        "home_team": ["Arsenal", "Chelsea"],
+        "away_team": ["Liverpool", "Manchester United"],
+        "home_goals": [2, 1],
+        "away_goals": [1, 0],
+        "referee": ["A", "B"]
+    })
+    path = str(tmp_path / f"matches{suffix}")
+    if suffix == ".parquet":
+        df.to_parquet(path)
+    elif suffix == ".feather":
+        df.to_feather(path)
+    else:
+        df.to_csv(path, index=False)
+
+    response = client.post("/ingest", params={"csv_path": path, "wait": True})
+    assert response.status_code == 200
+    assert response.json()["matches_created"] == 2
+
+    match = db.query(Match).order_by(Match.date).first()
+    assert match.date == date(2023, 1, 1)
+    assert match.home_goals == 2
+
+
+def test_ingest_incremental_skips_unchanged_and_watermarked_rows(client, db: Session, tmp_path):
+    """Test that incremental ingest skips an unchanged file and rows before the season watermark"""
+    csv_path = str(tmp_path / "cumulative.csv")
+    df = pd.DataFrame({
+        "date": ["2023-01-01", "2023-01-08"],
+        "season": ["2023-24", "2023-24"],
+        "home_team": ["Arsenal", "Chelsea"],
+        "away_team": ["Liverpool", "Manchester United"],
+        "home_goals": [2, 1],
+        "away_goals": [1, 0]
+    })
+    df.to_csv(csv_path, index=False)
+
+    first = client.post("/ingest", params={"csv_path": csv_path, "incremental": True, "wait": True}).json()
+    assert first["matches_created"] == 2
+    assert db.query(IngestWatermark).one().max_date == date(2023, 1, 8)
+
+    second = client.post("/ingest", params={"csv_path": csv_path, "incremental": True, "wait": True}).json()
+    assert second["file_unchanged"]
+    assert second["rows_processed"] == 0
+
+    # Append a new matchday; the earlier rows fall before the watermark
+    pd.concat([df, pd.DataFrame({
+        "date": ["2023-01-15"],
+        "season": ["2023-24"],
+        "home_team": ["Liverpool"],
+        "away_team": ["Arsenal"],
+        "home_goals": [3],
+        "away_goals": [0]
+    })]).to_csv(csv_path, index=False)
+
+    third = client.post("/ingest", params={"csv_path": csv_path, "incremental": True, "wait": True}).json()
+    assert not third["file_unchanged"]
+    assert third["rows_below_watermark"] == 1
+    assert third["matches_created"] == 1
+    assert db.query(Match).count() == 3
+    assert db.query(IngestManifest).one().rows == 3
+
+
+def test_ingest_files_incremental_records_manifest_without_new_rows(db: Session, tmp_path):
+    """Test that a changed file with only rows before its watermark still gets its new manifest"""
+    csv_path = str(tmp_path / "season.csv")
+    pd.DataFrame({
+        "date": ["2023-01-01", "2023-01-08"],
+        "season": ["2023-24", "2023-24"],
+        "home_team": ["Arsenal", "Chelsea"],
+        "away_team": ["Liverpool", "Manchester United"],
+        "home_goals": [2, 1],
+        "away_goals": [1, 0]
+    }).to_csv(csv_path, index=False)
+    ingest_files([csv_path], db, workers=1, incremental=True)
+
+    # Rewrite the file with only a correction to the older match
+    pd.DataFrame({
+        "date": ["2023-01-01"],
+        "season": ["2023-24"],
+        "home_team": ["Arsenal"],
+        "away_team": ["Liverpool"],
+        "home_goals": [3],
+        "away_goals": [1]
+    }).to_csv(csv_path, index=False)
+    result = ingest_files([csv_path], db, workers=1, incremental=True)
+    assert result["files"][csv_path]["rows_below_watermark"] == 1
+    db.rollback()
+
+    manifest = db.query(IngestManifest).one()
+    assert manifest.rows == 1
+    assert manifest.content_hash == file_fingerprint(csv_path)
+
+
+def test_match_key_is_unique_in_database(db: Session):
+    """Test that the database rejects a second match with the same date and teams"""
+    arsenal = Team(name="Arsenal")
+    liverpool = Team(name="Liverpool")
+    db.add_all([arsenal, liverpool])
+    db.commit()
+
+    for _ in range(2):
+        db.add(Match(
+            date=date(2023, 1, 1),
+            season="2023-24",
+            home_team_id=arsenal.id,
+            away_team_id=liverpool.id,
+            home_goals=2,
+            away_goals=1
+        ))
+    with pytest.raises(IntegrityError):
+        db.commit()
+    db.rollback()
+
+
+def test_resolve_teams_with_concurrent_sessions(db: Session):
+    """Test that a team inserted by a concurrent, uncommitted ingest does not fail the second one"""
+    first, second = TestingSessionLocal(), TestingSessionLocal()
+    outcome = {}
+
+    def resolve_second():
+        try:
+            outcome["result"] = resolve_teams(["Arsenal", "Liverpool"], second)
+            second.commit()
+        except Exception as e:
+            outcome["error"] = e
+
+    try:
+        first_ids, first_created = resolve_teams(["Arsenal", "Chelsea"], first)
+        # The second session sees no Arsenal yet and waits on the first one's write lock
+        thread = threading.Thread(target=resolve_second)
+        thread.start()
+        time.sleep(0.3)
+        first.commit()
+        thread.join(timeout=10)
+    finally:
+        first.close()
+        second.close()
+
+    assert "error" not in outcome
+    second_ids, second_created = outcome["result"]
+    assert first_created == 2
+    assert second_created == 1
+    assert second_ids["Arsenal"] == first_ids["Arsenal"]
+    assert {team.name for team in db.query(Team).all()} == {"Arsenal", "Chelsea", "Liverpool"}
@@ -1,7 +1,27 @@
+import os
+import pickle
+import queue
+import threading
+import time
+
+import numpy as np
+import pandas as pd
 import pytest
-from datetime import date, timedelta
+from datetime import date, datetime, timedelta
 from sqlalchemy.orm import Session
 
+from backend import datasets
+from backend.artifacts import LinearSoftmaxModel, export_linear, linear_artifact_path, load_model
+from backend.config import settings
+from backend.ingestion import ingest_dataframe
+from backend.estimators import SEARCH_SPACES, make_estimator
+from backend.features import FEATURE_NAMES, load_training_set
+from backend.model_registry import model_registry
+from backend.pair_matrix import pair_matrix
+from backend.prediction_log import PredictionLogWriter, prediction_log
+from backend.routers import ml
+from backend.simulation import season_table, simulate_season
+from backend.training import active_model_run
 from backend.models import Team, Match, ModelRun, Prediction
 
 
@@ -47,7 +67,7 @@ def training_data(db: Session):
 
 def test_train_model(client, training_data):
     """Test POST /train endpoint"""
-    response = client.post("/train")
+    response = client.post("/train", params={"wait": True})
     assert response.status_code == 200
 
     data = response.json()
@@ -59,6 +79,637 @@ def test_train_model(client, training_data):
     assert data["metrics"]["accuracy"] <= 1
 
 
+def test_train_model_background_job(client, training_data, db: Session):
+    """Test that POST /train returns a job that can be polled to completion"""
+    response = client.post("/train")
+    assert response.status_code == 202
+    job_id = response.json()["job_id"]
+
+    ml.train_jobs.get(job_id).wait()
+    job = client.get(f"/train/jobs/{job_id}").json()
+    assert job["state"] == "succeeded"
+    assert job["stage"] == "saving"
+    assert job["rows_processed"] > 0
+    assert db.query(ModelRun).filter(ModelRun.id == job["result"]["model_run_id"]).count() == 1
+
+
+def test_cancelled_training_stores_no_model_run(client, training_data, db: Session, monkeypatch):
+    """Test that a training job cancelled mid-run ends cancelled without a ModelRun"""
+    loading, release = threading.Event(), threading.Event()
+    load_training_set = datasets.load_training_set
+
+    def blocking_load(session):
+        loading.set()
+        release.wait(5)
+        return load_training_set(session)
+
+    monkeypatch.setattr(datasets, "load_training_set", blocking_load)
+
+    job_id = client.post("/train").json()["job_id"]
+    assert loading.wait(5)
+    assert client.post(f"/train/jobs/{job_id}/cancel").status_code == 200
+    release.set()
+
+    ml.train_jobs.get(job_id).wait()
+    assert client.get(f"/train/jobs/{job_id}").json()["state"] == "cancelled"
+    assert db.query(ModelRun).count() == 0
+
+
+def test_train_requests_coalesce_only_with_same_parameters(client, training_data, monkeypatch):
+    """Test that a /train request joins a running job only when mode, estimator and activate match"""
+    loading, release = threading.Event(), threading.Event()
+    load_training_set = datasets.load_training_set
+
+    def blocking_load(session):
+        loading.set()
+        release.wait(5)
+        return load_training_set(session)
+
+    monkeypatch.setattr(datasets, "load_training_set", blocking_load)
+
+    first = client.post("/train").json()
+    assert loading.wait(5)
+    same = client.post("/train", params={"estimator": "logistic", "activate": True}).json()
+    assert (same["job_id"], same["coalesced"]) == (first["job_id"], True)
+
+    others = [
+        client.post("/train", params=params).json()
+        for params in ({"estimator": "hist_gb"}, {"mode": "backtest"}, {"activate": False})
+    ]
+    assert not any(other["coalesced"] for other in others)
+    assert len({first["job_id"], *(other["job_id"] for other in others)}) == 4
+
+    release.set()
+    for job_id in [first["job_id"]] + [other["job_id"] for other in others]:
+        ml.train_jobs.get(job_id).wait()
+    results = [client.get(f"/train/jobs/{other['job_id']}").json() for other in others]
+    assert results[0]["result"]["metrics"]["estimator"] == "hist_gb"
+    assert results[2]["result"]["activated"] is False
+
+
+def test_incremental_training_updates_latest_model(client, training_data, db: Session):
+    """Test that an incremental run continues the parent model on the new matches and scores held-out ones"""
+    teams, matches = training_data
+    full = client.post("/train", params={"estimator": "sgd", "wait": True}).json()
+    assert full["metrics"]["mode"] == "full"
+    assert full["metrics"]["max_match_id"] == max(m.id for m in matches)
+
+    response = client.post("/train", params={"mode": "incremental", "wait": True})
+    assert response.status_code == 400
+    assert "No new matches" in response.json()["detail"]
+
+    scores = [(2, 0), (1, 1), (0, 3)]
+    for i in range(10):
+        home_goals, away_goals = scores[i % 3]
+        db.add(Match(
+            date=date(2023, 4, 1) + timedelta(days=i),
+            season="2023-24",
+            home_team_id=teams[i % 10].id,
+            away_team_id=teams[(i + 3) % 10].id,
+            home_goals=home_goals,
+            away_goals=away_goals
+        ))
+    db.commit()
+
+    response = client.post("/train", params={"mode": "incremental", "wait": True})
+    assert response.status_code == 200
+    data = response.json()
+    metrics = data["metrics"]
+    assert metrics["mode"] == "incremental"
+    assert metrics["estimator"] == "sgd"
+    assert metrics["parent_run_id"] == full["model_run_id"]
+    # The latest 20% of the new matches are held out for scoring and left for the next update
+    assert (metrics["new_samples"], metrics["test_size"]) == (8, 2)
+    assert metrics["train_size"] == full["metrics"]["train_size"] + 8
+    held_out = sorted(m.id for m in db.query(Match).filter(Match.id > full["metrics"]["max_match_id"]))[-2:]
+    assert full["metrics"]["max_match_id"] < metrics["max_match_id"] < min(held_out)
+    assert db.query(ModelRun).count() == 2
+
+    # The update keeps what the parent learned from all history: it stays far closer to the
+    # parent than a model fitted on the new matches alone
+    with open(full["model_path"], "rb") as f:
+        parent = pickle.load(f)
+    with open(data["model_path"], "rb") as f:
+        updated = pickle.load(f)
+    X, y, kept = load_training_set(db)
+    new_rows = (kept["id"] > full["metrics"]["max_match_id"]) & (kept["id"] <= metrics["max_match_id"])
+    new_only = make_estimator("sgd").fit(X[new_rows.to_numpy()], y[new_rows.to_numpy()])
+    drift = np.abs(updated.predict_proba(X) - parent.predict_proba(X)).mean()
+    assert drift < np.abs(new_only.predict_proba(X) - parent.predict_proba(X)).mean() / 2
+    assert updated.t_ > parent.t_
+
+
+def test_incremental_training_requires_a_model(client, training_data):
+    """Test that an incremental run without a previous model is rejected"""
+    response = client.post("/train", params={"mode": "incremental", "wait": True})
+    assert response.status_code == 400
+    assert "No trained model" in response.json()["detail"]
+
+
+def test_backtest_training_scores_each_season(client, db: Session):
+    """Test that a backtest run trains on earlier seasons and reports one fold per later season"""
+    teams = [Team(name=f"Team{i}") for i in range(6)]
+    db.add_all(teams)
+    db.commit()
+
+    scores = [(2, 1), (1, 1), (0, 2), (3, 0)]
+    for s, season in enumerate(["2021-22", "2022-23", "2023-24"]):
+        for i in range(30):
+            db.add(Match(
+                date=date(2021 + s, 8, 1) + timedelta(days=i),
+                season=season,
+                home_team_id=teams[i % 6].id,
+                away_team_id=teams[(i + 1 + s) % 6].id,
+                home_goals=scores[(i + s) % 4][0],
+                away_goals=scores[(i + s) % 4][1]
+            ))
+    db.commit()
+
+    response = client.post("/train", params={"mode": "backtest", "wait": True})
+    assert response.status_code == 200
+    metrics = response.json()["metrics"]
+    assert metrics["mode"] == "backtest"
+    assert [fold["season"] for fold in metrics["folds"]] == ["2022-23", "2023-24"]
+    for fold in metrics["folds"]:
+        assert 0 <= fold["accuracy"] <= 1
+        assert fold["log_loss"] > 0
+        assert fold["seconds"] >= 0
+    assert metrics["folds"][1]["train_size"] > metrics["folds"][0]["train_size"]
+    assert metrics["test_size"] == sum(fold["test_size"] for fold in metrics["folds"])
+    assert db.query(ModelRun).count() == 1
+
+
+def test_backtest_training_needs_several_seasons(client, training_data):
+    """Test that a single-season history cannot be backtested"""
+    response = client.post("/train", params={"mode": "backtest", "wait": True})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize("estimator", ["logistic", "xgboost", "hist_gb", "sgd"])
+def test_train_and_predict_with_each_estimator(client, training_data, estimator):
+    """Test that every estimator trains, records its timings and serves predictions"""
+    teams, _ = training_data
+    response = client.post("/train", params={"estimator": estimator, "wait": True})
+    assert response.status_code == 200
+    metrics = response.json()["metrics"]
+    assert metrics["estimator"] == estimator
+    assert metrics["fit_seconds"] >= 0
+    assert metrics["predict_latency_ms"] > 0
+
+    prediction = client.post(
+        "/predict",
+        json={"home_team_id": teams[0].id, "away_team_id": teams[1].id, "season": "2023-24"}
+    ).json()
+    assert abs(prediction["proba_home"] + prediction["proba_draw"] + prediction["proba_away"] - 1.0) < 0.01
+    assert len(prediction["explanation"]["feature_contributions"]) == 6
+
+
+@pytest.mark.parametrize("estimator", ["logistic", "hist_gb"])
+def test_incremental_training_rejects_models_without_partial_fit(client, training_data, estimator):
+    """Test that models without an incremental update path ask for a full retrain"""
+    assert client.post("/train", params={"estimator": estimator, "wait": True}).status_code == 200
+    response = client.post("/train", params={"mode": "incremental", "wait": True})
+    assert response.status_code == 400
+    assert "cannot be updated incrementally" in response.json()["detail"]
+
+
+def test_train_unknown_estimator(client, training_data):
+    """Test that an unknown estimator is rejected before a job is queued"""
+    assert client.post("/train", params={"estimator": "svm"}).status_code == 422
+
+
+def test_search_stores_candidates_and_leaderboard(client, training_data, db: Session):
+    """Test that a grid search stores every candidate and the leaderboard sorts by log loss"""
+    full = client.post("/train", params={"wait": True}).json()
+
+    response = client.post("/train/search", params={"estimator": "logistic", "wait": True})
+    assert response.status_code == 200
+    search = response.json()
+    assert search["candidates"] == len(SEARCH_SPACES["logistic"]["C"])
+    assert db.query(ModelRun).count() == search["candidates"] + 1
+
+    board = client.get("/train/leaderboard", params={"search_id": search["search_id"]}).json()
+    assert len(board) == search["candidates"]
+    assert [entry["log_loss"] for entry in board] == sorted(entry["log_loss"] for entry in board)
+    assert board[0]["model_run_id"] == search["best_run_id"]
+    assert {entry["params"]["C"] for entry in board} == set(SEARCH_SPACES["logistic"]["C"])
+    assert all(entry["fit_seconds"] is not None for entry in board)
+
+    # Candidates are not served unless promoted
+    assert active_model_run(db).id == full["model_run_id"]
+
+
+def test_search_promotes_best_run(client, training_data, db: Session):
+    """Test that promote activates the best candidate for serving"""
+    response = client.post(
+        "/train/search",
+        params={"estimator": "hist_gb", "strategy": "random", "n_candidates": 3, "promote": True, "wait": True}
+    )
+    assert response.status_code == 200
+    search = response.json()
+    assert search["candidates"] == 3
+    assert active_model_run(db).id == search["best_run_id"]
+
+
+def test_predict_reuses_loaded_model(client, training_data):
+    """Test that the served model is unpickled once, not per request"""
+    teams, _ = training_data
+    run_id = client.post("/train", params={"wait": True}).json()["model_run_id"]
+    body = {"home_team_id": teams[0].id, "away_team_id": teams[1].id, "season": "2023-24"}
+
+    for _ in range(3):
+        assert client.post("/predict", json=body).status_code == 200
+    assert model_registry.swaps == 1
+    assert model_registry.current.run_id == run_id
+
+
+def test_activate_swaps_served_model(client, training_data):
+    """Test that activating a run swaps it in and training with activate=false keeps it pinned"""
+    teams, _ = training_data
+    first = client.post("/train", params={"wait": True}).json()["model_run_id"]
+    second = client.post("/train", params={"estimator": "hist_gb", "wait": True}).json()["model_run_id"]
+    assert client.get("/models/active").json()["model_run_id"] == second
+
+    response = client.post(f"/models/{first}/activate")
+    assert response.status_code == 200
+    assert response.json()["model_run_id"] == first
+
+    body = {"home_team_id": teams[0].id, "away_team_id": teams[1].id, "season": "2023-24"}
+    explanation = client.post("/predict", json=body).json()["explanation"]
+    assert model_registry.current.run_id == first
+
+    third = client.post("/train", params={"activate": False, "wait": True}).json()
+    assert third["activated"] is False
+    assert client.get("/models/active").json()["model_run_id"] == first
+    assert client.post("/predict", json=body).json()["explanation"] == explanation
+
+
+def test_activate_unknown_model_run(client):
+    """Test that activating a missing run returns 404"""
+    assert client.post("/models/999/activate").status_code == 404
+    assert client.get("/models/active").status_code == 404
+
+
+def test_predict_batch_matches_single_predictions(client, training_data, db: Session):
+    """Test that a batch gives the same results as /predict and stores every prediction"""
+    teams, _ = training_data
+    assert client.post("/train", params={"wait": True}).status_code == 200
+
+    pairs = [(teams[i].id, teams[(i + 3) % 10].id) for i in range(6)]
+    singles = [
+        client.post("/predict", json={"home_team_id": h, "away_team_id": a, "season": "2023-24"}).json()
+        for h, a in pairs
+    ]
+    stored_before = db.query(Prediction).count()
+
+    response = client.post("/predict/batch", json={"fixtures": [
+        {"home_team_id": h, "away_team_id": a, "season": "2023-24"} for h, a in pairs
+    ]})
+    assert response.status_code == 200
+    batch = response.json()["predictions"]
+    assert len(batch) == len(pairs)
+    assert db.query(Prediction).count() == stored_before + len(pairs)
+
+    for single, predicted in zip(singles, batch):
+        assert predicted["match_date"] == date.today().isoformat()
+        for key in ("proba_home", "proba_draw", "proba_away"):
+            assert abs(single[key] - predicted[key]) < 1e-9
+        for name, entry in single["explanation"]["feature_contributions"].items():
+            assert entry["value"] == predicted["explanation"]["feature_contributions"][name]["value"]
+            assert abs(entry["contribution"] - predicted["explanation"]["feature_contributions"][name]["contribution"]) < 1e-9
+
+
+def test_predict_batch_uses_fixture_dates(client, training_data):
+    """Test that features are computed as of each fixture's match_date"""
+    teams, matches = training_data
+    assert client.post("/train", params={"estimator": "hist_gb", "wait": True}).status_code == 200
+
+    fixture = {"home_team_id": teams[0].id, "away_team_id": teams[1].id, "season": "2023-24"}
+    response = client.post("/predict/batch", json={"fixtures": [
+        {**fixture, "match_date": "2022-12-01"},
+        {**fixture, "match_date": "2024-01-01"},
+    ]})
+    assert response.status_code == 200
+    early, late = response.json()["predictions"]
+    assert all(v["value"] == 0 for k, v in early["explanation"]["feature_contributions"].items() if k != "home_advantage")
+    assert late["explanation"]["feature_contributions"]["home_team_points_last5"]["value"] > 0
+
+
+def test_predict_batch_unknown_team(client, training_data):
+    """Test that a batch with an unknown team is rejected"""
+    teams, _ = training_data
+    response = client.post("/predict/batch", json={"fixtures": [
+        {"home_team_id": teams[0].id, "away_team_id": 999, "season": "2023-24"}
+    ]})
+    assert response.status_code == 404
+    assert "999" in response.json()["detail"]
+
+
+def test_predict_cache_hits_until_data_or_model_change(client, training_data, db: Session):
+    """Test that repeated predictions are served from the cache and invalidated by new matches and models"""
+    teams, _ = training_data
+    assert client.post("/train", params={"wait": True}).status_code == 200
+    body = {"home_team_id": teams[0].id, "away_team_id": teams[1].id, "season": "2023-24"}
+
+    first = client.post("/predict", json=body).json()
+    second = client.post("/predict", json=body).json()
+    assert second == first
+    stats = client.get("/predict/cache").json()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 1)
+    # Every request is still recorded
+    assert db.query(Prediction).count() == 2
+
+    ingest_dataframe(pd.DataFrame([{"date": "2023-03-15", "season": "2023-24", "home_team": "Team0",
+                                    "away_team": "Team1", "home_goals": 5, "away_goals": 0}]), db)
+    db.commit()
+    after_ingest = client.post("/predict", json=body).json()
+    assert after_ingest["explanation"] != first["explanation"]
+    assert client.get("/predict/cache").json()["misses"] == 2
+
+    assert client.post("/train", params={"estimator": "hist_gb", "wait": True}).status_code == 200
+    client.post("/predict", json=body)
+    stats = client.get("/predict/cache").json()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 3, 1)
+
+
+def test_prediction_cache_evicts_least_recently_used():
+    """Test the size bound and TTL of the prediction cache"""
+    cache = ml.PredictionCache(max_size=2, ttl_seconds=60)
+    generation = (1, 1)
+    cache.get(generation, "a")
+    cache.put(generation, "a", 1)
+    cache.put(generation, "b", 2)
+    assert cache.get(generation, "a") == 1
+    cache.put(generation, "c", 3)
+    assert cache.get(generation, "b") is None
+    assert cache.get(generation, "a") == 1
+    assert cache.get((1, 2), "a") is None
+    assert cache.stats()["size"] == 0
+
+    expired = ml.PredictionCache(max_size=2, ttl_seconds=0)
+    expired.get(generation, "a")
+    expired.put(generation, "a", 1)
+    assert expired.get(generation, "a") is None
+
+
+def test_pair_matrix_serves_predict_like_live(client, training_data, db: Session, monkeypatch):
+    """Test that /predict answers from the all-pairs matrix built after training, with live results"""
+    teams, _ = training_data
+    assert client.post("/train", params={"wait": True}).status_code == 200
+    pair_matrix.wait()
+    matrix = pair_matrix.matrix
+    assert matrix.probabilities.shape == (10, 10, 3)
+    assert matrix.last_match_date == date(2023, 3, 1)
+    body = {"home_team_id": teams[2].id, "away_team_id": teams[7].id, "season": "2023-24"}
+
+    live_calls = []
+    get_features = ml.get_features
+    monkeypatch.setattr(ml, "get_features", lambda *args: live_calls.append(args) or get_features(*args))
+    from_matrix = client.post("/predict", json=body).json()
+    assert live_calls == []
+
+    # Reloading the saved file gives the same matrix
+    pair_matrix.reset()
+    pair_matrix.load()
+    assert pair_matrix.matrix.run_id == matrix.run_id
+    assert (pair_matrix.matrix.probabilities == matrix.probabilities).all()
+
+    pair_matrix.reset()
+    ml.prediction_cache.clear()
+    live = client.post("/predict", json=body).json()
+    assert len(live_calls) == 1
+    assert live["proba_home"] == pytest.approx(from_matrix["proba_home"])
+    assert live["proba_away"] == pytest.approx(from_matrix["proba_away"])
+    for name, entry in live["explanation"]["feature_contributions"].items():
+        assert entry == pytest.approx(from_matrix["explanation"]["feature_contributions"][name])
+
+
+def test_pair_matrix_falls_back_when_stale_and_rebuilds_after_ingest(client, training_data, db: Session):
+    """Test that new matches make /predict compute live until an ingest rebuilds the matrix"""
+    teams, _ = training_data
+    assert client.post("/train", params={"wait": True}).status_code == 200
+    pair_matrix.wait()
+    run_id = pair_matrix.matrix.run_id
+
+    body = {"home_team_id": teams[0].id, "away_team_id": teams[1].id, "season": "2023-24"}
+    before = client.post("/predict", json=body).json()
+
+    db.add(Match(date=date(2023, 3, 10), season="2023-24", home_team_id=teams[0].id,
+                 away_team_id=teams[1].id, home_goals=4, away_goals=0))
+    db.commit()
+    stale = client.post("/predict", json=body).json()
+    assert stale["explanation"] != before["explanation"]
+    assert pair_matrix.matrix.match_count == 60
+
+    csv_content = "date,season,home_team,away_team,home_goals,away_goals\n2023-03-11,2023-24,Team2,Team3,1,0\n"
+    response = client.post("/ingest/upload", files={"file": ("matches.csv", csv_content, "text/csv")})
+    assert response.json()["matches_created"] == 1
+    pair_matrix.wait()
+    matrix = pair_matrix.matrix
+    assert (matrix.run_id, matrix.match_count, matrix.last_match_date) == (run_id, 62, date(2023, 3, 11))
+    args = (run_id, 62, ml.team_form_index.max_match_id, teams[0].id, teams[1].id)
+    assert pair_matrix.lookup(*args, date.today()) is not None
+    # Fixtures on or before the last match need features the matrix was not built for
+    assert pair_matrix.lookup(*args, date(2023, 3, 11)) is None
+
+
+def test_pair_matrix_covers_latest_season_teams(client, training_data, db: Session):
+    """Test that the matrix only holds teams of the latest season and other teams are predicted live"""
+    teams, _ = training_data
+    relegated = Team(name="Relegated")
+    db.add(relegated)
+    db.commit()
+    db.add(Match(date=date(2022, 5, 1), season="2021-22", home_team_id=relegated.id,
+                 away_team_id=teams[0].id, home_goals=0, away_goals=1))
+    db.commit()
+
+    assert client.post("/train", params={"wait": True}).status_code == 200
+    pair_matrix.wait()
+    assert pair_matrix.matrix.team_ids.tolist() == sorted(team.id for team in teams)
+
+    response = client.post("/predict", json={
+        "home_team_id": relegated.id, "away_team_id": teams[0].id, "season": "2023-24"
+    })
+    assert response.status_code == 200
+    assert ml.prediction_cache.stats()["misses"] == 1
+
+
+def test_linear_artifact_serves_identical_probabilities(client, training_data, db: Session):
+    """Test that logistic runs are served from the NumPy artifact with predict_proba's probabilities"""
+    response = client.post("/train", params={"wait": True}).json()
+    model_path = response["model_path"]
+    with open(model_path, "rb") as f:
+        fitted = pickle.load(f)
+
+    served = model_registry.get(db).model
+    assert isinstance(served, LinearSoftmaxModel)
+    X = np.random.default_rng(0).normal(0, 5, size=(200, len(FEATURE_NAMES)))
+    assert np.allclose(served.predict_proba(X), fitted.predict_proba(X), rtol=0, atol=1e-12)
+    assert (served.predict(X) == fitted.predict(X)).all()
+
+    # Tree models have no artifact and are unpickled
+    response = client.post("/train", params={"estimator": "hist_gb", "wait": True}).json()
+    assert not os.path.exists(linear_artifact_path(response["model_path"]))
+    assert type(model_registry.get(db).model).__name__ == "HistGradientBoostingClassifier"
+
+
+def test_linear_artifact_two_classes(tmp_path):
+    """Test the softmax path against predict_proba for a model fitted on two classes"""
+    X = np.random.default_rng(1).normal(size=(100, len(FEATURE_NAMES)))
+    y = (X[:, 0] + X[:, 1] > 0).astype(int)
+    fitted = make_estimator("logistic").fit(X, y)
+    model_path = str(tmp_path / "model.pkl")
+    with open(model_path, "wb") as f:
+        pickle.dump(fitted, f)
+
+    export_linear(fitted, model_path)
+    served = load_model(model_path)
+    assert isinstance(served, LinearSoftmaxModel)
+    assert np.allclose(served.predict_proba(X), fitted.predict_proba(X), rtol=0, atol=1e-12)
+
+
+def test_async_prediction_log_writes_in_bulk(client, training_data, db: Session, monkeypatch):
+    """Test that async logging queues predictions and the writer inserts them in batches"""
+    teams, _ = training_data
+    assert client.post("/train", params={"wait": True}).status_code == 200
+    monkeypatch.setattr(settings, "prediction_log_mode", "async")
+    monkeypatch.setattr(settings, "prediction_log_batch_size", 4)
+    monkeypatch.setattr(settings, "prediction_log_flush_seconds", 0.05)
+    prediction_log.start(lambda: Session(bind=db.get_bind()))
+    try:
+        written, batches = prediction_log.written, prediction_log.batches
+        body = {"home_team_id": teams[0].id, "away_team_id": teams[1].id, "season": "2023-24"}
+        for _ in range(3):
+            assert client.post("/predict", json=body).status_code == 200
+        client.post("/predict/batch", json={"fixtures": [
+            {"home_team_id": teams[i].id, "away_team_id": teams[i + 1].id, "season": "2023-24"} for i in range(5)
+        ]})
+
+        prediction_log.flush()
+        assert prediction_log.written - written == 8
+        assert prediction_log.batches - batches >= 2
+        assert db.query(Prediction).count() == 8
+        assert client.get("/predict/log").json()["running"] is True
+    finally:
+        prediction_log.stop()
+
+
+def test_prediction_log_flushes_on_stop(db: Session, monkeypatch):
+    """Test that rows still queued when the writer stops are written"""
+    team = Team(name="Solo")
+    db.add(team)
+    db.commit()
+    monkeypatch.setattr(settings, "prediction_log_flush_seconds", 60)
+    monkeypatch.setattr(settings, "prediction_log_batch_size", 1000)
+
+    prediction_log.start(lambda: Session(bind=db.get_bind()))
+    prediction_log.enqueue([{
+        "home_team_id": team.id, "away_team_id": team.id, "season": "2023-24", "proba_home": 0.5,
+        "proba_draw": 0.3, "proba_away": 0.2, "explanation_json": {}, "created_at": datetime.utcnow()
+    } for _ in range(3)])
+    prediction_log.stop()
+    assert db.query(Prediction).count() == 3
+
+
+def test_prediction_log_drops_batch_when_queue_is_full(monkeypatch):
+    """Test that a batch that does not fit waits one timeout in total, then drops the rest"""
+    monkeypatch.setattr(settings, "prediction_log_max_queue", 10)
+    monkeypatch.setattr(settings, "prediction_log_put_timeout_seconds", 0.2)
+    writer = PredictionLogWriter()
+    # No writer thread: nothing leaves the queue
+    writer._queue = queue.Queue(maxsize=settings.prediction_log_max_queue)
+
+    start = time.monotonic()
+    writer.enqueue([{"row": i} for i in range(5000)])
+    assert time.monotonic() - start < 1
+    assert writer._queue.qsize() == 10
+    assert writer.dropped == 4990
+
+
+def test_simulate_season_position_probabilities(client, training_data, monkeypatch):
+    """Test that the season simulator returns consistent position distributions, reproducible by seed"""
+    teams, _ = training_data
+    assert client.post("/train", params={"wait": True}).status_code == 200
+    fixtures = [{"home_team_id": teams[i].id, "away_team_id": teams[(i + 3) % 10].id} for i in range(10)]
+    body = {"season": "2023-24", "fixtures": fixtures, "n_simulations": 2500, "seed": 7}
+
+    monkeypatch.setattr(settings, "simulation_chunk_size", 1000)
+    monkeypatch.setattr(settings, "simulation_workers", 1)
+    response = client.post("/simulate/season", json=body)
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["simulations"], data["chunks"], data["fixtures"]) == (2500, 3, 10)
+    assert data["simulations_per_second"] > 0
+
+    result = data["teams"]
+    assert len(result) == 10
+    assert sum(team["played"] for team in result) == 120
+    assert sum(team["title"] for team in result) == pytest.approx(1)
+    assert sum(team["top"] for team in result) == pytest.approx(4)
+    assert sum(team["relegation"] for team in result) == pytest.approx(3)
+    for team in result:
+        assert sum(team["positions"]) == pytest.approx(1)
+        assert team["points"] <= team["expected_points"] <= team["points"] + 6
+    expected = [team["expected_points"] for team in result]
+    assert expected == sorted(expected, reverse=True)
+
+    # Same seed, same result regardless of how many threads run the chunks
+    monkeypatch.setattr(settings, "simulation_workers", 3)
+    again = client.post("/simulate/season", json=body).json()
+    assert [(team["team_id"], team["positions"]) for team in again["teams"]] == \
+        [(team["team_id"], team["positions"]) for team in result]
+
+
+def test_simulate_season_certain_outcomes():
+    """Test the simulator on fixtures whose results are certain, with ties broken by goal difference"""
+    team_ids = np.array([1, 2, 3])
+    played = pd.DataFrame({"home_team_id": [1, 2], "away_team_id": [3, 3], "home_goals": [1, 3],
+                           "away_goals": [0, 0]})
+    table = season_table(team_ids, played)
+    assert table.points.tolist() == [3, 3, 0]
+    assert table.goal_difference.tolist() == [1, 3, -4]
+
+    fixtures = pd.DataFrame({"home_team_id": [3], "away_team_id": [1]})
+    result = simulate_season(table, fixtures, np.array([[0.0, 1.0, 0.0]]), n_simulations=500, seed=1)
+    # Team 1 draws to 4 points; team 2 (3 points) stays ahead of team 3 (1 point)
+    assert result.position_counts.tolist() == [[500, 0, 0], [0, 500, 0], [0, 0, 500]]
+    assert result.expected_points.tolist() == [4, 3, 1]
+
+    result = simulate_season(table, fixtures, np.array([[1.0, 0.0, 0.0]]), n_simulations=500, seed=1)
+    # All three teams finish on 3 points, ordered by current goal difference
+    assert result.position_counts.tolist() == [[0, 500, 0], [500, 0, 0], [0, 0, 500]]
+
+
+def test_simulate_season_breaks_exact_ties_at_random():
+    """Test that teams level on points, goal difference and goals scored split the positions evenly"""
+    team_ids = np.array([1, 2])
+    table = season_table(team_ids, pd.DataFrame(
+        {"home_team_id": [], "away_team_id": [], "home_goals": [], "away_goals": []}))
+    fixtures = pd.DataFrame({"home_team_id": [1], "away_team_id": [2]})
+
+    for seed in (1, 2):
+        result = simulate_season(table, fixtures, np.array([[0.0, 1.0, 0.0]]), n_simulations=2000, seed=seed)
+        first = result.position_counts[:, 0]
+        assert first.sum() == 2000
+        assert 850 < first[0] < 1150
+
+
+def test_simulate_season_unknown_team(client, training_data):
+    """Test that fixtures with unknown teams are rejected"""
+    teams, _ = training_data
+    assert client.post("/train", params={"wait": True}).status_code == 200
+    response = client.post("/simulate/season", json={
+        "season": "2023-24", "fixtures": [{"home_team_id": teams[0].id, "away_team_id": 99999}]
+    })
+    assert response.status_code == 404
+
+
+def test_get_unknown_training_job(client):
+    """Test that polling or cancelling an unknown job returns 404"""
+    assert client.get("/train/jobs/missing").status_code == 404
+    assert client.post("/train/jobs/missing/cancel").status_code == 404
+
+
 def test_train_model_insufficient_data(client, db: Session):
     """Test POST /train with insufficient data"""
     # Create only a few matches
@@ -80,7 +731,7 @@ def test_train_model_insufficient_data(client, db: Session):
         db.add(match)
     db.commit()
 
-    response = client.post("/train")
+    response = client.post("/train", params={"wait": True})
     assert response.status_code == 400
 
 
@@ -89,7 +740,7 @@ def test_predict_match(client, training_data, db: Session):
     teams, _ = training_data
 
     # First train a model
-    train_response = client.post("/train")
+    train_response = client.post("/train", params={"wait": True})
     assert train_response.status_code == 200
 
     # Then make a prediction
@@ -141,7 +792,7 @@ def test_predict_without_model(client, training_data):
 def test_predict_invalid_teams(client, training_data):
     """Test POST /predict with invalid team IDs"""
     # Train model first
-    client.post("/train")
+    client.post("/train", params={"wait": True})
 
     response = client.post(
         "/predict",
@@ -154,3 +805,25 @@ def test_predict_invalid_teams(client, training_data):
 
     assert response.status_code == 404
 
+
+@pytest.mark.parametrize("feature_backend", ["index", "sql", "python"])
+def test_predict_feature_backends_agree(client, training_data, db: Session, feature_backend, monkeypatch):
+    """Test that every feature backend yields the same prediction"""
+    teams, _ = training_data
+    assert client.post("/train", params={"wait": True}).status_code == 200
+
+    body = {"home_team_id": teams[0].id, "away_team_id": teams[1].id, "season": "2023-24"}
+    expected_features = ml.compute_features(teams[0].id, teams[1].id, date.today(), db)
+    monkeypatch.setattr(settings, "feature_backend", "python")
+    expected = client.post("/predict", json=body).json()
+
+    monkeypatch.setattr(settings, "feature_backend", feature_backend)
+    np.testing.assert_array_equal(ml.get_features(teams[0].id, teams[1].id, date.today(), db), expected_features)
+
+    # Neither the result cache nor the precomputed pair matrix may answer for the backend
+    ml.prediction_cache.clear()
+    pair_matrix.reset()
+    response = client.post("/predict", json=body)
+    assert response.status_code == 200
+    assert response.json()["explanation"]["feature_contributions"] == expected["explanation"]["feature_contributions"]
+    assert ml.prediction_cache.stats()["misses"] == 1
@@ -64,7 +64,7 @@ echo ""
 
 # Step 5: Ingest data
 echo "Step 5: Ingesting sample data..."
-INGEST_RESPONSE=$(curl -s -X POST "http://localhost:8000/ingest")
+INGEST_RESPONSE=$(curl -s -X POST "http://localhost:8000/ingest?wait=true")
 echo "Response: $INGEST_RESPONSE"
 if echo "$INGEST_RESPONSE" | grep -q "matches_created\|matches_skipped"; then
     echo -e "${GREEN}✓${NC} Data ingestion successful"
@@ -75,7 +75,7 @@ echo ""
 
 # Step 6: Train model
 echo "Step 6: Training ML model..."
-TRAIN_RESPONSE=$(curl -s -X POST "http://localhost:8000/train")
+TRAIN_RESPONSE=$(curl -s -X POST "http://localhost:8000/train?wait=true")
 echo "Response: $TRAIN_RESPONSE"
 if echo "$TRAIN_RESPONSE" | grep -q "model_run_id\|accuracy"; then
     echo -e "${GREEN}✓${NC} Model training successful"